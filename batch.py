@@ -0,0 +1,297 @@
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Headless: render with Agg, never touch Qt
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import animation
+from matplotlib import pyplot as plt
+
+from preprocessing import preprocessing
+from storage import atomic_write
+from visualizations import binning, bubble_chart, map, paths, rollups, spatial, stream_graph, constants
+
+FIGURE_SIZE = (15.0, 7.0)
+PROGRESS_EVERY = 25
+
+# Datasets and precomputed structures of this process, loaded once by load() and reused for every
+# job. With the fork start method the workers inherit them from the parent (copy on write), so
+# the geometry is parsed once and shared instead of once per worker.
+_state = None
+_load_args = None
+
+
+def load(cfile: str, vfile: str, cache_dir: str = None, rebuild_cache: bool = False,
+         parse_workers: int = None) -> dict:
+    global _state
+    if _state is None:
+        community_df, hesitancy_df, _ = preprocessing.process(cfile, vfile, None, cache_dir, rebuild_cache,
+                                                              parse_workers)
+        county_paths = paths.PathLevels(hesitancy_df, cache_dir=cache_dir)
+        county_paths.dissolve()
+        _state = {
+            'community_df': community_df,
+            'hesitancy_df': hesitancy_df,
+            'date_frames': preprocessing.split_dates(community_df),
+            'stream_cube': stream_graph.build_cube(community_df),
+            'state_rollups': rollups.build_rollups(community_df, hesitancy_df),
+            'county_paths': county_paths,
+            'county_index': spatial.CountyIndex(hesitancy_df),
+            'map_bins': binning.BinCache(),
+            'dates': {}
+        }
+    return _state
+
+
+def date_data(state: dict, date: str):
+    # Joined frame of a report date, built once per process
+    if date not in state['dates']:
+        state['dates'][date] = preprocessing.process_date(state['community_df'], state['hesitancy_df'], date,
+                                                          state['date_frames'])
+    return state['dates'][date]
+
+
+def slug(text: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+
+def build_jobs(args) -> list:
+    # One job per image: (view, settings, output path relative to the output directory).
+    # Jobs are grouped by date so a worker reuses the joined frame of a date.
+    jobs = []
+    for date in args.dates:
+        if 'bubble' in args.views:
+            for size_attribute in constants.SIZE_ATTRIBUTES:
+                jobs.append(('bubble', {'date': date, 'size_attribute': size_attribute},
+                             os.path.join('bubble', date, f'{slug(size_attribute)}.png')))
+
+        if 'map' in args.views:
+            for attribute in args.attributes:
+                for state_name in args.states:
+                    if state_name == 'Country View':
+                        settings = [('None', view) for view in ['County', 'State']]
+                    else:
+                        settings = [(secondary, 'County') for secondary in args.secondary]
+                    for secondary, view in settings:
+                        name = f'{slug(attribute)}_{slug(secondary)}_{slug(view)}.png'
+                        jobs.append(('map', {'date': date, 'attribute': attribute, 'state_name': state_name,
+                                             'secondary': secondary, 'view': view},
+                                     os.path.join('map', date, slug(state_name), name)))
+
+    # The stream graph covers every report date
+    if 'stream' in args.views:
+        for attribute in constants.STREAM_ATTRIBUTES:
+            jobs.append(('stream', {'attribute': attribute},
+                         os.path.join('stream', f'{slug(attribute)}.png')))
+    return jobs
+
+
+def render(job: tuple, out_dir: str, thresholds: tuple, dpi: int) -> str:
+    kind, settings, output = job
+    state = load(*_load_args)
+
+    figure = plt.figure(figsize=FIGURE_SIZE, dpi=dpi)
+    ax = figure.add_subplot(111)
+    try:
+        if kind == 'bubble':
+            bubble_chart.plot(date_data(state, settings['date']), ax, settings['size_attribute'], *thresholds)
+        elif kind == 'map':
+            map.plot(date_data(state, settings['date']), ax, settings['state_name'], settings['attribute'],
+                     settings['secondary'], settings['view'], state['county_paths'], state['county_index'],
+                     state['map_bins'], state['state_rollups'])
+        else:
+            stream_graph.plot(state['community_df'], settings['attribute'], ax, state['stream_cube'])
+
+        path = os.path.join(out_dir, output)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as temporary:
+            figure.savefig(temporary, format='png')
+    finally:
+        plt.close(figure)
+    return output
+
+
+def select_dates(args, state: dict) -> bool:
+    # --dates defaults to every report date of the data, dates the data does not have are an error
+    dates = sorted(state['date_frames'])
+    unknown = [date for date in args.dates or [] if date not in state['date_frames']]
+    if unknown:
+        print(f'Report dates {", ".join(unknown)} are not in the data. Report dates: {", ".join(dates)}')
+        return False
+    args.dates = args.dates or dates
+    return True
+
+
+def init_worker(load_args: tuple) -> None:
+    global _load_args
+    _load_args = load_args
+    load(*load_args)
+
+
+def animate(args) -> int:
+    # Play the first of --views (bubble or map) over --dates into a GIF or MP4 (by the file
+    # extension). The view is drawn once and then updated in place for every date, like the
+    # window's playback, with the first of --attributes, --states and --secondary.
+    view = args.views[0]
+    if view == 'stream':
+        print('The stream graph covers every report date already, animate the bubble or map view.')
+        return 1
+
+    if args.animate.lower().endswith('.gif'):
+        writer = animation.PillowWriter(fps=args.fps)
+    elif animation.FFMpegWriter.isAvailable():
+        writer = animation.FFMpegWriter(fps=args.fps)
+    else:
+        print('Writing MP4 needs ffmpeg on the PATH, write a .gif instead.')
+        return 1
+
+    try:
+        state = load(args.cfile, args.vfile, args.cache_dir, args.rebuild_cache, args.parse_workers)
+    except FileNotFoundError:
+        print("Community or vaccine hesitancy dataset file not found. Aborting animation.")
+        return 1
+    if not select_dates(args, state):
+        return 1
+
+    thresholds = (args.svi_min, args.svi_max, args.population)
+    attribute, state_name, secondary = args.attributes[0], args.states[0], args.secondary[0]
+
+    figure = plt.figure(figsize=FIGURE_SIZE, dpi=args.dpi)
+    ax = figure.add_subplot(111)
+    date_label = figure.text(0.01, 0.01, '', size=12)
+    artists = None
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.animate)), exist_ok=True)
+    start = time.perf_counter()
+    with writer.saving(figure, args.animate, args.dpi):
+        for date in args.dates:
+            # Frames are not kept: one joined frame at a time
+            data = preprocessing.process_date(state['community_df'], state['hesitancy_df'], date,
+                                              state['date_frames'])
+            if view == 'bubble':
+                filtered = bubble_chart.filter_data(data, args.size_attribute, *thresholds)
+                if artists is None:
+                    artists = bubble_chart.draw(filtered, ax, args.size_attribute)
+                else:
+                    bubble_chart.update(artists, filtered, args.size_attribute)
+            elif artists is None:
+                artists = map.plot(data, ax, state_name, attribute, secondary, 'County',
+                                   state['county_paths'], state['county_index'], state['map_bins'],
+                                   state['state_rollups'])
+            else:
+                map.update(artists, data, attribute, secondary, 'County', state['map_bins'], state['state_rollups'])
+
+            date_label.set_text(f'Report date: {date}')
+            writer.grab_frame()
+    plt.close(figure)
+
+    elapsed = time.perf_counter() - start
+    print(f'Wrote {args.animate}: {len(args.dates)} frames in {elapsed:.1f}s')
+    return 0
+
+
+def run(args) -> int:
+    global _load_args
+
+    # Load in the parent first: the report dates to render come from the data, forked workers
+    # share the parsed geometry, spawned workers at least find the dataset cache filled (and must
+    # not all rebuild it)
+    start = time.perf_counter()
+    try:
+        state = load(args.cfile, args.vfile, args.cache_dir, args.rebuild_cache, args.parse_workers)
+    except FileNotFoundError:
+        print("Community or vaccine hesitancy dataset file not found. Aborting batch render.")
+        return 1
+    print(f'Data loaded in {time.perf_counter() - start:.1f}s')
+    if not select_dates(args, state):
+        return 1
+
+    jobs = build_jobs(args)
+    # Resume: images from an earlier (interrupted) run are kept
+    pending = jobs if args.force else [job for job in jobs
+                                       if not os.path.exists(os.path.join(args.out_dir, job[2]))]
+    print(f'{len(jobs)} images, {len(jobs) - len(pending)} already rendered, {len(pending)} to render')
+    if not pending:
+        return 0
+
+    thresholds = (args.svi_min, args.svi_max, args.population)
+
+    # Render workers that have to load the data themselves (spawned) parse it serially, they
+    # already run side by side
+    _load_args = (args.cfile, args.vfile, args.cache_dir, False, 1)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    start = time.perf_counter()
+    done = failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context,
+                             initializer=init_worker, initargs=(_load_args,)) as executor:
+        futures = {executor.submit(render, job, args.out_dir, thresholds, args.dpi): job for job in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            except Exception as error:
+                failed += 1
+                print(f'Failed to render {futures[future][2]}: {error!r}')
+
+            if (done + failed) % PROGRESS_EVERY == 0 or done + failed == len(pending):
+                elapsed = time.perf_counter() - start
+                print(f'{done + failed}/{len(pending)} images, {done / elapsed:.2f} images/sec')
+
+    elapsed = time.perf_counter() - start
+    print(f'Rendered {done} images in {elapsed:.1f}s ({done / elapsed:.2f} images/sec), {failed} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CS 43900 Final Project: headless batch render')
+    parser.add_argument('-c', action='store', required=True, dest='cfile')
+    parser.add_argument('-v', action='store', required=True, dest='vfile')
+    parser.add_argument('-o', action='store', default='renders', dest='out_dir',
+                        help='output directory (default: renders)')
+    parser.add_argument('--views', nargs='+', choices=['bubble', 'map', 'stream'],
+                        default=['bubble', 'map', 'stream'], help='views to render (default: all)')
+    parser.add_argument('--dates', nargs='+', default=None, metavar='DATE',
+                        help='report dates to render (default: every report date of the data)')
+    parser.add_argument('--attributes', nargs='+', choices=list(constants.MAP_ATTRIBUTES),
+                        default=list(constants.MAP_ATTRIBUTES), metavar='ATTRIBUTE',
+                        help='map attributes to render (default: all)')
+    parser.add_argument('--states', nargs='+', choices=constants.US_STATES, default=constants.US_STATES,
+                        metavar='STATE', help='map states to render, including "Country View" (default: all)')
+    parser.add_argument('--secondary', nargs='+', choices=list(constants.SECONDARY_MAP_ATTRIBUTES),
+                        default=['None'], metavar='ATTRIBUTE',
+                        help='secondary (point size) attributes of the state maps (default: None)')
+    parser.add_argument('--svi-min', type=float, default=0.1, dest='svi_min')
+    parser.add_argument('--svi-max', type=float, default=0.9, dest='svi_max')
+    parser.add_argument('--population', type=float, default=5000, dest='population')
+    parser.add_argument('--dpi', type=int, default=150)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of render processes (default: one per CPU)')
+    parser.add_argument('--parse-workers', type=int, default=None, dest='parse_workers',
+                        help='processes parsing the county geometry, 1 parses serially (default: one per CPU)')
+    parser.add_argument('--force', action='store_true',
+                        help='render every image again instead of resuming')
+    parser.add_argument('--animate', action='store', default=None, metavar='FILE',
+                        help='instead of images, write the first of --views over --dates to this .gif or .mp4')
+    parser.add_argument('--fps', type=int, default=2, help='frames (report dates) per second of --animate')
+    parser.add_argument('--size-attribute', choices=constants.SIZE_ATTRIBUTES, default='SVI',
+                        dest='size_attribute', help='bubble size attribute of --animate (default: SVI)')
+    parser.add_argument('--cache-dir', action='store', default='.cache', dest='cache_dir',
+                        help='directory for the preprocessed dataset cache (default: .cache)')
+    parser.add_argument('--rebuild-cache', action='store_true', dest='rebuild_cache',
+                        help='ignore any cached datasets and rebuild the cache from the CSV files')
+    parser.add_argument('--no-cache', action='store_true', dest='no_cache',
+                        help='bypass the preprocessed dataset cache entirely')
+
+    namespace = parser.parse_args(sys.argv[1:])
+    if namespace.no_cache:
+        namespace.cache_dir = None
+    sys.exit(run(namespace) if namespace.animate is None else animate(namespace))
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Headless: render with Agg, never touch Qt
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+import numpy as np
+import pandas as pd
+
+from preprocessing import preprocessing
+from visualizations import bubble_chart, map, paths, spatial, stream_graph, constants
+from . import synthetic
+
+FIGURE_SIZE = (15.0, 7.0)
+DPI = 100
+
+
+def measure(function, repeat: int) -> dict:
+    # Wall time of every run, then one more run under tracemalloc for the peak of memory
+    # allocated during the call (numpy and pandas buffers included)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'runs': repeat,
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+        'peak_mb': peak / 2 ** 20
+    }
+
+
+def on_figure(draw, render: bool):
+    # Run a view function on a fresh figure (and render it with Agg when render is set)
+    def run():
+        figure = plt.figure(figsize=FIGURE_SIZE, dpi=DPI)
+        try:
+            draw(figure.add_subplot(111))
+            if render:
+                figure.canvas.draw()
+        finally:
+            plt.close(figure)
+    return run
+
+
+def benchmarks(community_filename: str, hesitancy_filename: str, state_name: str) -> dict:
+    # Name -> function to measure. Data the functions under test take as input is prepared
+    # once here, like the app does at startup.
+    date = constants.REPORT_DATES[0]
+    community_df, hesitancy_df, date_data = preprocessing.process(community_filename, hesitancy_filename, date)
+    date_frames = preprocessing.split_dates(community_df)
+    stream_cube = stream_graph.build_cube(community_df)
+    county_paths = paths.PathLevels(hesitancy_df)
+    county_index = spatial.CountyIndex(hesitancy_df)
+    map_data = date_data.reset_index()
+
+    views = {
+        'bubble_chart.plot': lambda ax: bubble_chart.plot(date_data, ax, 'SVI', 0.1, 0.9, 5000),
+        'map.country_view': lambda ax: map.country_view(map_data, ax, 'Cases Per 100k', 'County',
+                                                        county_paths, county_index),
+        'map.state_view': lambda ax: map.state_view(map_data, ax, state_name, 'Cases Per 100k', 'Cases Per 100k',
+                                                    county_paths, county_index),
+        'stream_graph.plot': lambda ax: stream_graph.plot(community_df, 'Cases Per 100k', ax, stream_cube)
+    }
+
+    cases = {
+        'preprocessing.process': lambda: preprocessing.process(community_filename, hesitancy_filename, date),
+        'preprocessing.process_date': lambda: preprocessing.process_date(community_df, hesitancy_df, date),
+        'preprocessing.process_date[date_frames]': lambda: preprocessing.process_date(community_df, hesitancy_df,
+                                                                                      date, date_frames)
+    }
+    for name, draw in views.items():
+        cases[name] = on_figure(draw, render=False)
+        cases[f'{name}[render]'] = on_figure(draw, render=True)
+    return cases
+
+
+def compare(results: dict, baseline_filename: str) -> None:
+    # Print the median time and peak memory of every benchmark relative to an earlier results file
+    with open(baseline_filename) as file:
+        baseline = {result['name']: result for result in json.load(file)['results']}
+
+    print(f'\nCompared to {baseline_filename}:')
+    for result in results['results']:
+        if result['name'] not in baseline:
+            continue
+        before = baseline[result['name']]
+        print(f'{result["name"]:45} time x{result["median_s"] / before["median_s"]:.2f}'
+              f'  memory x{result["peak_mb"] / max(before["peak_mb"], 1e-9):.2f}')
+
+
+def run(args) -> dict:
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='cs439-bench-')
+    community_filename = os.path.join(data_dir, 'community.csv')
+    hesitancy_filename = os.path.join(data_dir, 'hesitancy.csv')
+    if not (os.path.exists(community_filename) and os.path.exists(hesitancy_filename)):
+        print(f'Generating {args.counties} counties x {args.dates} report dates in {data_dir}')
+        synthetic.generate(data_dir, args.counties, args.dates, seed=args.seed)
+
+    cases = benchmarks(community_filename, hesitancy_filename, args.state)
+    results = []
+    for name, function in cases.items():
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        result = {'name': name, **measure(function, args.repeat)}
+        results.append(result)
+        print(f'{name:45} median {result["median_s"] * 1000:9.2f} ms  min {result["min_s"] * 1000:9.2f} ms'
+              f'  peak {result["peak_mb"]:8.1f} MB')
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'matplotlib': matplotlib.__version__},
+            'counties': args.counties,
+            'dates': args.dates,
+            'state': args.state,
+            'repeat': args.repeat,
+            'data_dir': data_dir
+        },
+        'results': results
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CS 43900 Final Project: headless benchmarks on synthetic data')
+    parser.add_argument('-o', action='store', default='bench_results.json', dest='out_file',
+                        help='results file (default: bench_results.json)')
+    parser.add_argument('--data-dir', action='store', default=None, dest='data_dir',
+                        help='directory with community.csv/hesitancy.csv, generated there if missing '
+                             '(default: a new temporary directory)')
+    parser.add_argument('--counties', type=int, default=3000)
+    parser.add_argument('--dates', type=int, default=35)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--state', choices=constants.US_STATES[1:], default='Indiana',
+                        help='state of the state view benchmark (default: Indiana)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--only', nargs='+', default=None, metavar='NAME',
+                        help='only run benchmarks whose name contains one of these')
+    parser.add_argument('--compare', action='store', default=None, dest='baseline',
+                        help='earlier results file to compare against')
+
+    namespace = parser.parse_args(sys.argv[1:])
+    results = run(namespace)
+    with open(namespace.out_file, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Wrote {namespace.out_file}')
+
+    if namespace.baseline is not None:
+        compare(results, namespace.baseline)
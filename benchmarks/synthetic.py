@@ -0,0 +1,151 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from visualizations import constants
+
+# Extent of the generated map, roughly the contiguous US like the Country View
+X_RANGE = (-124.0, -67.0)
+Y_RANGE = (25.0, 49.0)
+
+COMMUNITY_LEVELS = np.array(['Low', 'Medium', 'High'])
+SVI_CATEGORIES = np.array(['Very Low Vulnerability', 'Low Vulnerability', 'Moderate Vulnerability',
+                           'High Vulnerability', 'Very High Vulnerability'])
+
+
+def report_dates(n_dates: int) -> list:
+    # The app's report dates first, then further weekly reports for longer ranges
+    dates = pd.date_range(constants.REPORT_DATES[0], periods=max(n_dates, 1), freq='7D')
+    return [date.strftime('%Y-%m-%d') for date in dates][:n_dates]
+
+
+def grid(n: int, x_min: float, y_min: float, width: float, height: float) -> (np.ndarray, np.ndarray, float, float):
+    # Lay n cells out on a near square grid over the rectangle, returns the lower left corners and cell size
+    columns = int(np.ceil(np.sqrt(n * width / height)))
+    rows = int(np.ceil(n / columns))
+    cell_width, cell_height = width / columns, height / rows
+    cells = np.arange(n)
+    return x_min + (cells % columns) * cell_width, y_min + (cells // columns) * cell_height, cell_width, cell_height
+
+
+def polygon_wkt(x: float, y: float, width: float, height: float, vertices: int) -> str:
+    # Rectangle with wavy top and bottom edges, closed ring, as a single part MULTIPOLYGON
+    xs = np.linspace(x, x + width, vertices)
+    wave = 0.05 * min(width, height) * np.sin(np.linspace(0, 4 * np.pi, vertices))
+    bottom = [f'{px:.5f} {y + dy:.5f}' for px, dy in zip(xs, wave)]
+    top = [f'{px:.5f} {y + height + dy:.5f}' for px, dy in zip(xs[::-1], wave[::-1])]
+    return 'MULTIPOLYGON (((' + ', '.join(bottom + top + [bottom[0]]) + ')))'
+
+
+def generate(out_dir: str, counties: int = 3000, dates: int = 35, vertices: int = 40,
+             missing: float = 0.01, seed: int = 0) -> (str, str):
+    # Write community levels and vaccine hesitancy CSVs with the CDC schema (including the columns
+    # the app does not use). Counties are spread evenly over the states, every state is a rectangle
+    # of the map and its counties a grid inside it. Returns the two file paths.
+    rng = np.random.default_rng(seed)
+    states = constants.US_STATES[1:]
+    os.makedirs(out_dir, exist_ok=True)
+
+    state_x, state_y, state_width, state_height = grid(len(states), X_RANGE[0], Y_RANGE[0],
+                                                       X_RANGE[1] - X_RANGE[0], Y_RANGE[1] - Y_RANGE[0])
+    county_state = np.arange(counties) % len(states)
+    # FIPS: two digit state code followed by a three digit county number
+    county_number = np.arange(counties) // len(states) + 1
+    fips = (county_state + 1) * 1000 + county_number
+
+    county_boundaries, points, state_boundaries = [], [], []
+    for state in range(len(states)):
+        members = np.flatnonzero(county_state == state)
+        # Leave a margin between states so state boundaries do not touch
+        x0, y0 = state_x[state] + 0.05 * state_width, state_y[state] + 0.05 * state_height
+        width, height = 0.9 * state_width, 0.9 * state_height
+        cell_x, cell_y, cell_width, cell_height = grid(len(members), x0, y0, width, height)
+
+        state_wkt = polygon_wkt(x0, y0, width, height, 2)
+        for x, y in zip(cell_x, cell_y):
+            county_boundaries.append(polygon_wkt(x, y, cell_width, cell_height, vertices))
+            points.append(f'POINT ({x + cell_width / 2:.5f} {y + cell_height / 2:.5f})')
+            state_boundaries.append(state_wkt)
+
+    # Generated per state above, restore the county order
+    order = np.argsort(np.concatenate([np.flatnonzero(county_state == state) for state in range(len(states))]))
+    county_boundaries = np.array(county_boundaries, dtype=object)[order]
+    points = np.array(points, dtype=object)[order]
+    state_boundaries = np.array(state_boundaries, dtype=object)[order]
+
+    state_names = np.array(states, dtype=object)[county_state]
+    county_names = np.array([f'County {number}' for number in county_number], dtype=object)
+
+    hesitant = rng.uniform(0.05, 0.3, counties)
+    hesitancy_df = pd.DataFrame({
+        'FIPS Code': fips,
+        'County Name': county_names + ', ' + state_names,
+        'State': np.char.upper(state_names.astype(str)),
+        'Estimated hesitant': hesitant,
+        'Estimated hesitant or unsure': hesitant + rng.uniform(0, 0.1, counties),
+        'Estimated strongly hesitant': rng.uniform(0.02, 0.2, counties),
+        'Social Vulnerability Index (SVI)': rng.uniform(0, 1, counties),
+        'SVI Category': rng.choice(SVI_CATEGORIES, counties),
+        'CVAC level of concern for vaccination rollout': rng.uniform(0, 1, counties),
+        'CVAC Level Of Concern': 'Moderate Concern',
+        'Percent adults fully vaccinated against COVID-19 (as of 6/10/21)': rng.uniform(0.2, 0.8, counties),
+        'Percent Hispanic': rng.uniform(0, 0.5, counties),
+        'Percent non-Hispanic American Indian/Alaska Native': rng.uniform(0, 0.1, counties),
+        'Percent non-Hispanic Asian': rng.uniform(0, 0.1, counties),
+        'Percent non-Hispanic Black': rng.uniform(0, 0.4, counties),
+        'Percent non-Hispanic Native Hawaiian/Pacific Islander': rng.uniform(0, 0.01, counties),
+        'Percent non-Hispanic White': rng.uniform(0.2, 0.9, counties),
+        'Geographical Point': points,
+        'State Code': np.char.upper(np.array([state[:2] for state in states])[county_state]),
+        'County Boundary': county_boundaries,
+        'State Boundary': state_boundaries
+    })
+
+    # Like the CDC files, a few counties miss their geometry
+    for column in ['County Boundary', 'Geographical Point']:
+        hesitancy_df.loc[rng.random(counties) < missing / 2, column] = np.nan
+
+    report = report_dates(dates)
+    rows = counties * len(report)
+    cases = rng.gamma(2, 80, rows)
+    community_df = pd.DataFrame({
+        'county': np.tile(county_names, len(report)),
+        'county_fips': np.tile(fips, len(report)),
+        'state': np.tile(state_names, len(report)),
+        'county_population': np.tile(rng.integers(1000, 1_000_000, counties), len(report)),
+        'health_service_area_number': np.tile(county_state + 1, len(report)),
+        'health_service_area': np.tile(state_names, len(report)),
+        'health_service_area_population': 1_000_000,
+        'covid_inpatient_bed_utilization': rng.uniform(0, 10, rows),
+        'covid_hospital_admissions_per_100k': rng.gamma(2, 5, rows),
+        'covid_cases_per_100k': cases,
+        'covid-19_community_level': COMMUNITY_LEVELS[np.digitize(cases, [100, 200])],
+        'date_updated': np.repeat(report, counties)
+    })
+    for column in ['covid_hospital_admissions_per_100k', 'covid_cases_per_100k']:
+        community_df.loc[rng.random(rows) < missing, column] = np.nan
+
+    community_filename = os.path.join(out_dir, 'community.csv')
+    hesitancy_filename = os.path.join(out_dir, 'hesitancy.csv')
+    community_df.to_csv(community_filename, index=False)
+    hesitancy_df.to_csv(hesitancy_filename, index=False)
+    return community_filename, hesitancy_filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic CDC community levels and vaccine hesitancy CSVs')
+    parser.add_argument('-o', action='store', default='synthetic', dest='out_dir',
+                        help='output directory (default: synthetic)')
+    parser.add_argument('--counties', type=int, default=3000)
+    parser.add_argument('--dates', type=int, default=35, help='number of weekly report dates')
+    parser.add_argument('--vertices', type=int, default=40, help='vertices per county boundary edge')
+    parser.add_argument('--missing', type=float, default=0.01, help='fraction of missing values')
+    parser.add_argument('--seed', type=int, default=0)
+
+    namespace = parser.parse_args(sys.argv[1:])
+    for filename in generate(namespace.out_dir, namespace.counties, namespace.dates, namespace.vertices,
+                             namespace.missing, namespace.seed):
+        print(f'Wrote {filename}')
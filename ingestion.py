@@ -0,0 +1,142 @@
+import os
+import traceback
+from functools import partial
+
+from PyQt5 import QtCore
+
+import profiling
+from scheduler import Worker
+
+# Changes to a watched file are read once it has not changed for this long, so a report that is
+# still being written is read once instead of for every write
+SETTLE_MS = 1000
+
+
+class ReportIngester(QtCore.QObject):
+    # Picks up weekly community level reports published while the window is open: rows appended
+    # to a watched file or a new file. Only the rows after the last read of a file are read, and
+    # only the reports of a county and date not loaded yet are processed: the date index, stream
+    # cube, rollups, county history and map bins are extended for their dates. A date can arrive
+    # over several reads, its reports are merged and the date is rolled up again. Files are read
+    # one at a time on a worker thread, the updated datasets are delivered on the Qt main thread
+    # through the ingested signal as a dictionary.
+    ingested = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(ReportIngester, self).__init__(parent)
+
+        # Datasets the next report is added to and the position (preprocessing.read_position) of
+        # the last read of every file, None to read it from the start. Once started, only the
+        # worker thread changes them.
+        self.datasets = None
+        self.positions = {}
+
+        self.worker = Worker(self)
+
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.file_changed)
+        self.timers = {}
+
+    def start(self, datasets: dict, files: dict):
+        # Ingest on top of the loaded datasets (community_df, hesitancy_df, date_frames, database,
+        # stream_cube, state_rollups, county_history, map_bins). files maps every file to watch to
+        # the position read up to already.
+        self.datasets = dict(datasets)
+        for filename, position in files.items():
+            self.watch(filename, position)
+
+    def watch(self, filename: str, position: tuple = None):
+        self.positions[filename] = position
+        self.watcher.addPath(filename)
+        # The file may have new reports already
+        self.ingest(filename)
+
+    def file_changed(self, filename: str):
+        # Editors and downloads that replace the file drop it from the watcher, watch it again
+        if filename not in self.watcher.files() and os.path.exists(filename):
+            self.watcher.addPath(filename)
+
+        if filename not in self.timers:
+            timer = QtCore.QTimer(self)
+            timer.setSingleShot(True)
+            timer.setInterval(SETTLE_MS)
+            timer.timeout.connect(lambda: self.ingest(filename))
+            self.timers[filename] = timer
+        self.timers[filename].start()
+
+    def ingest(self, filename: str):
+        if self.datasets is not None:
+            self.worker.start(partial(self.ingest_file, filename), on_error=partial(self.ingest_failed, filename))
+
+    def ingest_failed(self, filename: str, error: Exception):
+        if isinstance(error, FileNotFoundError):
+            print(f'Community level report file {filename} not found.')
+        else:
+            traceback.print_exception(error)
+
+    def ingest_file(self, filename: str):
+        from preprocessing import preprocessing
+
+        datasets = self.datasets
+        database = datasets.get('database')
+        # The position only moves on once the rows are ingested, the rows of a failed ingest are
+        # read again. In the database they are inserted uncommitted and rolled back on failure.
+        new_df, position = preprocessing.read_new_reports(filename, self.positions.get(filename))
+        try:
+            with profiling.span('ingestion.extend', rows=len(new_df)):
+                update = self.extend(datasets, new_df, filename)
+        except Exception:
+            if database is not None:
+                database.rollback()
+            raise
+        if database is not None:
+            database.commit()
+        self.positions[filename] = position
+        if update is None:
+            return
+
+        self.datasets = {**datasets, 'community_df': update['community_df'], 'date_frames': update['date_frames'],
+                         'stream_cube': update['stream_cube'], 'state_rollups': update['state_rollups'],
+                         'county_history': update['county_history']}
+        if update['dates']:
+            print(f'Added report dates {", ".join(update["dates"])} from {filename}')
+        if update['updated']:
+            print(f'Added reports of the report dates {", ".join(update["updated"])} from {filename}')
+        self.ingested.emit(update)
+
+    def extend(self, datasets: dict, new_df, filename: str):
+        # The datasets with the rows of new_df added, None if all of them are loaded already
+        import pandas as pd
+
+        from preprocessing import preprocessing
+        from visualizations import history, map, rollups, stream_graph
+
+        database = datasets.get('database')
+        known_dates = database.dates() if database is not None else list(datasets['date_frames'])
+        if database is not None:
+            # The reports go into the database, there are no frames in memory to extend
+            community_df, date_frames = None, None
+            new_reports = database.append(new_df, filename, commit=False)
+        else:
+            community_df, date_frames, new_reports = preprocessing.append_reports(datasets['community_df'],
+                                                                                  datasets['date_frames'], new_df)
+        if new_reports.empty:
+            return None
+        # Dates new to the datasets, and dates that were loaded in part and got more reports
+        dates = sorted(set(new_reports['date_updated'].dropna()) - set(known_dates))
+        updated = sorted(set(new_reports['date_updated'].dropna()).intersection(known_dates))
+
+        stream_cube = stream_graph.extend_cube(datasets['stream_cube'], community_df, new_reports, database)
+        date_reports = new_reports if database is not None else pd.concat(
+            [date_frames[date] for date in dates + updated])
+        state_rollups = rollups.extend_rollups(datasets['state_rollups'], date_reports, datasets['hesitancy_df'],
+                                               database)
+        county_history = history.extend_history(datasets['county_history'], new_reports)
+        # The bins of the updated dates are dropped on the main thread, which stops using their
+        # earlier reports then
+        for date in dates:
+            map.warm_bins(preprocessing.process_date(community_df, datasets['hesitancy_df'], date, date_frames,
+                                                     database), datasets['map_bins'], state_rollups)
+
+        return {'community_df': community_df, 'date_frames': date_frames, 'stream_cube': stream_cube,
+                'state_rollups': state_rollups, 'county_history': county_history, 'dates': dates, 'updated': updated}
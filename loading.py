@@ -0,0 +1,125 @@
+import traceback
+
+from PyQt5 import QtCore
+
+import profiling
+from scheduler import Worker
+
+# Loading stages, reported through DataLoader.progress as (stage, message)
+STAGES = ['Reading datasets', 'Parsing county geometry', 'Indexing county geometry', 'Ready']
+
+
+class _LoadSignals(QtCore.QObject):
+    progress = QtCore.pyqtSignal(int, str)
+    tables = QtCore.pyqtSignal(object)
+    geometry = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+
+class _LoadJob:
+
+    def __init__(self, cfile: str, vfile: str, date: str, cache_dir: str, rebuild_cache: bool,
+                 parse_workers: int, database: str, signals: _LoadSignals):
+        self.cfile = cfile
+        self.vfile = vfile
+        self.date = date
+        self.cache_dir = cache_dir
+        self.rebuild_cache = rebuild_cache
+        self.parse_workers = parse_workers
+        self.database = database
+        self.signals = signals
+
+    def failed(self, error: Exception):
+        if isinstance(error, FileNotFoundError):
+            self.signals.failed.emit('Community or vaccine hesitancy dataset file not found.')
+        else:
+            traceback.print_exception(error)
+            self.signals.failed.emit(f'Loading the datasets failed: {error!r}')
+
+    def load(self):
+        # Heavy modules are imported here, on the loader thread, the first time they are needed
+        from preprocessing import cache, preprocessing
+
+        # Stage 1: the tables, enough for the bubble chart and the stream graph
+        self.signals.progress.emit(0, STAGES[0])
+        with profiling.span('startup.tables'):
+            # Reports appended to the community file after this point are picked up by ingestion.ReportIngester
+            community_position = preprocessing.read_position(self.cfile)
+
+            # With a database the community reports are read from the CSV files (or the cache) only
+            # to (re)build it, the window queries them from the database and never holds them
+            reports, built = None, False
+            if self.database is not None:
+                from preprocessing import database
+                reports = database.ReportDatabase(self.database)
+
+            if reports is not None and reports.current(self.cfile, self.vfile) and not self.rebuild_cache:
+                community_df, hesitancy_df, store_key = None, reports.hesitancy(), None
+            else:
+                community_df, hesitancy_df, store_key = preprocessing.load_tables(self.cfile, self.vfile,
+                                                                                  self.cache_dir, self.rebuild_cache)
+                if reports is not None:
+                    reports.build(community_df, hesitancy_df, [self.cfile, self.vfile])
+                    built = True
+
+            date_frames = preprocessing.split_dates(community_df) if reports is None else None
+            tabular_df = preprocessing.tabular_table(hesitancy_df)
+            # Without a start date the window opens on the first report date of the data
+            date = self.date if self.date is not None else (sorted(date_frames) if reports is None
+                                                            else reports.dates())[0]
+            self.signals.tables.emit({
+                'community_df': community_df if reports is None else None,
+                'hesitancy_df': tabular_df,
+                'date_frames': date_frames,
+                'database': reports,
+                'community_position': community_position,
+                'date': date,
+                'date_data': preprocessing.process_date(community_df, tabular_df, date, date_frames, reports)
+            })
+
+        # Stage 2: the geometry the map needs
+        self.signals.progress.emit(1, STAGES[1])
+        with profiling.span('startup.geometry'):
+            hesitancy_df = preprocessing.parse_geometry(hesitancy_df, self.parse_workers)
+            if store_key is not None:
+                cache.store(self.cache_dir, store_key, community_df, hesitancy_df)
+            if built:
+                reports.store_geometry(hesitancy_df)
+            geometry_df = preprocessing.build_geometry_table(hesitancy_df)
+
+        self.signals.progress.emit(2, STAGES[2])
+        with profiling.span('startup.index'):
+            from visualizations import history, paths, rollups, spatial, stream_graph
+            # The State by State view draws the counties dissolved into states
+            county_paths = paths.PathLevels(geometry_df, cache_dir=self.cache_dir)
+            county_paths.dissolve()
+            self.signals.geometry.emit({
+                'hesitancy_df': geometry_df,
+                'stream_cube': stream_graph.build_cube(community_df, reports),
+                'state_rollups': rollups.build_rollups(community_df, geometry_df, reports),
+                'county_history': history.build_history(community_df, reports),
+                'county_paths': county_paths,
+                'county_index': spatial.CountyIndex(geometry_df)
+            })
+        self.signals.progress.emit(3, STAGES[3])
+
+
+class DataLoader(QtCore.QObject):
+    # Loads the datasets on a worker thread so the window can show right away. The tables
+    # (signal tables) arrive before the parsed geometry and spatial structures (signal geometry),
+    # both are delivered on the Qt main thread as dictionaries.
+
+    def __init__(self, parent=None):
+        super(DataLoader, self).__init__(parent)
+        self.signals = _LoadSignals(self)
+        self.progress = self.signals.progress
+        self.tables = self.signals.tables
+        self.geometry = self.signals.geometry
+        self.failed = self.signals.failed
+
+        self.worker = Worker(self)
+
+    def start(self, cfile: str, vfile: str, date: str, cache_dir: str = None, rebuild_cache: bool = False,
+              parse_workers: int = None, database: str = None):
+        job = _LoadJob(cfile, vfile, date, cache_dir, rebuild_cache, parse_workers, database, self.signals)
+        self.worker.start(job.load, on_error=job.failed)
@@ -1,26 +1,59 @@
 import argparse
 import math
 import sys
+from functools import partial
 
 from PyQt5 import QtCore
 from PyQt5.QtGui import QFont
-from PyQt5.QtWidgets import QApplication, QDialog, QGridLayout, QLabel, QComboBox, QSlider, QPushButton
+from PyQt5.QtWidgets import QApplication, QDialog, QGridLayout, QLabel, QComboBox, QSlider, QPushButton, \
+    QProgressBar
 from matplotlib import pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 
-from preprocessing import preprocessing
-from visualizations import bubble_chart, map, stream_graph, constants
+import profiling
+from ingestion import ReportIngester
+from loading import DataLoader, STAGES
+from playback import Playback
+from scheduler import RenderScheduler
+from visualizations import blitting, constants
+
+# The data (pandas, geopandas) and view modules (bokeh, mplcursors) are heavy to import: they
+# are imported on first use, by the data loader thread or by the view that needs them, so the
+# window shows up right away.
 
 
 class Window(QDialog):
 
-    def __init__(self, cfile: str, vfile: str, date: str, parent=None):
+    def __init__(self, cfile: str, vfile: str, date: str = None, cache_dir: str = None,
+                 rebuild_cache: bool = False, live_latency: bool = False, density_threshold: int = None,
+                 parse_workers: int = None, report_files: list = None, database: str = None, parent=None):
         super(Window, self).__init__(parent)
-        try:
-            self.community_df, self.hesitancy_df, self.date_data = preprocessing.process(cfile, vfile, date)
-        except FileNotFoundError:
-            print("Community or vaccine hesitancy dataset file not found. Aborting window initialization.")
-            return
+
+        # Datasets, filled in by the data loader: the tables first (bubble chart and stream graph),
+        # then the parsed geometry and the spatial structures the map needs. With a report database
+        # (preprocessing.database.ReportDatabase) there is no community_df or date_frames, the
+        # reports are queried from it instead.
+        self.database = None
+        self.community_df = None
+        self.hesitancy_df = None
+        self.date_frames = None
+        self.overview_data = None
+        self.bubble_index = None
+        self.stream_cube = None
+        self.county_history = None
+        self.state_rollups = None
+        self.county_paths = None
+        self.county_index = None
+        self.map_bins = None
+        # Report date shown, the first one of the data unless given
+        self.date = date
+
+        # Files watched for new weekly reports once the datasets are loaded: the community file
+        # (from the end of what was loaded) and any further report files (from the start)
+        self.cfile = cfile
+        self.report_files = {cfile: None, **{filename: None for filename in report_files or []}}
+        self.report_ingester = ReportIngester(self)
+        self.report_ingester.ingested.connect(self.reports_ingested)
 
         self.figure = plt.figure()
         self.canvas = FigureCanvas(self.figure)
@@ -29,11 +62,25 @@ class Window(QDialog):
 
         self.layout = QGridLayout()
 
+        # Coalesces slider-driven bubble chart redraws
+        self.render_scheduler = RenderScheduler(parent=self)
+
+        # Steps the map and bubble chart through the report dates, loading dates ahead in the background
+        self.playback = Playback(parent=self)
+        self.playback.frame.connect(self.play_frame)
+
+        # Retained artists of the current view, updated in place until the view type changes
+        self.blit_manager = blitting.BlitManager(self.canvas)
+        self.current_view = None
+        self.artists = None
+
         # Set defaults
         self.size_attribute = 'SVI'
         self.svi_min_threshold = 0.1
         self.svi_max_threshold = 0.9
         self.population_threshold = 5000
+        # Points in view above which the bubble chart shows their density (None: the chart's default)
+        self.density_threshold = density_threshold
         self.attribute_key = 'Cases Per 100k'
         self.state = 'Country View'
         self.secondary = 'None'
@@ -78,15 +125,161 @@ class Window(QDialog):
         self.stream_btn = QPushButton('Stream Graph View', self)
         self.stream_btn.clicked.connect(self.stream_plot)
 
+        self.play_btn = QPushButton('Play', self)
+        self.play_btn.clicked.connect(self.toggle_playback)
+
         self.layout.addWidget(title, 0, 0, 1, 2)
+        self.layout.addWidget(self.play_btn, 0, 3, 1, 1)
         self.layout.addWidget(self.canvas, 1, 0, 1, 4)
         self.layout.addWidget(self.bubble_btn, 6, 0, 1, 2)
         self.layout.addWidget(self.map_btn, 6, 2, 1, 1)
         self.layout.addWidget(self.stream_btn, 6, 3, 1, 1)
 
+        # Live latency readout of the last interaction (with --profile-live)
+        self.latency_label = None
+        if live_latency:
+            self.latency_label = QLabel('')
+            self.layout.addWidget(self.latency_label, 7, 0, 1, 4)
+            profiling.add_listener(self.show_latency)
+
+        # Loading progress, hidden once the map geometry is ready
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, len(STAGES) - 1)
+        self.progress_bar.setFormat(STAGES[0])
+        self.layout.addWidget(self.progress_bar, 8, 0, 1, 4)
+
+        # Views become available as their data arrives
+        for widget in [*self.bubble_widgets, self.bubble_btn, self.map_btn, self.stream_btn, self.play_btn]:
+            widget.setEnabled(False)
+
         self.setLayout(self.layout)
-        self.overview_data = self.date_data
-        self.bubblechart_plot()
+
+        self.data_loader = DataLoader(self)
+        self.data_loader.progress.connect(self.loading_progress)
+        self.data_loader.tables.connect(self.tables_loaded)
+        self.data_loader.geometry.connect(self.geometry_loaded)
+        self.data_loader.failed.connect(self.loading_failed)
+        self.data_loader.start(cfile, vfile, date, cache_dir, rebuild_cache, parse_workers, database)
+
+    def loading_progress(self, stage, message):
+        self.progress_bar.setValue(stage)
+        self.progress_bar.setFormat(message)
+        if stage == len(STAGES) - 1:
+            self.progress_bar.hide()
+
+    def loading_failed(self, message):
+        print(message + ' Aborting window initialization.')
+        self.progress_bar.setFormat(message)
+
+    def tables_loaded(self, tables):
+        # The bubble chart only needs the tables: draw it without waiting for the geometry
+        with profiling.interaction('tables_loaded'):
+            self.community_df = tables['community_df']
+            self.hesitancy_df = tables['hesitancy_df']
+            self.date_frames = tables['date_frames']
+            self.database = tables['database']
+            self.report_files[self.cfile] = tables['community_position']
+            self.date = tables['date']
+            self.set_overview_data(tables['date_data'])
+            self.fill_date_dropdown()
+
+            for widget in [*self.bubble_widgets, self.bubble_btn, self.stream_btn, self.play_btn]:
+                widget.setEnabled(True)
+            if self.current_view is None:
+                self.bubblechart_plot()
+
+    def geometry_loaded(self, geometry):
+        from preprocessing import preprocessing
+        from visualizations import binning
+
+        with profiling.interaction('geometry_loaded'):
+            self.hesitancy_df = geometry['hesitancy_df']
+            self.stream_cube = geometry['stream_cube']
+            self.state_rollups = geometry['state_rollups']
+            self.county_history = geometry['county_history']
+            self.county_paths = geometry['county_paths']
+            self.county_index = geometry['county_index']
+            # Frames prefetched so far were joined with the table without geometry
+            self.playback.clear()
+            # Quantile bins of the map colors by (attribute, scope, date), computed on first use
+            self.map_bins = binning.BinCache()
+            self.set_overview_data(preprocessing.process_date(self.community_df, self.hesitancy_df, self.date,
+                                                              self.date_frames, self.database))
+            self.map_btn.setEnabled(True)
+            # The bubble chart drawn from the tables shows the county history in its tooltips from now on
+            if self.current_view == 'bubble':
+                self.artists['history'] = self.county_history
+
+            # Every dataset new reports extend is ready now
+            self.report_ingester.start({'community_df': self.community_df, 'hesitancy_df': self.hesitancy_df,
+                                        'date_frames': self.date_frames, 'database': self.database,
+                                        'stream_cube': self.stream_cube, 'state_rollups': self.state_rollups,
+                                        'county_history': self.county_history, 'map_bins': self.map_bins},
+                                       self.report_files)
+
+    def reports_ingested(self, update):
+        from preprocessing import preprocessing
+        from visualizations import stream_graph
+
+        # New report dates were added to the datasets: offer them without rebuilding the current view.
+        # Dates that got more reports are computed again, the current one is shown again.
+        with profiling.interaction('reports_ingested', dates=len(update['dates']), updated=len(update['updated'])):
+            self.community_df = update['community_df']
+            self.date_frames = update['date_frames']
+            self.stream_cube = update['stream_cube']
+            self.state_rollups = update['state_rollups']
+            self.county_history = update['county_history']
+            for date in update['updated']:
+                self.map_bins.forget(date)
+            if update['updated']:
+                self.playback.clear()
+            if self.date in update['updated']:
+                self.set_overview_data(preprocessing.process_date(self.community_df, self.hesitancy_df, self.date,
+                                                                  self.date_frames, self.database))
+
+            self.fill_date_dropdown()
+
+            if self.playback.playing():
+                self.playback.start(self.report_dates(), self.date, self.load_frame)
+            # Open tooltips show the extended history, the current date redraws with its new reports
+            redraw = self.date in update['updated']
+            if self.current_view == 'map':
+                self.artists['picker'].set_history(self.county_history)
+                if redraw:
+                    self.update_map()
+            elif self.current_view == 'bubble':
+                self.artists['history'] = self.county_history
+                if redraw:
+                    self.schedule_bubblechart()
+            if self.current_view == 'stream':
+                stream_graph.update(self.artists, self.community_df, self.stream_attribute, self.stream_cube)
+                with profiling.span('canvas.draw'):
+                    self.canvas.draw()
+
+    def set_overview_data(self, data, index=None):
+        # Joined frame of the current date and the index the bubble chart sliders filter it with
+        self.overview_data = data
+        self.bubble_index = self.filter_index(self.date, data) if index is None else index
+
+    def filter_index(self, date, data):
+        from visualizations import bubble_chart
+
+        # Sorted columns of the frame in memory, or indexed queries on the report database
+        if self.database is not None:
+            return self.database.filter_index(date, data)
+        return bubble_chart.FilterIndex(data)
+
+    def fill_date_dropdown(self):
+        # The report dates of the loaded data, the current one selected
+        self.date_dropdown.clear()
+        self.date_dropdown.addItems(sorted(set(constants.REPORT_DATES).union(self.report_dates())))
+        self.date_dropdown.setCurrentText(self.date)
+
+    def report_dates(self):
+        # Report dates of the loaded data, in order
+        if self.database is not None:
+            return self.database.dates()
+        return sorted(self.date_frames)
 
     def initialize_bubble_widgets(self):
         # Size Attribute
@@ -166,8 +359,7 @@ class Window(QDialog):
         # Date Dropdown
         date_dropdown = QComboBox(self)
         date_dropdown.activated[str].connect(self.set_date)
-        date_dropdown.addItems(list(constants.REPORT_DATES))
-        date_dropdown.setCurrentIndex(0)
+        # Filled with the report dates of the data once it is loaded
 
         # Date Label
         date_label = QLabel('Report Date:')
@@ -234,57 +426,197 @@ class Window(QDialog):
         return stream_dropdown, stream_label
 
     def county_view(self):
-        self.view = 'County'
-        self.map_plot()
+        with profiling.interaction('county_view'):
+            self.view = 'County'
+            self.update_map()
 
     def state_view(self):
-        self.view = 'State'
-        self.map_plot()
+        with profiling.interaction('state_view'):
+            self.view = 'State'
+            self.update_map()
 
     def set_size(self, text):
-        self.size_attribute = text
-        self.bubblechart_plot()
+        with profiling.interaction('set_size'):
+            self.size_attribute = text
+            self.schedule_bubblechart()
 
     def set_min_svi(self, text):
-        self.svi_min_threshold = text / 100.0
-        self.svi_min_label.setText('Minimum SVI Threshold (' + str(self.svi_min_threshold) + '):')
-        self.bubblechart_plot()
+        with profiling.interaction('set_min_svi'):
+            self.svi_min_threshold = text / 100.0
+            self.svi_min_label.setText('Minimum SVI Threshold (' + str(self.svi_min_threshold) + '):')
+            self.schedule_bubblechart()
 
     def set_max_svi(self, text):
-        self.svi_max_threshold = text / 100.0
-        self.svi_max_label.setText('Maximum SVI Threshold (' + str(self.svi_max_threshold) + '):')
-        self.bubblechart_plot()
+        with profiling.interaction('set_max_svi'):
+            self.svi_max_threshold = text / 100.0
+            self.svi_max_label.setText('Maximum SVI Threshold (' + str(self.svi_max_threshold) + '):')
+            self.schedule_bubblechart()
 
     def set_population(self, text):
-        self.population_threshold = text * 1000.0
-        self.population_label.setText('Minimum County Population (' + str(self.population_threshold) + '):')
-        self.bubblechart_plot()
+        with profiling.interaction('set_population'):
+            self.population_threshold = text * 1000.0
+            self.population_label.setText('Minimum County Population (' + str(self.population_threshold) + '):')
+            self.schedule_bubblechart()
 
     def set_date(self, text):
-        self.overview_data = preprocessing.process_date(self.community_df, self.hesitancy_df, text)
-        self.map_plot()
+        from preprocessing import preprocessing
+
+        with profiling.interaction('set_date', date=text):
+            self.stop_playback()
+            self.date = text
+            self.set_overview_data(preprocessing.process_date(self.community_df, self.hesitancy_df, text,
+                                                              self.date_frames, self.database))
+            self.update_map()
 
     def set_attribute(self, text):
-        self.attribute_key = text
-        self.map_plot()
+        with profiling.interaction('set_attribute', attribute=text):
+            self.attribute_key = text
+            self.update_map()
 
     def set_state(self, text):
-        self.state = text
-        if self.state == 'Country View':
-            self.secondary = 'None'
-            self.secondary_map_widgets[0].setCurrentIndex(0)
-        self.map_plot()
+        with profiling.interaction('set_state', state=text):
+            self.state = text
+            if self.state == 'Country View':
+                self.secondary = 'None'
+                self.secondary_map_widgets[0].setCurrentIndex(0)
+            self.map_plot()
 
     def set_secondary(self, text):
-        self.secondary = text
-        self.map_plot()
+        with profiling.interaction('set_secondary', secondary=text):
+            self.secondary = text
+            self.update_map()
 
     def set_stream_attribute(self, text):
-        self.stream_attribute = text
-        self.stream_plot()
+        from visualizations import stream_graph
 
-    def bubblechart_plot(self):
+        with profiling.interaction('set_stream_attribute', attribute=text):
+            self.stream_attribute = text
+            if self.current_view != 'stream':
+                self.stream_plot()
+                return
+
+            stream_graph.update(self.artists, self.community_df, self.stream_attribute, self.stream_cube)
+            with profiling.span('canvas.draw'):
+                self.canvas.draw()
+
+    def toggle_playback(self):
+        if self.playback.playing():
+            self.stop_playback()
+            return
+
+        self.playback.start(self.report_dates(), self.date, self.load_frame)
+        self.play_btn.setText('Pause')
+
+    def stop_playback(self):
+        self.playback.stop()
+        self.play_btn.setText('Play')
+
+    def load_frame(self, date):
+        from preprocessing import preprocessing
+
+        # Runs on the playback thread: the joined frame of an upcoming date, its filter index and
+        # the arrays the retained view is updated with
+        data = preprocessing.process_date(self.community_df, self.hesitancy_df, date, self.date_frames,
+                                          self.database)
+        index = self.filter_index(date, data)
+        return data, index, self.prepare_view(data, index)
+
+    def view_settings(self):
+        # What the retained view shows, prepared playback frames are only applied while it is the same
+        if self.current_view == 'map':
+            return 'map', self.state, self.attribute_key, self.secondary, self.view
+        if self.current_view == 'bubble':
+            return ('bubble', self.size_attribute, self.svi_min_threshold, self.svi_max_threshold,
+                    self.population_threshold)
+        return self.current_view,
+
+    def prepare_view(self, data, index):
+        from visualizations import bubble_chart, map
+
+        # Runs on the playback thread: (artists, settings, arrays) of the retained view for data,
+        # computed with map.prepare or bubble_chart.prepare, None when the view is not updated
+        # in place. The settings are read before the artists, a view changed in between makes
+        # one of them stale and the frame is then updated on the main thread instead.
+        settings = self.view_settings()
+        artists = self.artists or {}
+        if settings[0] == 'map' and artists.get('state_name') == settings[1]:
+            _, _, attribute, secondary, view = settings
+            return artists, settings, map.prepare(artists, data, attribute, secondary, view, self.map_bins,
+                                                  self.state_rollups)
+        if settings[0] == 'bubble' and 'density' in artists:
+            _, size_attribute, svi_min_threshold, svi_max_threshold, population_threshold = settings
+            return artists, settings, bubble_chart.prepare(
+                bubble_chart.filter_data(data, size_attribute, svi_min_threshold, svi_max_threshold,
+                                         population_threshold, index), size_attribute)
+        return None
+
+    def play_frame(self, date, frame):
+        from visualizations import bubble_chart, map
+
+        # Swap a prefetched date into the retained view. Its arrays were prepared on the playback
+        # thread, here they are only pushed into the artists and blitted.
+        data, index, prepared = frame
+        with profiling.interaction('play_frame', date=date):
+            self.date = date
+            self.date_dropdown.setCurrentText(date)
+            self.set_overview_data(data, index)
+            if prepared is not None and prepared[0] is self.artists and prepared[1] == self.view_settings():
+                if self.current_view == 'map':
+                    map.apply(self.artists, prepared[2])
+                    self.redraw()
+                else:
+                    self.redraw(full=bubble_chart.apply(self.artists, prepared[2]))
+            elif self.current_view == 'map':
+                self.update_map()
+            elif self.current_view == 'bubble':
+                self.redraw(full=bubble_chart.update(
+                    self.artists, bubble_chart.filter_data(self.overview_data, self.size_attribute,
+                                                           self.svi_min_threshold, self.svi_max_threshold,
+                                                           self.population_threshold, self.bubble_index),
+                    self.size_attribute))
+
+    def new_view(self, view):
+        # Full rebuild of the figure, only done when the view type changes
+        self.render_scheduler.cancel()
+        # Prefetched playback frames were prepared for the artists of the old view
+        self.playback.clear()
         self.figure.clear()
+        self.blit_manager.clear()
+        self.current_view = view
+        return self.figure.add_subplot(111)
+
+    def redraw(self, full=False):
+        # Blit the retained dynamic artists, or redraw everything after a rebuild or axis change
+        self.blit_manager.set_artists(self.artists['dynamic'])
+        if full:
+            with profiling.span('canvas.draw'):
+                self.canvas.draw()
+        else:
+            with profiling.span('canvas.blit'):
+                self.blit_manager.update()
+
+    def show_latency(self, interaction):
+        self.latency_label.setText(profiling.summary(interaction))
+
+    def schedule_bubblechart(self):
+        from visualizations import bubble_chart
+
+        # Slider drags fire for every tick: filter off the main thread and only draw the latest state
+        self.render_scheduler.request(
+            partial(bubble_chart.filter_data, self.overview_data, self.size_attribute,
+                    self.svi_min_threshold, self.svi_max_threshold, self.population_threshold, self.bubble_index),
+            partial(self.draw_bubblechart, self.size_attribute))
+
+    def draw_bubblechart(self, size_attribute, data):
+        from visualizations import bubble_chart
+
+        with profiling.interaction('draw_bubblechart'):
+            if self.current_view != 'bubble':
+                return
+            self.redraw(full=bubble_chart.update(self.artists, data, size_attribute))
+
+    def bubblechart_plot(self):
+        from visualizations import bubble_chart
 
         # BUBBLE WIDGETS: SHOW
         for widget in self.bubble_widgets:
@@ -299,15 +631,32 @@ class Window(QDialog):
         for widget in self.stream_widgets:
             widget.hide()
 
-        ax = self.figure.add_subplot(111)
-        bubble_chart.plot(self.overview_data, ax, self.size_attribute,
-                          self.svi_min_threshold, self.svi_max_threshold,
-                          self.population_threshold)
+        self.play_btn.show()
 
-        self.canvas.draw()
+        with profiling.interaction('bubblechart_plot'):
+            ax = self.new_view('bubble')
+            self.artists = bubble_chart.draw(bubble_chart.filter_data(self.overview_data, self.size_attribute,
+                                                                      self.svi_min_threshold, self.svi_max_threshold,
+                                                                      self.population_threshold, self.bubble_index),
+                                             ax, self.size_attribute, self.density_threshold, self.county_history)
+            # Scroll zooming redraws the whole canvas, the axis limits change
+            self.artists['density'].redraw = partial(self.redraw, True)
+            self.redraw(full=True)
+
+    def update_map(self):
+        from visualizations import map
+
+        # Date, attribute, secondary attribute and County/State changes recolor the retained map
+        if self.current_view != 'map' or self.artists['state_name'] != self.state:
+            self.map_plot()
+            return
+
+        map.update(self.artists, self.overview_data, self.attribute_key, self.secondary, self.view, self.map_bins,
+                   self.state_rollups)
+        self.redraw()
 
     def map_plot(self):
-        self.figure.clear()
+        from visualizations import map
 
         # BUBBLE WIDGETS: HIDE
         for widget in self.bubble_widgets:
@@ -332,13 +681,19 @@ class Window(QDialog):
         for widget in self.stream_widgets:
             widget.hide()
 
-        ax = self.figure.add_subplot(111)
-        map.plot(self.overview_data, ax, self.state, self.attribute_key, self.secondary, self.view)
+        self.play_btn.show()
 
-        self.canvas.draw()
+        with profiling.interaction('map_plot'):
+            ax = self.new_view('map')
+            self.artists = map.plot(self.overview_data, ax, self.state, self.attribute_key, self.secondary, self.view,
+                                    self.county_paths, self.county_index, self.map_bins, self.state_rollups,
+                                    self.county_history)
+            # Hover tooltips only blit the annotation
+            self.artists['picker'].redraw = self.redraw
+            self.redraw(full=True)
 
     def stream_plot(self):
-        self.figure.clear()
+        from visualizations import stream_graph
 
         # BUBBLE WIDGETS: HIDE
         for widget in self.bubble_widgets:
@@ -353,10 +708,14 @@ class Window(QDialog):
         for widget in self.stream_widgets:
             widget.show()
 
-        ax = self.figure.add_subplot(111)
-        stream_graph.plot(self.community_df, self.stream_attribute, ax)
+        # The stream graph covers every date already
+        self.stop_playback()
+        self.play_btn.hide()
 
-        self.canvas.draw()
+        with profiling.interaction('stream_plot'):
+            ax = self.new_view('stream')
+            self.artists = stream_graph.plot(self.community_df, self.stream_attribute, ax, self.stream_cube)
+            self.redraw(full=True)
 
 
 # If module is not being imported (ran as main program).
@@ -364,11 +723,47 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='CS 43900 Final Project')
     parser.add_argument('-c', action='store', required=True, dest='cfile')
     parser.add_argument('-v', action='store', required=True, dest='vfile')
-    if len(sys.argv) == 5:
+    parser.add_argument('--cache-dir', action='store', default='.cache', dest='cache_dir',
+                        help='directory for the preprocessed dataset cache (default: .cache)')
+    parser.add_argument('--rebuild-cache', action='store_true', dest='rebuild_cache',
+                        help='ignore any cached datasets and rebuild the cache from the CSV files')
+    parser.add_argument('--no-cache', action='store_true', dest='no_cache',
+                        help='bypass the preprocessed dataset cache entirely')
+    parser.add_argument('--profile', action='store', default=None, dest='profile',
+                        help='record timing spans and write them to this file on exit')
+    parser.add_argument('--profile-format', choices=['json', 'chrome'], default='json', dest='profile_format',
+                        help='json: per-interaction breakdown, chrome: Chrome trace event format (default: json)')
+    parser.add_argument('--profile-live', action='store_true', dest='profile_live',
+                        help='record timing spans and show the latency of the last interaction in the window')
+    parser.add_argument('--parse-workers', type=int, default=None, dest='parse_workers',
+                        help='processes parsing the county geometry, 1 parses serially (default: one per CPU)')
+    parser.add_argument('--database', action='store', default=None, dest='database', metavar='FILE',
+                        help='keep the community reports in this SQLite database instead of in memory, '
+                             'built from the datasets when missing or out of date')
+    parser.add_argument('--reports', nargs='+', default=[], metavar='FILE', dest='report_files',
+                        help='further community level files to add new report dates from, watched for '
+                             'new reports like the main community file')
+    parser.add_argument('--density-threshold', type=int, default=None, dest='density_threshold',
+                        help='points in view above which the bubble chart draws their density instead of '
+                             'one marker per county (default: 20000)')
+    if len(sys.argv) >= 5:
         namespace = parser.parse_args(sys.argv[1:])
+        profiling.enable(namespace.profile is not None or namespace.profile_live)
+
         app = QApplication(sys.argv)
-        main = Window(namespace.cfile, namespace.vfile, '2022-02-24')
+        main = Window(namespace.cfile, namespace.vfile, None,
+                      None if namespace.no_cache else namespace.cache_dir, namespace.rebuild_cache,
+                      namespace.profile_live, namespace.density_threshold, namespace.parse_workers,
+                      namespace.report_files, namespace.database)
         main.show()
-        sys.exit(app.exec_())
+        status = app.exec_()
+
+        if namespace.profile is not None:
+            profiling.export(namespace.profile, namespace.profile_format)
+            print(f'Wrote profile to {namespace.profile}')
+        sys.exit(status)
     else:
-        print('Usage: python main.py -c <community_file_path> -v <vaccine_file_path>')
+        print('Usage: python main.py -c <community_file_path> -v <vaccine_file_path> '
+              '[--cache-dir <dir>] [--rebuild-cache] [--no-cache] '
+              '[--profile <file> [--profile-format json|chrome]] [--profile-live] [--density-threshold <points>] '
+              '[--parse-workers <n>] [--reports <file> ...] [--database <file>]')
@@ -0,0 +1,98 @@
+from functools import partial
+
+from PyQt5 import QtCore
+
+from scheduler import Worker
+
+# Time each report date stays on screen during playback
+FRAME_MS = 500
+# Dates loaded ahead of the one on screen
+PREFETCH_DATES = 4
+
+
+class Playback(QtCore.QObject):
+    # Steps through the report dates at a steady rate. The frame of a date (whatever load(date)
+    # returns) is computed on a worker thread a few dates ahead of the one on screen, so a tick
+    # only swaps the prefetched data into the retained view. When the frame of the next date is
+    # not ready yet, the tick holds the current date instead of blocking the UI, and the next
+    # tick tries again. A date whose load failed is skipped. Frames are delivered on the Qt main
+    # thread through the frame signal as (date, frame).
+    frame = QtCore.pyqtSignal(str, object)
+
+    def __init__(self, frame_ms: int = FRAME_MS, prefetch: int = PREFETCH_DATES, parent=None):
+        super(Playback, self).__init__(parent)
+        self.prefetch = prefetch
+        self.generation = 0
+        self.dates = []
+        self.position = 0
+        self.load = None
+        self.frames = {}
+        self.requested = set()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(frame_ms)
+        self.timer.timeout.connect(self.tick)
+
+        self.worker = Worker(self)
+
+    def start(self, dates: list, current: str, load):
+        # Play dates from the one after current, looping at the end
+        if self.load != load or self.dates != dates:
+            self.clear()
+        self.dates = list(dates)
+        self.load = load
+        self.position = self.dates.index(current) if current in self.dates else -1
+        self.fetch()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def playing(self) -> bool:
+        return self.timer.isActive()
+
+    def clear(self):
+        # Forget prefetched frames, e.g. when the data they were computed from is replaced
+        self.generation += 1
+        self.frames.clear()
+        self.requested.clear()
+        self.worker.clear()
+
+    def upcoming(self) -> list:
+        return [self.dates[(self.position + step) % len(self.dates)] for step in range(1, self.prefetch + 1)]
+
+    def fetch(self):
+        upcoming = self.upcoming()
+        # Frames behind the playhead are not needed until the next loop
+        for date in list(self.frames):
+            if date not in upcoming:
+                del self.frames[date]
+        for date in upcoming:
+            if date not in self.frames and date not in self.requested:
+                self.requested.add(date)
+                # A failed load reports back without a frame, so the date is skipped instead of stalling
+                self.worker.start(partial(self.load, date), partial(self.loaded, self.generation, date))
+
+    def loaded(self, generation: int, date: str, frame):
+        if generation != self.generation:
+            return
+        self.requested.discard(date)
+        # Failed loads are kept as None so the tick skips the date
+        if date in self.upcoming():
+            self.frames[date] = frame
+
+    def tick(self):
+        if not self.dates:
+            return
+        date = self.dates[(self.position + 1) % len(self.dates)]
+        if date not in self.frames:
+            # Still loading: hold the current date for another tick
+            if date not in self.requested:
+                self.fetch()
+            return
+
+        self.position = (self.position + 1) % len(self.dates)
+        frame = self.frames.pop(date)
+        self.fetch()
+        if frame is not None:
+            self.frame.emit(date, frame)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+import pandas as pd
+
+import profiling
+from storage import atomic_write
+
+# Hesitancy columns holding shapely geometries. They are stored in the cache as WKB
+# so a warm start never has to go back through WKT parsing.
+GEOMETRY_COLUMNS = ['county_boundary', 'state_boundary', 'point']
+
+# Bump whenever the layout of the cached frames changes so stale caches are ignored.
+CACHE_VERSION = 3
+
+# Names of the cache entry directories (cache_key), other directories in cache_dir are left alone
+ENTRY_NAME = re.compile(r'[0-9a-f]{32}')
+
+# Content digests of the input files in cache_dir, by path, size and modification time
+DIGESTS_FILE = 'digests.json'
+# A file modified this close to its hashing may have changed again within the same mtime, it is
+# hashed again rather than trusted
+RACY_NS = 2_000_000_000
+
+
+@profiling.timed()
+def cache_key(cache_dir: str, *filenames: str) -> str:
+    # Key the cache on the contents of every input file. A file is only read and hashed again
+    # when its size or modification time changed since it was last hashed, the digests are kept
+    # in cache_dir. Raises FileNotFoundError for missing inputs, same as pd.read_csv would.
+    digests = read_digests(cache_dir)
+    key = hashlib.sha256(f'v{CACHE_VERSION}'.encode())
+    changed = False
+    for filename in filenames:
+        path = os.path.abspath(filename)
+        stat = os.stat(filename)
+        known = digests.get(path)
+        if known is None or (known['size'], known['mtime_ns']) != (stat.st_size, stat.st_mtime_ns) \
+                or stat.st_mtime_ns >= known['hashed_ns'] - RACY_NS:
+            known = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hashed_ns': time.time_ns(),
+                     'digest': file_digest(filename)}
+            digests[path] = known
+            changed = True
+        key.update(f'{path}:{known["digest"]}'.encode())
+    if changed:
+        write_digests(cache_dir, digests)
+    return key.hexdigest()[:32]
+
+
+@profiling.timed()
+def file_digest(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_digests(cache_dir: str) -> dict:
+    try:
+        with open(os.path.join(cache_dir, DIGESTS_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_digests(cache_dir: str, digests: dict) -> None:
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with atomic_write(os.path.join(cache_dir, DIGESTS_FILE)) as temporary:
+            with open(temporary, 'w') as file:
+                json.dump(digests, file)
+    except OSError as error:
+        print(f'Could not save the input file digests: {error}')
+
+
+@profiling.timed()
+def load(cache_dir: str, key: str, decode: bool = True) -> (pd.DataFrame, pd.DataFrame):
+    # Return the cached (community, hesitancy) frames, or (None, None) on a cache miss.
+    # With decode=False the geometry columns are left as WKB for preprocessing.parse_geometry.
+    entry = os.path.join(cache_dir, key)
+    community_path = os.path.join(entry, 'community.parquet')
+    hesitancy_path = os.path.join(entry, 'hesitancy.parquet')
+    if not (os.path.exists(community_path) and os.path.exists(hesitancy_path)):
+        return None, None
+
+    try:
+        community_df = pd.read_parquet(community_path)
+        hesitancy_df = pd.read_parquet(hesitancy_path)
+    except ImportError:
+        print('pyarrow is not installed. Skipping the preprocessing cache.')
+        return None, None
+
+    if decode:
+        import geopandas as gpd
+        for column in GEOMETRY_COLUMNS:
+            hesitancy_df[column] = gpd.GeoSeries.from_wkb(hesitancy_df[column], index=hesitancy_df.index)
+
+    return community_df, hesitancy_df
+
+
+@profiling.timed()
+def store(cache_dir: str, key: str, community_df: pd.DataFrame, hesitancy_df: pd.DataFrame) -> None:
+    import geopandas as gpd
+
+    entry = os.path.join(cache_dir, key)
+    os.makedirs(entry, exist_ok=True)
+
+    hesitancy_wkb = hesitancy_df.copy()
+    for column in GEOMETRY_COLUMNS:
+        hesitancy_wkb[column] = gpd.GeoSeries(hesitancy_df[column]).to_wkb()
+
+    try:
+        for frame, name in [(community_df, 'community.parquet'), (hesitancy_wkb, 'hesitancy.parquet')]:
+            with atomic_write(os.path.join(entry, name)) as temporary:
+                frame.to_parquet(temporary)
+    except ImportError:
+        print('pyarrow is not installed. Skipping the preprocessing cache.')
+        return
+
+    prune(cache_dir, key)
+
+
+def prune(cache_dir: str, key: str) -> None:
+    # Remove the entries of other keys, written for earlier versions of the input files. Only
+    # directories named like an entry and holding nothing but cached frames are removed, so the
+    # coordinate store (cache_dir/geometry) and anything else kept next to the entries stays.
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name == key or not ENTRY_NAME.fullmatch(name) or not os.path.isdir(entry):
+            continue
+        if all(file.endswith(('.parquet', '.tmp')) for file in os.listdir(entry)):
+            shutil.rmtree(entry, ignore_errors=True)
@@ -0,0 +1,314 @@
+import os
+import sqlite3
+import threading
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from storage import atomic_write
+from . import cache
+from .preprocessing import CATEGORY_COLUMNS, ORDERED_COLUMNS, drop_loaded, report_keys
+
+# Bump whenever the schema changes so databases built by an older version are rebuilt.
+DATABASE_VERSION = 1
+
+# (name, table, columns) of the indexes: rows of a date (in FIPS order), of a state over time,
+# and the numeric columns the bubble chart sliders filter on
+INDEXES = [
+    ('community_date_fips', 'community', ['date_updated', 'county_fips']),
+    ('community_state_date', 'community', ['state', 'date_updated']),
+    ('community_date_population', 'community', ['date_updated', 'county_population']),
+    ('hesitancy_fips', 'hesitancy', ['county_fips']),
+    ('hesitancy_svi', 'hesitancy', ['SVI'])
+]
+
+
+class ReportDatabase:
+    # The processed datasets in a local SQLite database, for when the community levels history
+    # is too large to keep in memory. The community reports stay on disk: the rows of a date, the
+    # rows within the bubble chart thresholds and the stream graph counts are indexed queries
+    # returning only what the view needs, as frames with the same columns and dtypes as the
+    # in-memory path. The hesitancy table keeps its geometry encoded (WKB, or WKT until the first
+    # parse) for preprocessing.parse_geometry. Every thread queries through its own connection.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.date_list = None
+        self.category_map = None
+
+    def connection(self) -> sqlite3.Connection:
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = sqlite3.connect(self.path)
+        return self.local.connection
+
+    def current(self, *filenames: str) -> bool:
+        # Whether the database was built (or last extended) from these files as they are now
+        if not os.path.exists(self.path):
+            return False
+        try:
+            version, = self.connection().execute('PRAGMA user_version').fetchone()
+            sources = dict(self.connection().execute('SELECT filename, signature FROM sources').fetchall())
+        except sqlite3.DatabaseError:
+            return False
+        return version == DATABASE_VERSION and sources == {os.path.abspath(filename): signature(filename)
+                                                            for filename in filenames}
+
+    @profiling.timed()
+    def build(self, community_df: pd.DataFrame, hesitancy_df: pd.DataFrame, filenames: list) -> None:
+        # Load the processed datasets into a new database, replacing any previous one. Written to
+        # a temporary file first so an interrupted build never leaves a half-written database.
+        with atomic_write(self.path) as temporary:
+            with closing(sqlite3.connect(temporary)) as connection:
+                # Readers (the views) and the writer (report ingestion) do not block each other
+                connection.execute('PRAGMA journal_mode=WAL')
+                with profiling.span('database.insert', rows=len(community_df)):
+                    community_df.to_sql('community', connection, index=True, index_label='county_fips')
+                    hesitancy_df.to_sql('hesitancy', connection, index=True, index_label='county_fips')
+                with profiling.span('database.index'):
+                    for name, table, columns in INDEXES:
+                        connection.execute(f'CREATE INDEX {name} ON {table} ({", ".join(map(quote, columns))})')
+
+                connection.execute('CREATE TABLE categories (name TEXT, value TEXT, UNIQUE (name, value))')
+                for frame in [community_df, hesitancy_df]:
+                    insert_categories(connection, frame)
+                connection.execute('CREATE TABLE sources (filename TEXT PRIMARY KEY, signature TEXT)')
+                connection.executemany('INSERT INTO sources VALUES (?, ?)',
+                                       [(os.path.abspath(filename), signature(filename)) for filename in filenames])
+                connection.execute(f'PRAGMA user_version = {DATABASE_VERSION}')
+                connection.commit()
+
+            # Connections opened before now still point at the replaced file
+            self.close()
+        self.local = threading.local()
+        self.date_list = None
+        self.category_map = None
+
+    def store_geometry(self, hesitancy_df: pd.DataFrame) -> None:
+        # Replace the geometry read from the CSV (WKT) with the parsed geometry as WKB, so later
+        # starts decode instead of parsing it
+        import shapely
+
+        connection = self.connection()
+        columns = cache.GEOMETRY_COLUMNS
+        rows = zip(*[shapely.to_wkb(np.asarray(hesitancy_df[column])) for column in columns],
+                   hesitancy_df.index.to_numpy().tolist())
+        connection.executemany(f'UPDATE hesitancy SET {", ".join(f"{quote(column)} = ?" for column in columns)} '
+                               f'WHERE county_fips = ?', rows)
+        connection.commit()
+
+    @profiling.timed()
+    def append(self, new_df: pd.DataFrame, filename: str = None, commit: bool = True) -> pd.DataFrame:
+        # Insert community reports, also of dates the database has part of already. Reports of a
+        # county and date the database has are left out. Returns the rows inserted. When filename
+        # is one of the sources, its new size and time are recorded. With commit=False the rows
+        # are only seen by this thread until commit() (or dropped by rollback()).
+        dates = [date for date in new_df['date_updated'].dropna().unique() if date in self.dates()]
+        loaded = None
+        if dates:
+            loaded = report_keys(self.query('community', f'SELECT county_fips, date_updated FROM community '
+                                                         f'WHERE date_updated IN ({", ".join("?" * len(dates))})',
+                                            tuple(dates)))
+        new_df = drop_loaded(new_df, loaded)
+        connection = self.connection()
+        if not new_df.empty:
+            insert_rows(connection, 'community', new_df)
+            insert_categories(connection, new_df)
+        if filename is not None:
+            connection.execute('UPDATE sources SET signature = ? WHERE filename = ?',
+                               (signature(filename), os.path.abspath(filename)))
+        if commit:
+            connection.commit()
+        self.date_list = None
+        self.category_map = None
+        return new_df
+
+    def commit(self) -> None:
+        self.connection().commit()
+        self.date_list = None
+        self.category_map = None
+
+    def rollback(self) -> None:
+        self.connection().rollback()
+        self.date_list = None
+        self.category_map = None
+
+    def dates(self) -> list:
+        # Report dates in the database, in order
+        if self.date_list is None:
+            self.date_list = [date for date, in self.connection().execute(
+                'SELECT DISTINCT date_updated FROM community WHERE date_updated IS NOT NULL ORDER BY date_updated')]
+        return self.date_list
+
+    def counties(self) -> pd.Index:
+        # FIPS codes of the counties with community reports, in order
+        return pd.Index([fips for fips, in self.connection().execute(
+            'SELECT DISTINCT county_fips FROM community ORDER BY county_fips')], dtype='int32')
+
+    def categories(self) -> dict:
+        # Column -> categories, the categories the in-memory frames have
+        if self.category_map is None:
+            category_map = {}
+            for name, value in self.connection().execute('SELECT name, value FROM categories ORDER BY name, value'):
+                category_map.setdefault(name, []).append(value)
+            self.category_map = category_map
+        return self.category_map
+
+    @profiling.timed()
+    def hesitancy(self) -> pd.DataFrame:
+        # The hesitancy table, geometry columns still encoded
+        return self.query('hesitancy', 'SELECT * FROM hesitancy ORDER BY rowid')
+
+    @profiling.timed()
+    def community(self, date: str) -> pd.DataFrame:
+        # Community reports of a date, in the order they were read
+        return self.query('community', 'SELECT * FROM community WHERE date_updated = ? ORDER BY rowid', (date,))
+
+    def filter_index(self, date: str, data: pd.DataFrame):
+        return QueryIndex(self, date, data)
+
+    @profiling.timed()
+    def values(self, column: str) -> np.ndarray:
+        # Every present value of a numeric community column
+        cursor = self.connection().execute(f'SELECT {quote(column)} FROM community WHERE {quote(column)} IS NOT NULL')
+        return np.fromiter((value for value, in cursor), dtype=np.float32)
+
+    @profiling.timed()
+    def count_values(self, column: str) -> pd.DataFrame:
+        # Number of reports of every value of a community column by date (rows) and value (columns)
+        counts = pd.read_sql_query(f'SELECT date_updated, {quote(column)} AS value, COUNT(*) AS count FROM community '
+                                   f'WHERE date_updated IS NOT NULL AND {quote(column)} IS NOT NULL '
+                                   f'GROUP BY date_updated, {quote(column)}', self.connection())
+        counts = counts.pivot(index='date_updated', columns='value', values='count')
+        return counts.fillna(0).astype(np.int64).rename_axis(index=None, columns=None)
+
+    @profiling.timed()
+    def count_bins(self, column: str, edges: np.ndarray) -> pd.DataFrame:
+        # Number of reports in every bin of a numeric community column by date (rows) and bin
+        # (columns 0 to len(edges) - 2). Bins are assigned like binning.QuantileBins.codes():
+        # right closed, the first one closed on the left too.
+        bins = len(edges) - 1
+        if bins < 1:
+            return pd.DataFrame(dtype=np.int64)
+
+        value = quote(column)
+        cases = ' '.join(f'WHEN {value} <= ? THEN {i}' for i in range(bins))
+        counts = pd.read_sql_query(f'SELECT date_updated, bin, COUNT(*) AS count FROM '
+                                   f'(SELECT date_updated, CASE WHEN {value} < ? THEN -1 {cases} ELSE -1 END AS bin '
+                                   f'FROM community WHERE date_updated IS NOT NULL AND {value} IS NOT NULL) '
+                                   f'WHERE bin >= 0 GROUP BY date_updated, bin', self.connection(),
+                                   params=[float(edge) for edge in edges])
+        counts = counts.pivot(index='date_updated', columns='bin', values='count')
+        counts = counts.reindex(columns=range(bins)).fillna(0).astype(np.int64)
+        return counts.rename_axis(index=None, columns=None)
+
+    @profiling.timed()
+    def weighted_sums(self, columns: list, dates: list = None) -> (pd.DataFrame, pd.DataFrame):
+        # Sums of population * value and of the population of the counties with a value, by
+        # (date, state) and column, like visualizations.rollups.weighted_sums(). Community and
+        # hesitancy columns alike, counties without geometry are left out like in the geometry table.
+        connection = self.connection()
+        community = {name for _, name, *_ in connection.execute('PRAGMA table_info(community)')}
+        values = [f'{"c" if column in community else "h"}.{quote(column)}' for column in columns]
+        sums = [f'TOTAL(CASE WHEN {value} IS NOT NULL THEN c.county_population * {value} END)' for value in values]
+        weights = [f'TOTAL(CASE WHEN {value} IS NOT NULL THEN c.county_population END)' for value in values]
+
+        conditions = ['c.date_updated IS NOT NULL', 'c.state IS NOT NULL', 'c.county_population IS NOT NULL',
+                      *[f'h.{quote(column)} IS NOT NULL' for column in cache.GEOMETRY_COLUMNS]]
+        if dates is not None:
+            conditions.append(f'c.date_updated IN ({", ".join("?" * len(dates))})')
+
+        rows = connection.execute(f'SELECT c.date_updated, c.state, {", ".join(sums + weights)} FROM community c '
+                                  f'JOIN hesitancy h ON h.county_fips = c.county_fips '
+                                  f'WHERE {" AND ".join(conditions)} GROUP BY c.date_updated, c.state',
+                                  list(dates or [])).fetchall()
+        index = pd.MultiIndex.from_tuples([row[:2] for row in rows]) if rows else \
+            pd.MultiIndex.from_arrays([[], []])
+        totals = np.array([row[2:] for row in rows], dtype=np.float64).reshape(len(rows), 2 * len(columns))
+        return (pd.DataFrame(totals[:, :len(columns)], index=index, columns=columns),
+                pd.DataFrame(totals[:, len(columns):], index=index, columns=columns))
+
+    def query(self, table: str, sql: str, params: tuple = ()) -> pd.DataFrame:
+        # Rows of a table as a FIPS indexed frame in the dtypes of preprocessing.compact()
+        connection = self.connection()
+        frame = pd.read_sql_query(sql, connection, params=params, index_col='county_fips')
+        frame.index = frame.index.astype('int32')
+
+        numeric = [name for _, name, kind, *_ in connection.execute(f'PRAGMA table_info({table})')
+                   if kind == 'REAL']
+        categories = self.categories()
+        dtypes = {column: 'float32' for column in numeric if column in frame}
+        dtypes.update({column: pd.CategoricalDtype(categories.get(column, []), ordered=column in ORDERED_COLUMNS)
+                       for column in CATEGORY_COLUMNS if column in frame})
+        return frame.astype(dtypes)
+
+    def close(self) -> None:
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+class QueryIndex:
+    # Slider filter of one date frame answered by the database, the counterpart of
+    # bubble_chart.FilterIndex: the indexes on (date, population) and SVI narrow the reports down
+    # and only the matching FIPS codes come back.
+
+    def __init__(self, database: ReportDatabase, date: str, data: pd.DataFrame):
+        self.database = database
+        self.date = date
+        self.data = data
+        self.fips = data.index
+
+        # Complete rows only, like FilterIndex: every column of both tables is present
+        connection = database.connection()
+        columns = [f'c.{quote(name)}' for _, name, *_ in connection.execute('PRAGMA table_info(community)')]
+        columns += [f'h.{quote(name)}' for _, name, *_ in connection.execute('PRAGMA table_info(hesitancy)')]
+        self.complete = ' AND '.join(f'{column} IS NOT NULL' for column in columns)
+
+    def rows(self, svi_min_threshold: float, svi_max_threshold: float, population_threshold: float) -> np.ndarray:
+        # Positions of the rows within the thresholds, in frame order. Thresholds are compared as
+        # float32, the dtype of the columns.
+        cursor = self.database.connection().execute(
+            f'SELECT c.county_fips FROM community c JOIN hesitancy h ON h.county_fips = c.county_fips '
+            f'WHERE c.date_updated = ? AND c.county_population >= ? AND h."SVI" >= ? AND h."SVI" <= ? '
+            f'AND {self.complete}',
+            (self.date, *[float(np.float32(threshold)) for threshold in
+                          (population_threshold, svi_min_threshold, svi_max_threshold)]))
+        rows = self.fips.get_indexer(np.fromiter((fips for fips, in cursor), dtype=np.int64))
+        return np.sort(rows[rows >= 0])
+
+    def median(self, column: str, rows: np.ndarray) -> float:
+        # Median of a column over rows (of rows(), not empty), the upper one of an even count.
+        # The size columns have no index in the database, the rows are partitioned.
+        values = self.data[column].to_numpy()[rows]
+        return np.partition(values, len(values) // 2)[len(values) // 2]
+
+
+def signature(filename: str) -> str:
+    stat = os.stat(filename)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def insert_rows(connection: sqlite3.Connection, table: str, frame: pd.DataFrame) -> None:
+    # Insert the rows of a FIPS indexed frame. Unlike DataFrame.to_sql this does not commit, the
+    # rows can still be rolled back.
+    frame = frame.rename_axis('county_fips').reset_index()
+    frame = frame.astype({column: np.float64 for column in frame if frame[column].dtype.kind == 'f'}).astype(object)
+    connection.executemany(f'INSERT INTO {table} ({", ".join(map(quote, frame.columns))}) '
+                           f'VALUES ({", ".join("?" * len(frame.columns))})',
+                           frame.where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+def insert_categories(connection: sqlite3.Connection, frame: pd.DataFrame) -> None:
+    for column in CATEGORY_COLUMNS:
+        if column in frame:
+            connection.executemany('INSERT OR IGNORE INTO categories VALUES (?, ?)',
+                                   [(column, value) for value in frame[column].dropna().unique()])
+
+
+def quote(name: str) -> str:
+    # Column names like "Percent Asian" as SQL identifiers
+    return '"' + name.replace('"', '""') + '"'
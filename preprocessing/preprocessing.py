@@ -1,97 +1,380 @@
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-
-
-def process(community_filename: str, hesitancy_df: str, date: str) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
-    # Read in CDC Datasets (Community Levels and Hesitancy Data)
-    community_df = pd.read_csv(community_filename)
-    hesitancy_df = pd.read_csv(hesitancy_df)
-
-    # Filter community levels data by selecting relevant columns
-    community_df_filtered = community_df[[
-        'county',
-        'county_fips',
-        'state',
-        'county_population',
-        'covid_hospital_admissions_per_100k',
-        'covid_cases_per_100k',
-        'covid-19_community_level',
-        'date_updated'
-    ]]
-
-    # Rename community levels columns to uniform short snake case for easier reference
-    community_df_final = community_df_filtered.rename({
-        'covid_hospital_admissions_per_100k': 'hospital_100k',
-        'covid_cases_per_100k': 'cases_100k',
-        'covid-19_community_level': 'community_level'
-    }, axis='columns')
-
-    # Filter vaccine hesitancy data by selecting relevant columns
-    hesitancy_df_filtered = hesitancy_df[[
-        'FIPS Code',
-        'Estimated hesitant',
-        'Estimated strongly hesitant',
-        'Social Vulnerability Index (SVI)', 'SVI Category',
-        'Percent adults fully vaccinated against COVID-19 (as of 6/10/21)',
-        'Percent Hispanic',
-        'Percent non-Hispanic American Indian/Alaska Native',
-        'Percent non-Hispanic Asian', 'Percent non-Hispanic Black',
-        'Percent non-Hispanic Native Hawaiian/Pacific Islander',
-        'Percent non-Hispanic White',
-        'County Boundary',
-        'State Boundary',
-        'Geographical Point'
-    ]]
-
-    # Rename vaccine hesitancy columns to uniform short snake case for easier reference
-    # With the exception of percentages of racial categories so that they display is a more
-    # readable way.
-    hesitancy_df_final = hesitancy_df_filtered.rename({
-        'FIPS Code': 'county_fips',
-        'Estimated hesitant': 'percent_hesitant',
-        'Estimated strongly hesitant': 'percent_strongly_hesitant',
-        'Social Vulnerability Index (SVI)': 'SVI',
-        'SVI Category': 'SVI_category',
-        'Percent adults fully vaccinated against COVID-19 (as of 6/10/21)': 'percent_vaccinated',
-        'Percent non-Hispanic American Indian/Alaska Native': 'Percent American Indian/Alaska Native',
-        'Percent non-Hispanic Asian': 'Percent Asian',
-        'Percent non-Hispanic Black': 'Percent Black',
-        'Percent non-Hispanic Native Hawaiian/Pacific Islander': 'Percent Native Hawaiian/Pacific Islander',
-        'Percent non-Hispanic White': 'Percent White',
-        'County Boundary': 'county_boundary',
-        'State Boundary': 'state_boundary',
-        'Geographical Point': 'point'
-    }, axis='columns')
-
-    # Set index of both dataframes to FIPS code in place
-    community_df_final.set_index('county_fips', inplace=True)
-    hesitancy_df_final.set_index('county_fips', inplace=True)
+from pandas.api.types import union_categoricals
+
+import profiling
+from . import cache
+
+# Rows of the community levels file read per chunk
+CHUNK_ROWS = 200_000
+# Bytes at the start of a file and before the end of its last read that tell a file appended to
+# from a rewritten one (see read_position)
+POSITION_BYTES = 1 << 16
+
+# Processes parsing the WKT geometry (default: one per CPU). Below PARALLEL_MIN_BYTES of WKT text
+# (about a quarter second of serial parsing) starting the pool costs more than it saves and the
+# columns are parsed serially. The size, not the number of geometries, tells: a state boundary
+# carried by every county of the state is far longer than a county's point.
+PARSE_WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_BYTES = 8 << 20
+# Chunks per worker and column, so workers finishing early pick up more work
+CHUNKS_PER_WORKER = 4
+
+# Relevant columns of the CDC datasets and their short snake case names, for easier reference
+COMMUNITY_COLUMNS = {
+    'county': 'county',
+    'county_fips': 'county_fips',
+    'state': 'state',
+    'county_population': 'county_population',
+    'covid_hospital_admissions_per_100k': 'hospital_100k',
+    'covid_cases_per_100k': 'cases_100k',
+    'covid-19_community_level': 'community_level',
+    'date_updated': 'date_updated'
+}
+
+# Racial category percentages keep readable names since they are displayed as is
+HESITANCY_COLUMNS = {
+    'FIPS Code': 'county_fips',
+    'Estimated hesitant': 'percent_hesitant',
+    'Estimated strongly hesitant': 'percent_strongly_hesitant',
+    'Social Vulnerability Index (SVI)': 'SVI',
+    'SVI Category': 'SVI_category',
+    'Percent adults fully vaccinated against COVID-19 (as of 6/10/21)': 'percent_vaccinated',
+    'Percent Hispanic': 'Percent Hispanic',
+    'Percent non-Hispanic American Indian/Alaska Native': 'Percent American Indian/Alaska Native',
+    'Percent non-Hispanic Asian': 'Percent Asian',
+    'Percent non-Hispanic Black': 'Percent Black',
+    'Percent non-Hispanic Native Hawaiian/Pacific Islander': 'Percent Native Hawaiian/Pacific Islander',
+    'Percent non-Hispanic White': 'Percent White',
+    'County Boundary': 'county_boundary',
+    'State Boundary': 'state_boundary',
+    'Geographical Point': 'point'
+}
+
+# Parse dtypes: explicit so pandas never infers (or falls back to object for) a column. FIPS codes
+# are parsed as float since a row may be missing one, then dropped and downcast by compact().
+COMMUNITY_DTYPES = {
+    'county': object,
+    'county_fips': 'float64',
+    'state': object,
+    'county_population': 'float32',
+    'covid_hospital_admissions_per_100k': 'float32',
+    'covid_cases_per_100k': 'float32',
+    'covid-19_community_level': object,
+    'date_updated': object
+}
+
+HESITANCY_DTYPES = {column: 'float32' for column in HESITANCY_COLUMNS}
+HESITANCY_DTYPES.update({
+    'FIPS Code': 'float64',
+    'SVI Category': object,
+    'County Boundary': object,
+    'State Boundary': object,
+    'Geographical Point': object
+})
+
+# Repeated strings are stored as categoricals (small integer codes into one copy of each string).
+# date_updated is ordered by date, so its codes double as an ordinal date code.
+CATEGORY_COLUMNS = ['county', 'state', 'community_level', 'date_updated', 'SVI_category']
+ORDERED_COLUMNS = ['date_updated']
+
+COMPACT_DTYPES = {'county_fips': 'int32', **{column: 'category' for column in CATEGORY_COLUMNS}}
+
+
+@profiling.timed()
+def process(community_filename: str, hesitancy_df: str, date: str = None, cache_dir: str = None,
+            rebuild_cache: bool = False, workers: int = None) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    community_df_final, hesitancy_df_final, store_key = load_tables(community_filename, hesitancy_df,
+                                                                    cache_dir, rebuild_cache)
+    hesitancy_df_final = parse_geometry(hesitancy_df_final, workers)
+    if store_key is not None:
+        cache.store(cache_dir, store_key, community_df_final, hesitancy_df_final)
+
+    hesitancy_df_final = build_geometry_table(hesitancy_df_final)
 
     # Return filtered/renamed community and hesitancy datasets, and a dataset joined and filtered by date
+    # (None without a date)
+    if date is None:
+        return community_df_final, hesitancy_df_final, None
     return community_df_final, hesitancy_df_final, process_date(community_df_final, hesitancy_df_final, date)
 
 
-def process_date(community_df: pd.DataFrame, hesitancy_df: pd.DataFrame, date: str) -> pd.DataFrame:
+@profiling.timed()
+def load_tables(community_filename: str, hesitancy_filename: str, cache_dir: str = None,
+                rebuild_cache: bool = False) -> (pd.DataFrame, pd.DataFrame, str):
+    # Load the filtered datasets from the on-disk cache when possible (skips CSV parsing),
+    # otherwise read them from the CSVs. The geometry columns are still encoded (WKB from the
+    # cache, WKT from the CSV) so the tabular columns are usable before parse_geometry() runs.
+    # Also returns the cache key to store the parsed datasets under, None if the cache is current.
+    if cache_dir is None:
+        return read_community(community_filename), read_hesitancy(hesitancy_filename), None
+
+    key = cache.cache_key(cache_dir, community_filename, hesitancy_filename)
+    if not rebuild_cache:
+        community_df_final, hesitancy_df_final = cache.load(cache_dir, key, decode=False)
+        if community_df_final is not None:
+            return community_df_final, hesitancy_df_final, None
+
+    return read_community(community_filename), read_hesitancy(hesitancy_filename), key
+
+
+@profiling.timed()
+def parse_geometry(hesitancy_df: pd.DataFrame, workers: int = None) -> pd.DataFrame:
+    # Parse the geometry columns once here instead of on every date switch.
+    # Missing boundaries become empty (None) geometries and are dropped in process_date.
+    # WKT is parsed by a pool of worker processes (PARSE_WORKERS by default, 1 parses serially),
+    # WKB from the cache is fast to decode and always parsed here.
+    # geopandas is only needed from here on, it is imported on first use.
+    import geopandas as gpd
+
+    if workers is None:
+        workers = PARSE_WORKERS
+
+    hesitancy_df = hesitancy_df.copy()
+    encoded = {}
+    for column in cache.GEOMETRY_COLUMNS:
+        values = hesitancy_df[column]
+        encoded[column] = values.where(values.notna(), None)
+
+    wkt = [column for column in cache.GEOMETRY_COLUMNS
+           if not encoded[column].map(lambda value: isinstance(value, bytes)).any()]
+    if workers > 1 and sum(encoded[column].str.len().sum() for column in wkt) >= PARALLEL_MIN_BYTES:
+        # The workers return WKB, which decodes exactly to the geometry they parsed
+        with profiling.span('preprocessing.parse_wkt_parallel', workers=workers):
+            encoded.update(parse_wkt_parallel({column: encoded[column].to_numpy() for column in wkt}, workers))
+        wkt = []
+
+    for column in cache.GEOMETRY_COLUMNS:
+        with profiling.span('preprocessing.parse_geometry', column=column):
+            if column in wkt:
+                hesitancy_df[column] = gpd.GeoSeries.from_wkt(encoded[column])
+            else:
+                hesitancy_df[column] = gpd.GeoSeries.from_wkb(encoded[column], index=hesitancy_df.index)
+    return hesitancy_df
+
+
+def parse_wkt_parallel(columns: dict, workers: int) -> dict:
+    # Split every column into chunks and parse all of them, of all columns at once, on a process
+    # pool. Each chunk comes back as WKB, far cheaper to pickle and decode than the geometries.
+    # Returns column -> WKB array, None where the WKT is missing.
+    # The workers are started from a clean server process (or spawned), never forked from this
+    # one: the window parses on a loader thread, and forking a process running Qt threads is not safe.
+    # The server imports this module and shapely once, then forks the workers from that state.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__, 'shapely'])
+    else:
+        context = multiprocessing.get_context('spawn')
+
+    chunks = []
+    for column, values in columns.items():
+        size = max(-(-len(values) // (workers * CHUNKS_PER_WORKER)), 1)
+        chunks += [(column, values[start:start + size]) for start in range(0, len(values), size)]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(parse_wkt_chunk, values) for _, values in chunks]
+        parsed = {column: [] for column in columns}
+        for (column, _), future in zip(chunks, futures):
+            parsed[column].append(future.result())
+
+    return {column: np.concatenate(parts) if parts else np.array([], dtype=object)
+            for column, parts in parsed.items()}
+
+
+def parse_wkt_chunk(values: np.ndarray) -> np.ndarray:
+    # Worker side of parse_wkt_parallel()
+    import shapely
+
+    return shapely.to_wkb(shapely.from_wkt(values))
+
+
+def tabular_table(hesitancy_df: pd.DataFrame) -> pd.DataFrame:
+    # The counties build_geometry_table() keeps, before the geometry is parsed: lets the
+    # bubble chart join the same counties while the map geometry is still loading
+    return hesitancy_df.dropna(subset=cache.GEOMETRY_COLUMNS)
+
+
+@profiling.timed()
+def read_community(community_filename, chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    # Stream the community levels file in chunks, reading only the relevant columns. Each chunk is
+    # filtered and downcast before the next one is read, so peak memory stays close to the final frame.
+    chunks = []
+    for chunk in pd.read_csv(community_filename, usecols=list(COMMUNITY_COLUMNS),
+                             dtype=COMMUNITY_DTYPES, chunksize=chunk_rows):
+        chunks.append(compact(chunk, COMMUNITY_COLUMNS))
+
+    if not chunks:
+        return compact(pd.DataFrame(columns=list(COMMUNITY_COLUMNS)), COMMUNITY_COLUMNS)
+
+    # The chunk row numbers are not kept, rows are only ever looked up by FIPS (and date).
+    return pd.concat(merge_categories(chunks))
+
+
+def merge_categories(frames: list) -> list:
+    # Every frame has its own categories: give all of them the merged categories (in place),
+    # otherwise concatenating would fall back to object strings.
+    for column in CATEGORY_COLUMNS:
+        if column in frames[0]:
+            categories = sorted(union_categoricals([frame[column] for frame in frames], ignore_order=True).categories)
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories, ordered=column in ORDERED_COLUMNS)
+    return frames
+
+
+@profiling.timed()
+def read_new_reports(community_filename: str, position: tuple = None) -> (pd.DataFrame, tuple):
+    # Rows of the community levels file read since position (read_position), and the position to
+    # read from next time. When the file was appended to, only the rows after the previous read
+    # are parsed. A file that no longer continues from there (replaced, rewritten or truncated) is
+    # read in full. A last line still being written is left for the next read.
+    with open(community_filename, 'rb') as file:
+        header = file.readline()
+        stat = os.fstat(file.fileno())
+        offset = len(header)
+        if position is not None and len(header) < position[0] <= stat.st_size \
+                and position_of(file, position[0], stat) == position:
+            offset = position[0]
+        file.seek(offset)
+        appended = file.read(stat.st_size - offset)
+
+        complete = appended.rfind(b'\n') + 1
+        position = position_of(file, offset + complete, stat)
+
+    return read_community(io.BytesIO(header + appended[:complete])), position
+
+
+def read_position(filename: str) -> tuple:
+    # Position of a read of the whole file, for read_new_reports() to continue from
+    with open(filename, 'rb') as file:
+        stat = os.fstat(file.fileno())
+        return position_of(file, stat.st_size, stat)
+
+
+def position_of(file, offset: int, stat: os.stat_result) -> tuple:
+    # The end of a read (offset), the file it read (device and inode) and a hash of the first
+    # POSITION_BYTES of the file and of the POSITION_BYTES before offset. The file continues from
+    # the read only while all of them are the same.
+    key = hashlib.sha256()
+    file.seek(0)
+    key.update(file.read(min(offset, POSITION_BYTES)))
+    start = max(offset - POSITION_BYTES, 0)
+    file.seek(start)
+    key.update(file.read(offset - start))
+    return offset, (stat.st_dev, stat.st_ino), key.hexdigest()
+
+
+@profiling.timed()
+def append_reports(community_df: pd.DataFrame, date_frames: dict,
+                   new_df: pd.DataFrame) -> (pd.DataFrame, dict, pd.DataFrame):
+    # Add newly read rows to the community dataset and the date index. Returns the new (community
+    # dataset, date index) and the added rows. A report date can arrive over several reads: rows of
+    # a date indexed before are merged into its frame. Rows of a county and date already loaded
+    # (a file read again in full, or reports in more than one file) are dropped. The frames of the
+    # other dates are kept as they are, neither input is modified.
+    frames = [date_frames[date] for date in new_df['date_updated'].dropna().unique() if date in date_frames]
+    new_df = drop_loaded(new_df, report_keys(pd.concat(frames)) if frames else None)
+    if new_df.empty:
+        return community_df, date_frames, new_df
+
+    # Shallow copies: replacing their categorical columns leaves the inputs untouched
+    community_df, new_df = merge_categories([community_df.copy(deep=False), new_df.copy(deep=False)])
+    combined = pd.concat([community_df, new_df])
+    new_reports = combined.iloc[len(community_df):]
+
+    date_frames = dict(date_frames)
+    for date, date_df in split_dates(new_reports).items():
+        if date in date_frames:
+            date_df = pd.concat(merge_categories([date_frames[date].copy(deep=False), date_df.copy(deep=False)]))
+        date_frames[date] = date_df
+    return combined, date_frames, new_reports
+
+
+def report_keys(community_df: pd.DataFrame) -> pd.MultiIndex:
+    # (FIPS code, report date) of every report
+    return pd.MultiIndex.from_arrays([community_df.index, community_df['date_updated'].astype(object)])
+
+
+def drop_loaded(new_df: pd.DataFrame, loaded: pd.MultiIndex = None) -> pd.DataFrame:
+    # Rows of new_df for a county and date that is neither in loaded (report_keys) nor in an
+    # earlier row of new_df
+    keys = report_keys(new_df)
+    dropped = keys.duplicated()
+    if loaded is not None:
+        dropped |= keys.isin(loaded)
+    return new_df.loc[~dropped, :]
+
+
+@profiling.timed()
+def read_hesitancy(hesitancy_filename: str) -> pd.DataFrame:
+    # One row per county: read the relevant columns (WKT stays as text until parsed) in one go
+    hesitancy_df = pd.read_csv(hesitancy_filename, usecols=list(HESITANCY_COLUMNS), dtype=HESITANCY_DTYPES)
+    return compact(hesitancy_df, HESITANCY_COLUMNS)
+
+
+def compact(df: pd.DataFrame, columns: dict) -> pd.DataFrame:
+    # Rename the columns to the short snake case names (in the listed order), drop rows without
+    # a FIPS code (they can not be joined), index by the FIPS code as a 32-bit integer and
+    # turn the repeated strings into categoricals.
+    df = df[list(columns)].rename(columns, axis='columns')
+    df = df.loc[df['county_fips'].notna(), :]
+    df = df.astype({column: dtype for column, dtype in COMPACT_DTYPES.items() if column in df})
+    return df.set_index('county_fips')
+
+
+@profiling.timed()
+def build_geometry_table(hesitancy_df: pd.DataFrame) -> pd.DataFrame:
+    # Geometry depends only on the county (FIPS), not on the report date. Drop counties without
+    # boundaries and compute the county centroids once here, so per-date frames just attach to this table.
+    import geopandas as gpd
+    import shapely
+
+    geometry_df = hesitancy_df.dropna(subset=cache.GEOMETRY_COLUMNS).copy()
+    geometry_df['county_point'] = gpd.GeoSeries(geometry_df['county_boundary']).centroid
+
+    # Every county row holds its own parsed copy of its state's boundary, share one object per state
+    state_codes, state_wkb = pd.factorize(shapely.to_wkb(np.asarray(gpd.GeoSeries(geometry_df['state_boundary']))))
+    geometry_df['state_boundary'] = gpd.GeoSeries(shapely.from_wkb(state_wkb)[state_codes], index=geometry_df.index)
+    return geometry_df
+
+
+@profiling.timed()
+def split_dates(community_df: pd.DataFrame) -> dict:
+    # Split the community levels dataset into one frame per report date, so that switching
+    # dates is a dictionary lookup instead of a scan over every report.
+    return {date: date_df for date, date_df in community_df.groupby('date_updated', sort=False, observed=True)}
+
+
+@profiling.timed()
+def process_date(community_df: pd.DataFrame, hesitancy_df: pd.DataFrame, date: str,
+                 date_frames: dict = None, database=None) -> pd.DataFrame:
     # Filter the community levels dataset to only consider the passed date.
     # Check that this date is in the list of dates and raise an exception if not.
-    date_list = community_df['date_updated'].unique()
-    if date not in date_list:
-        raise Exception(f"Date not valid. Report dates: {date_list}")
-
-    # Select rows with the matching report date
-    community_df_date = community_df.loc[community_df['date_updated'] == date, :]
+    # With a database.ReportDatabase the reports of the date are queried from it instead.
+    if database is not None:
+        if date not in database.dates():
+            raise Exception(f"Date not valid. Report dates: {database.dates()}")
 
-    # Join the community dataset on the passed date with the hesitancy dataset (inner join) using the FIPS code.
-    # Since the codes are numpy.int64 type, they are automatically formatted (leading zeros are removed).
-    join = community_df_date.join(hesitancy_df, how='inner')
+        community_df_date = database.community(date)
+    elif date_frames is not None:
+        if date not in date_frames:
+            raise Exception(f"Date not valid. Report dates: {list(date_frames)}")
 
-    join.dropna(subset=['county_boundary'], inplace=True)
-    join['county_boundary'] = gpd.GeoSeries.from_wkt(join['county_boundary'])
+        community_df_date = date_frames[date]
+    else:
+        date_list = community_df['date_updated'].unique()
+        if date not in date_list:
+            raise Exception(f"Date not valid. Report dates: {date_list}")
 
-    join.dropna(subset=['state_boundary'], inplace=True)
-    join['state_boundary'] = gpd.GeoSeries.from_wkt(join['state_boundary'])
+        # Select rows with the matching report date
+        community_df_date = community_df.loc[community_df['date_updated'] == date, :]
 
-    join.dropna(subset=['point'], inplace=True)
-    join['point'] = gpd.GeoSeries.from_wkt(join['point'])
-    return join
+    # Join the community dataset on the passed date with the FIPS-indexed geometry table (inner join).
+    # Since the codes are int32, they are automatically formatted (leading zeros are removed).
+    return community_df_date.join(hesitancy_df, how='inner')
 
@@ -0,0 +1,197 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Lightweight timing spans. Disabled by default: span() then returns a shared no-op context and
+# timed() functions only pay for one flag check, so the instrumentation can stay in place.
+# Enabled, every span is recorded with its thread and nesting, and spans run inside an
+# interaction (one user action in the window) are grouped into a per-interaction breakdown.
+# Only the latest MAX_EVENTS spans and MAX_INTERACTIONS interactions are kept, so a long profiled
+# session does not grow without bound; the oldest are dropped first.
+MAX_EVENTS = 200_000
+MAX_INTERACTIONS = 2_000
+
+_enabled = False
+_events = deque(maxlen=MAX_EVENTS)
+_interactions = deque(maxlen=MAX_INTERACTIONS)
+_listeners = []
+_local = threading.local()
+_origin = time.perf_counter_ns()
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        stack = _stack()
+        self.depth = len(stack)
+        self.interaction = getattr(_local, 'interaction', None)
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _stack().pop()
+        event = {
+            'name': self.name,
+            'cat': self.category,
+            'start_ns': self.start - _origin,
+            'dur_ns': end - self.start,
+            'tid': threading.get_ident(),
+            'thread': threading.current_thread().name,
+            'depth': self.depth,
+            'args': self.args
+        }
+        self.event = event
+        _events.append(event)
+        if self.interaction is not None:
+            self.interaction['spans'].append(event)
+        return False
+
+
+class _Interaction(_Span):
+
+    def __enter__(self):
+        self.record = {'name': self.name, 'spans': []}
+        _local.interaction = self.record
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        _local.interaction = None
+
+        event = self.event
+        self.record['start_ns'] = event['start_ns']
+        self.record['dur_ns'] = event['dur_ns']
+        _interactions.append(self.record)
+        for listener in _listeners:
+            listener(self.record)
+        return False
+
+
+def _stack() -> list:
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def enable(enabled: bool = True) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    _events.clear()
+    _interactions.clear()
+
+
+def span(name: str, **args):
+    # Time the enclosed stage: with profiling.span('map.bins'): ...
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, 'stage', args)
+
+
+def interaction(name: str, **args):
+    # Time one user action, the spans run inside it (on the same thread) make up its breakdown
+    if not _enabled:
+        return _NULL_SPAN
+    # Actions triggered by another one (set_state rebuilding the map) are stages of the outer one
+    if getattr(_local, 'interaction', None) is not None:
+        return _Span(name, 'stage', args)
+    return _Interaction(name, 'interaction', args)
+
+
+def timed(name: str = None):
+    # Decorator version of span(), named after the function by default
+    def decorator(function):
+        span_name = name or f'{function.__module__.split(".")[-1]}.{function.__qualname__}'
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(span_name, 'stage', {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_listener(listener) -> None:
+    # listener(interaction) is called on the interaction's thread when it finishes
+    _listeners.append(listener)
+
+
+def breakdown(interaction_record: dict) -> list:
+    # Time of the direct stages of an interaction, slowest first: [(name, milliseconds), ...]
+    # Actions wrapping a single stage (set_state -> map_plot) are looked through
+    spans = interaction_record['spans']
+    depth = min((event['depth'] for event in spans), default=0) + 1
+    while len([event for event in spans if event['depth'] == depth]) == 1 \
+            and any(event['depth'] == depth + 1 for event in spans):
+        depth += 1
+
+    totals = {}
+    for event in spans:
+        if event['depth'] == depth:
+            totals[event['name']] = totals.get(event['name'], 0) + event['dur_ns'] / 1e6
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def summary(interaction_record: dict, stages: int = 4) -> str:
+    parts = ', '.join(f'{name} {milliseconds:.1f}' for name, milliseconds in breakdown(interaction_record)[:stages])
+    total = f'{interaction_record["name"]}: {interaction_record["dur_ns"] / 1e6:.1f} ms'
+    return f'{total} ({parts})' if parts else total
+
+
+def export(filename: str, output_format: str = 'json') -> None:
+    # 'json': per-interaction breakdown plus the spans run outside interactions (startup, workers).
+    # 'chrome': Chrome trace event format, open it in chrome://tracing or Perfetto.
+    if output_format == 'chrome':
+        pid = os.getpid()
+        trace = {'traceEvents': [{'name': event['name'], 'cat': event['cat'], 'ph': 'X',
+                                  'ts': event['start_ns'] / 1000, 'dur': event['dur_ns'] / 1000,
+                                  'pid': pid, 'tid': event['tid'], 'args': event['args']} for event in _events],
+                 'displayTimeUnit': 'ms'}
+    else:
+        in_interactions = {id(event) for record in _interactions for event in record['spans']}
+        trace = {
+            'interactions': [{
+                'name': record['name'],
+                'start_ms': record['start_ns'] / 1e6,
+                'total_ms': record['dur_ns'] / 1e6,
+                'stages': [{'name': name, 'ms': milliseconds} for name, milliseconds in breakdown(record)],
+                'spans': [{'name': event['name'], 'start_ms': event['start_ns'] / 1e6, 'ms': event['dur_ns'] / 1e6,
+                           'depth': event['depth'], 'args': event['args']} for event in record['spans']]
+            } for record in _interactions],
+            'other_spans': [{'name': event['name'], 'thread': event['thread'], 'start_ms': event['start_ns'] / 1e6,
+                             'ms': event['dur_ns'] / 1e6, 'depth': event['depth'], 'args': event['args']}
+                            for event in _events if id(event) not in in_interactions and event['cat'] == 'stage']
+        }
+
+    with open(filename, 'w') as file:
+        json.dump(trace, file, indent=1, default=str)
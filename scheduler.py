@@ -0,0 +1,110 @@
+import traceback
+from functools import partial
+
+from PyQt5 import QtCore
+
+# Quiet period after the last parameter change before work is started. Slider drags emit
+# valueChanged for every tick, so anything shorter just rebuilds charts nobody sees.
+DEBOUNCE_MS = 40
+
+
+class _JobSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(object, object)
+
+
+class _Job(QtCore.QRunnable):
+
+    def __init__(self, fn, on_done, on_error, signals: _JobSignals):
+        super(_Job, self).__init__()
+        self.fn = fn
+        self.on_done = on_done
+        self.on_error = on_error
+        self.signals = signals
+
+    def run(self):
+        try:
+            result = self.fn()
+        except Exception as error:
+            if self.on_error is not None:
+                self.signals.finished.emit(self.on_error, error)
+                return
+            # A failed job still reports back (with no result) so its caller does not wait forever
+            traceback.print_exc()
+            result = None
+        self.signals.finished.emit(self.on_done, result)
+
+
+class Worker(QtCore.QObject):
+    # A single worker thread running jobs one at a time, in order. start(fn, on_done, on_error)
+    # calls fn() on the worker thread, then on_done(result) on the Qt main thread. A job that
+    # raises calls on_error(error) instead, or without one prints the traceback and calls
+    # on_done(None).
+
+    def __init__(self, parent=None):
+        super(Worker, self).__init__(parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+        self.signals = _JobSignals(self)
+        self.signals.finished.connect(self.finished)
+
+    def start(self, fn, on_done=None, on_error=None):
+        self.pool.start(_Job(fn, on_done, on_error, self.signals))
+
+    def clear(self):
+        # Drop the queued jobs, the running one still finishes
+        self.pool.clear()
+
+    def finished(self, callback, value):
+        if callback is not None:
+            callback(value)
+
+
+class RenderScheduler(QtCore.QObject):
+    # Coalesces bursts of redraw requests. Each request pairs a compute callable, run on a
+    # worker thread, with a draw callable, run on the Qt main thread with the computed result.
+    # Only the most recent request is ever drawn; stale results are dropped on arrival.
+
+    def __init__(self, delay_ms: int = DEBOUNCE_MS, parent=None):
+        super(RenderScheduler, self).__init__(parent)
+        self.generation = 0
+        self.pending = None
+        self.draw = None
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(self.submit)
+
+        # A single worker: queued jobs are always stale by the time a newer one arrives
+        self.worker = Worker(self)
+
+    def request(self, compute, draw):
+        self.generation += 1
+        self.pending = (self.generation, compute, draw)
+        self.timer.start()
+
+    def cancel(self):
+        # Forget pending and in-flight work, e.g. when the user switches to another view
+        self.generation += 1
+        self.pending = None
+        self.draw = None
+        self.timer.stop()
+        self.worker.clear()
+
+    def submit(self):
+        if self.pending is None:
+            return
+
+        generation, compute, self.draw = self.pending
+        self.pending = None
+        self.worker.clear()
+        self.worker.start(compute, partial(self.finished, generation))
+
+    def finished(self, generation: int, result):
+        if generation != self.generation or self.draw is None:
+            return
+
+        draw, self.draw = self.draw, None
+        if result is not None:
+            draw(result)
@@ -0,0 +1,18 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path: str):
+    # Yields a temporary path next to path to write to, moved over path once the block finishes.
+    # An interrupted write never leaves a half-written file behind, and the process id in the
+    # name keeps processes writing the same file at once from clobbering each other's temporary.
+    temporary = f'{path}.{os.getpid()}.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The modules import each other from the repository root, like when main.py is run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import synthetic  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def synthetic_files(tmp_path_factory) -> (str, str):
+    # Small community levels and vaccine hesitancy CSVs: 200 counties over 6 report dates
+    return synthetic.generate(str(tmp_path_factory.mktemp('synthetic')), counties=200, dates=6, vertices=8)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from visualizations import binning
+
+
+def sample(kind: str) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    if kind == 'continuous':
+        values = rng.gamma(2, 80, 3000)
+    elif kind == 'ties':
+        # Repeated values collapse some of the quantile edges
+        values = rng.integers(0, 4, 3000).astype(np.float64)
+    else:
+        values = rng.uniform(0, 1, 3000).round(2)
+    values[rng.random(len(values)) < 0.05] = np.nan
+    return values
+
+
+@pytest.mark.parametrize('kind', ['continuous', 'ties', 'rounded'])
+@pytest.mark.parametrize('q', [4, 5, 9])
+def test_same_as_qcut(kind, q):
+    values = sample(kind)
+    expected = pd.qcut(values, q, duplicates='drop', precision=2)
+    bins = binning.QuantileBins(values, q)
+
+    assert bins.labels == [str(category) for category in expected.categories]
+    assert np.array_equal(bins.color_index[bins.codes(values)], expected.codes)
+
+
+def test_missing_values():
+    values = np.full(10, np.nan)
+    bins = binning.QuantileBins(values, 5)
+    assert bins.labels == []
+    assert (bins.colors(values) == binning.MISSING_COLOR).all()
+
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing import preprocessing
+from visualizations import binning, bubble_chart
+
+
+@pytest.fixture(scope='module')
+def date_data(synthetic_files):
+    community_filename, hesitancy_filename = synthetic_files
+    community_df = preprocessing.read_community(community_filename)
+    hesitancy_df = preprocessing.tabular_table(preprocessing.read_hesitancy(hesitancy_filename))
+    return preprocessing.process_date(community_df, hesitancy_df, community_df['date_updated'].min())
+
+
+def scan(data, svi_min_threshold, svi_max_threshold, population_threshold) -> np.ndarray:
+    # The column scans the index replaces
+    complete = data.notna().all(axis=1)
+    keep = complete & (data['SVI'] >= svi_min_threshold) & (data['SVI'] <= svi_max_threshold) \
+        & (data['county_population'] >= population_threshold)
+    return np.flatnonzero(keep.to_numpy())
+
+
+@pytest.mark.parametrize('thresholds', [(0.0, 1.0, 0), (0.1, 0.9, 5000), (0.4, 0.6, 100_000),
+                                        (0.5, 0.5, 0), (0.9, 0.1, 0), (0.0, 1.0, 10_000_000)])
+def test_same_rows_as_scan(date_data, thresholds):
+    index = bubble_chart.FilterIndex(date_data)
+    assert np.array_equal(index.rows(*thresholds), scan(date_data, *thresholds))
+
+
+def test_thresholds_on_values(date_data):
+    # Thresholds equal to values of the frame keep those rows, like the scans
+    index = bubble_chart.FilterIndex(date_data)
+    svi = date_data['SVI'].dropna().sort_values().to_numpy()
+    population = date_data['county_population'].dropna().sort_values().to_numpy()
+    for thresholds in [(svi[10], svi[-10], population[20]), (svi[0], svi[0], population[0])]:
+        assert np.array_equal(index.rows(*thresholds), scan(date_data, *thresholds))
+
+
+def test_filter_data(date_data):
+    filtered = bubble_chart.filter_data(date_data, 'SVI', 0.1, 0.9, 5000)
+    assert filtered['county_fips'].tolist() == date_data.index[scan(date_data, 0.1, 0.9, 5000)].tolist()
+
+
+@pytest.mark.parametrize('thresholds', [(0.0, 1.0, 0), (0.1, 0.9, 5000), (0.4, 0.6, 100_000), (0.5, 0.5, 0)])
+def test_median_from_index(date_data, thresholds):
+    # The median read from the index is the one the column partition gives
+    index = bubble_chart.FilterIndex(date_data)
+    rows = index.rows(*thresholds)
+    for column in ['SVI', 'Percent Hispanic', 'Percent White', 'county_population']:
+        if len(rows):
+            values = date_data[column].to_numpy()[rows]
+            assert index.median(column, rows) == np.partition(values, len(values) // 2)[len(values) // 2]
+
+    filtered = bubble_chart.filter_data(date_data, 'Percent Asian', *thresholds, index=index)
+    if len(filtered):
+        labels = bubble_chart.size_labels(filtered, 'Percent Asian')
+        filtered.attrs.clear()
+        assert labels == bubble_chart.size_labels(filtered, 'Percent Asian')
+
+
+def test_missing_level_colors():
+    # A county without a community level is drawn in the missing color, not in the last level's
+    color_map = bubble_chart.level_color_map()
+    colors = bubble_chart.level_colors(pd.Series(['Low', np.nan, 'High', None], dtype=object))
+    assert colors.tolist() == [color_map['Low'], binning.MISSING_COLOR, color_map['High'], binning.MISSING_COLOR]
+    assert bubble_chart.level_colors(pd.Series([np.nan, np.nan])).tolist() == [binning.MISSING_COLOR] * 2
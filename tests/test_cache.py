@@ -0,0 +1,64 @@
+import os
+
+from preprocessing import cache
+
+
+def hashed_files(monkeypatch) -> list:
+    # The files cache_key reads and hashes
+    hashed = []
+    file_digest = cache.file_digest
+    monkeypatch.setattr(cache, 'file_digest', lambda filename: hashed.append(filename) or file_digest(filename))
+    return hashed
+
+
+def set_mtime(filename: str, seconds: int):
+    # A modification time well before the hashing, so the digest is trusted
+    os.utime(filename, ns=(seconds * 1_000_000_000, seconds * 1_000_000_000))
+
+
+def test_hashed_only_when_changed(tmp_path, monkeypatch):
+    hashed = hashed_files(monkeypatch)
+    cache_dir = str(tmp_path / 'cache')
+    first, second = str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv')
+    for filename in [first, second]:
+        with open(filename, 'w') as file:
+            file.write('a,b\n1,2\n')
+        set_mtime(filename, 1_600_000_000)
+
+    key = cache.cache_key(cache_dir, first, second)
+    assert hashed == [first, second]
+
+    # Same size and modification time: the stored digests are used
+    assert cache.cache_key(cache_dir, first, second) == key
+    assert hashed == [first, second]
+
+    # Touched but not changed: hashed again, same key
+    set_mtime(second, 1_600_000_100)
+    assert cache.cache_key(cache_dir, first, second) == key
+    assert hashed == [first, second, second]
+
+    # Rewritten with the same size and modification time as before the change: with the digests
+    # gone the contents tell
+    with open(first, 'w') as file:
+        file.write('a,b\n1,3\n')
+    set_mtime(first, 1_600_000_000)
+    os.remove(os.path.join(cache_dir, cache.DIGESTS_FILE))
+    assert cache.cache_key(cache_dir, first, second) != key
+
+
+def test_recent_file_hashed_again(tmp_path, monkeypatch):
+    # A file modified right before it was hashed may change again within the same mtime: its
+    # digest is not trusted
+    hashed = hashed_files(monkeypatch)
+    cache_dir = str(tmp_path / 'cache')
+    filename = str(tmp_path / 'reports.csv')
+    with open(filename, 'w') as file:
+        file.write('a,b\n1,2\n')
+    stat = os.stat(filename)
+
+    key = cache.cache_key(cache_dir, filename)
+    with open(filename, 'w') as file:
+        file.write('a,b\n1,3\n')
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.cache_key(cache_dir, filename) != key
+    assert hashed == [filename, filename]
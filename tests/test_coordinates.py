@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from visualizations import coordinates
+
+
+@pytest.fixture(scope='module')
+def coverage() -> pd.DataFrame:
+    # Counties of a coverage: the cells between wavy lines (neighbours share their vertices
+    # exactly), one of them with an enclave in a hole, and an island
+    rng = np.random.default_rng(0)
+    steps = np.linspace(0, 6, 120)
+    lines = []
+    for line in range(7):
+        wave = 0.2 * np.sin(steps * rng.uniform(2, 6)) * (0 < line < 6)
+        lines += [shapely.linestrings(np.column_stack([steps, line + wave])),
+                  shapely.linestrings(np.column_stack([line + wave, steps]))]
+    cells = list(shapely.get_parts(shapely.polygonize(shapely.get_parts(shapely.union_all(lines)))))
+    enclave = shapely.Point(cells[0].centroid).buffer(0.2)
+    cells[0] = cells[0].difference(enclave)
+    cells += [enclave, shapely.Point(8, 8).buffer(0.5)]
+    return pd.DataFrame({'county_boundary': cells}, index=pd.Index(np.arange(len(cells)) + 1001, name='county_fips'))
+
+
+def table_polygons(table) -> np.ndarray:
+    # A polygon of the first ring (shell) and the holes of every geometry of a flat table
+    coords, codes, offsets = table
+    polygons = []
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        rings = np.split(coords[start:stop], np.flatnonzero(codes[start:stop] == coordinates.Path.MOVETO)[1:])
+        polygons.append(shapely.Polygon(rings[0], rings[1:]))
+    return np.array(polygons, dtype=object)
+
+
+@pytest.mark.parametrize('tolerance', [0.01, 0.05, 0.2])
+def test_neighbours_stay_flush(coverage, tolerance):
+    store = coordinates.CoordinateStore(coverage)
+    full = store.level(0)
+    simplified = store.level(tolerance)
+    assert len(simplified[0]) < len(full[0])
+    assert len(simplified[2]) == len(full[2])
+    assert np.count_nonzero(simplified[1] == coordinates.Path.MOVETO) == np.count_nonzero(full[1] == 1)
+
+    # Simplified on their own the cells would overlap and open gaps between them: together they
+    # tile the same region, without slivers
+    polygons = shapely.make_valid(table_polygons(simplified))
+    union = shapely.union_all(polygons)
+    assert shapely.area(polygons).sum() == pytest.approx(union.area, abs=1e-9)
+    assert sum(len(part.interiors) for part in shapely.get_parts(union)) == 0
+    assert union.area == pytest.approx(shapely.union_all(coverage['county_boundary'].to_numpy()).area,
+                                       rel=0.02)
+
+
+def test_full_level_is_exact(coverage):
+    store = coordinates.CoordinateStore(coverage)
+    polygons = table_polygons(store.level(0))
+    assert shapely.equals_exact(polygons, coverage['county_boundary'].to_numpy(), tolerance=0).all()
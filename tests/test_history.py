@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing import database, preprocessing
+from visualizations import history
+
+
+@pytest.fixture(scope='module')
+def community_df(synthetic_files):
+    return preprocessing.read_community(synthetic_files[0])
+
+
+def assert_same_history(result, expected):
+    assert result.dates == expected.dates
+    assert sorted(result.fips) == sorted(expected.fips)
+    rows = result.fips.get_indexer(expected.fips)
+    for column in history.HISTORY_COLUMNS:
+        assert np.array_equal(result.arrays[column][rows], expected.arrays[column],
+                              equal_nan=column != 'community_level')
+
+
+def test_same_as_pivot_table(community_df):
+    result = history.build_history(community_df)
+    reports = community_df.reset_index()
+    for column in ['cases_100k', 'hospital_100k']:
+        expected = reports.pivot(index='county_fips', columns='date_updated', values=column)
+        expected.columns = expected.columns.astype(str)
+        assert np.array_equal(result.table(column).loc[expected.index, expected.columns].to_numpy(),
+                              expected.to_numpy(dtype=np.float32), equal_nan=True)
+
+    fips = community_df.index[0]
+    levels = community_df.loc[[fips], ['date_updated', 'community_level']]
+    assert result.series(fips, 'community_level').astype(object).tolist() == \
+        levels.set_index(levels['date_updated'].astype(str))['community_level'].astype(object).tolist()
+
+
+def test_extend_history(community_df):
+    dates = sorted(community_df['date_updated'].unique())
+    old = community_df[community_df['date_updated'].isin(dates[:-2])]
+    # New dates, and a new county only reported on them
+    new = pd.concat([community_df[community_df['date_updated'].isin(dates[-2:])],
+                     community_df[community_df['date_updated'] == dates[-1]].iloc[:1].set_axis([99999])])
+    extended = history.extend_history(history.build_history(old), new)
+    assert_same_history(extended, history.build_history(pd.concat([old, new])))
+    assert extended.row(99999) >= 0 and np.isnan(extended.series(99999, 'cases_100k')[:-1]).all()
+
+
+def test_in_database(community_df, synthetic_files, tmp_path):
+    reports = database.ReportDatabase(str(tmp_path / 'reports.sqlite'))
+    reports.build(community_df, preprocessing.read_hesitancy(synthetic_files[1]), [])
+    assert_same_history(history.build_history(None, reports), history.build_history(community_df))
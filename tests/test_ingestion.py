@@ -0,0 +1,141 @@
+
+import numpy as np
+import pytest
+
+from ingestion import ReportIngester
+from preprocessing import database, preprocessing
+from visualizations import binning, history, rollups, stream_graph
+
+COUNTIES = 200
+
+
+def read_lines(filename: str) -> (bytes, list):
+    with open(filename, 'rb') as file:
+        header, *lines = file.readlines()
+    return header, lines
+
+
+def test_read_again_adds_nothing(synthetic_files):
+    community_filename, _ = synthetic_files
+    community_df = preprocessing.read_community(community_filename)
+    date_frames = preprocessing.split_dates(community_df)
+
+    # A file read again in full (replaced, or a second file with the same reports) adds no rows
+    new_df, _ = preprocessing.read_new_reports(community_filename)
+    combined, extended, new_reports = preprocessing.append_reports(community_df, date_frames, new_df)
+    assert new_reports.empty
+    assert combined is community_df and extended is date_frames
+
+
+def start_ingester(synthetic_files, tmp_path, in_database: bool, lines: list) -> (ReportIngester, str, list):
+    # Ingester on top of a community file holding the header and lines, the file and a list
+    # collecting the updates it delivers
+    community_filename, hesitancy_filename = synthetic_files
+    header, _ = read_lines(community_filename)
+    live = str(tmp_path / 'community.csv')
+    with open(live, 'wb') as file:
+        file.writelines([header, *lines])
+
+    hesitancy_df = preprocessing.tabular_table(preprocessing.read_hesitancy(hesitancy_filename))
+    community_df = preprocessing.read_community(live)
+    date_frames = preprocessing.split_dates(community_df)
+    reports = None
+    if in_database:
+        reports = database.ReportDatabase(str(tmp_path / 'reports.sqlite'))
+        reports.build(community_df, hesitancy_df, [live, hesitancy_filename])
+        community_df, date_frames = None, None
+
+    ingester = ReportIngester()
+    ingester.datasets = {'community_df': community_df, 'hesitancy_df': hesitancy_df, 'date_frames': date_frames,
+                         'database': reports, 'stream_cube': stream_graph.build_cube(community_df, reports),
+                         'state_rollups': rollups.build_rollups(community_df, hesitancy_df, reports),
+                         'county_history': history.build_history(community_df, reports),
+                         'map_bins': binning.BinCache()}
+    ingester.positions[live] = preprocessing.read_position(live)
+    updates = []
+    ingester.ingested.connect(updates.append)
+    return ingester, live, updates
+
+
+def test_rewritten_file_read_in_full(synthetic_files, tmp_path):
+    header, lines = read_lines(synthetic_files[0])
+    live = str(tmp_path / 'community.csv')
+    with open(live, 'wb') as file:
+        file.writelines([header, *lines[:100]])
+    position = preprocessing.read_position(live)
+
+    # Rewritten with other rows, a line still ends where the last read did
+    rewritten = [line.replace(b'County', b'Parish') for line in lines[:100]]
+    assert sum(map(len, rewritten)) == sum(map(len, lines[:100]))
+    with open(live, 'wb') as file:
+        file.writelines([header, *rewritten, *lines[100:110]])
+    new_df, _ = preprocessing.read_new_reports(live, position)
+    assert len(new_df) == 110
+
+    # Appended to, only the new rows are read
+    with open(live, 'wb') as file:
+        file.writelines([header, *lines[:110]])
+    new_df, _ = preprocessing.read_new_reports(live, position)
+    assert len(new_df) == 10
+
+
+@pytest.mark.parametrize('in_database', [False, True])
+def test_failed_ingest_read_again(synthetic_files, tmp_path, monkeypatch, in_database):
+    _, lines = read_lines(synthetic_files[0])
+    ingester, live, updates = start_ingester(synthetic_files, tmp_path, in_database, lines[:-COUNTIES])
+    with open(live, 'ab') as file:
+        file.writelines(lines[-COUNTIES:])
+
+    extend_cube = stream_graph.extend_cube
+    monkeypatch.setattr(stream_graph, 'extend_cube', lambda *args: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        ingester.ingest_file(live)
+    assert not updates
+
+    monkeypatch.setattr(stream_graph, 'extend_cube', extend_cube)
+    ingester.ingest_file(live)
+    assert len(updates) == 1 and len(updates[0]['dates']) == 1
+    last = updates[0]['dates'][0]
+    assert updates[0]['county_history'].series(preprocessing.read_community(live).index[-1], 'cases_100k').index[-1] \
+        == last
+
+
+@pytest.mark.parametrize('in_database', [False, True])
+def test_date_in_two_chunks(synthetic_files, tmp_path, in_database):
+    community_filename, _ = synthetic_files
+    _, lines = read_lines(community_filename)
+    ingester, live, updates = start_ingester(synthetic_files, tmp_path, in_database, lines[:-COUNTIES])
+    reports = ingester.datasets['database']
+
+    # The last report date arrives in two chunks, the second one repeating a few rows of the first
+    for chunk in [lines[-COUNTIES:-80], lines[-90:]]:
+        with open(live, 'ab') as file:
+            file.writelines(chunk)
+        ingester.ingest_file(live)
+
+    last = preprocessing.read_community(community_filename)['date_updated'].max()
+    assert [(update['dates'], update['updated']) for update in updates] == [([last], []), ([], [last])]
+
+    # Every dataset is the same as when the whole file is loaded at once
+    full_df = preprocessing.read_community(community_filename)
+    update = updates[-1]
+    if in_database:
+        assert len(reports.community(last)) == COUNTIES
+    else:
+        assert len(update['date_frames'][last]) == COUNTIES
+        assert len(update['community_df']) == len(full_df)
+
+    expected_cube = stream_graph.build_cube(full_df)
+    for attribute, counts in expected_cube.items():
+        assert np.array_equal(update['stream_cube'][attribute].to_numpy(), counts.to_numpy())
+
+    expected_rollups = rollups.build_rollups(full_df, ingester.datasets['hesitancy_df'])
+    assert np.allclose(update['state_rollups'].state_means, expected_rollups.state_means, equal_nan=True)
+    assert np.allclose(update['state_rollups'].national_means, expected_rollups.national_means, equal_nan=True)
+
+    expected_history = history.build_history(full_df)
+    county_history = update['county_history']
+    assert county_history.dates == expected_history.dates
+    for column in history.HISTORY_COLUMNS:
+        assert np.array_equal(expected_history.table(column).reindex(county_history.fips).to_numpy(),
+                              county_history.arrays[column], equal_nan=column != 'community_level')
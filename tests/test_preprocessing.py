@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+from preprocessing import cache, preprocessing
+
+
+def test_parallel_parse_same_as_serial(synthetic_files, monkeypatch):
+    _, hesitancy_filename = synthetic_files
+    hesitancy_df = preprocessing.read_hesitancy(hesitancy_filename)
+    # The synthetic geometry is far below the threshold, parse it on the pool anyway
+    monkeypatch.setattr(preprocessing, 'PARALLEL_MIN_BYTES', 0)
+
+    serial = preprocessing.parse_geometry(hesitancy_df, workers=1)
+    parallel = preprocessing.parse_geometry(hesitancy_df, workers=2)
+
+    other = [column for column in serial if column not in cache.GEOMETRY_COLUMNS]
+    pd.testing.assert_frame_equal(parallel[other], serial[other])
+    for column in cache.GEOMETRY_COLUMNS:
+        assert parallel[column].index.equals(serial[column].index)
+        expected = np.asarray(serial[column])
+        result = np.asarray(parallel[column])
+        missing = pd.isna(expected)
+        assert np.array_equal(pd.isna(result), missing)
+        assert missing.sum() < len(expected)
+        assert shapely.equals_exact(result[~missing], expected[~missing], tolerance=0).all()
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing import database, preprocessing
+from visualizations import rollups
+
+
+@pytest.fixture(scope='module')
+def tables(synthetic_files):
+    community_filename, hesitancy_filename = synthetic_files
+    return (preprocessing.read_community(community_filename),
+            preprocessing.tabular_table(preprocessing.read_hesitancy(hesitancy_filename)))
+
+
+def weighted_means(joined: pd.DataFrame, keys: list) -> pd.DataFrame:
+    # Population weighted means the groupby way, counties without a value or population left out
+    means = {}
+    for column in rollups.ROLLUP_COLUMNS:
+        present = joined[joined[column].notna() & joined['county_population'].notna()]
+        weights = present['county_population'].astype(np.float64)
+        sums = (present[column].astype(np.float64) * weights).groupby([present[key] for key in keys]).sum()
+        means[column] = sums / weights.groupby([present[key] for key in keys]).sum()
+    return pd.DataFrame(means)
+
+
+def assert_same_rollups(result, expected):
+    assert list(result.state_means.index) == list(expected.state_means.index)
+    assert np.allclose(result.state_means, expected.state_means, equal_nan=True)
+    assert list(result.national_means.index) == list(expected.national_means.index)
+    assert np.allclose(result.national_means, expected.national_means, equal_nan=True)
+
+
+def test_same_as_groupby(tables):
+    community_df, hesitancy_df = tables
+    joined = rollups.join(community_df, hesitancy_df)
+    joined['date_updated'] = joined['date_updated'].astype(str)
+    joined['state'] = joined['state'].astype(str)
+    result = rollups.build_rollups(community_df, hesitancy_df)
+
+    state_means = weighted_means(joined, ['date_updated', 'state'])
+    assert np.allclose(result.state_means.loc[state_means.index, state_means.columns], state_means, equal_nan=True)
+    national_means = weighted_means(joined, ['date_updated'])
+    assert np.allclose(result.national_means.loc[national_means.index, national_means.columns], national_means,
+                       equal_nan=True)
+
+
+def test_extend_rollups(tables):
+    community_df, hesitancy_df = tables
+    last = community_df['date_updated'] == community_df['date_updated'].max()
+    extended = rollups.extend_rollups(rollups.build_rollups(community_df[~last], hesitancy_df),
+                                      community_df[last], hesitancy_df)
+    assert_same_rollups(extended, rollups.build_rollups(community_df, hesitancy_df))
+
+
+def test_in_database(tables, tmp_path):
+    community_df, hesitancy_df = tables
+    last = community_df['date_updated'] == community_df['date_updated'].max()
+    reports = database.ReportDatabase(str(tmp_path / 'reports.sqlite'))
+    reports.build(community_df[~last], hesitancy_df, [])
+    built = rollups.build_rollups(None, hesitancy_df, reports)
+    extended = rollups.extend_rollups(built, reports.append(community_df[last]), hesitancy_df, reports)
+    assert_same_rollups(extended, rollups.build_rollups(community_df, hesitancy_df))
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from preprocessing import database, preprocessing
+from visualizations import stream_graph
+
+
+@pytest.fixture(scope='module')
+def community_df(synthetic_files):
+    return preprocessing.read_community(synthetic_files[0])
+
+
+def split_last_date(community_df):
+    last = community_df['date_updated'] == community_df['date_updated'].max()
+    return community_df.loc[~last, :], community_df.loc[last, :]
+
+
+def assert_same_cube(cube, expected):
+    assert list(cube) == list(expected)
+    for attribute, counts in expected.items():
+        assert list(cube[attribute].index) == list(counts.index)
+        assert np.array_equal(cube[attribute].to_numpy(), counts.to_numpy())
+
+
+def test_extend_cube(community_df):
+    old_df, new_df = split_last_date(community_df)
+    combined, _, new_reports = preprocessing.append_reports(old_df, preprocessing.split_dates(old_df), new_df)
+    cube = stream_graph.extend_cube(stream_graph.build_cube(old_df), combined, new_reports)
+    assert_same_cube(cube, stream_graph.build_cube(community_df))
+
+
+def test_extend_cube_in_database(community_df, synthetic_files, tmp_path):
+    old_df, new_df = split_last_date(community_df)
+    reports = database.ReportDatabase(str(tmp_path / 'reports.sqlite'))
+    reports.build(old_df, preprocessing.read_hesitancy(synthetic_files[1]), [])
+    cube = stream_graph.build_cube(None, reports)
+    new_reports = reports.append(new_df)
+    assert_same_cube(stream_graph.extend_cube(cube, None, new_reports, reports), stream_graph.build_cube(community_df))
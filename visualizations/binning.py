@@ -0,0 +1,121 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from bokeh import palettes
+
+import profiling
+
+MISSING_COLOR = 'lightgray'
+
+
+class QuantileBins:
+    # Quantile bins of one attribute over one set of counties, equivalent to
+    # pd.qcut(values, q, duplicates='drop', precision=precision): same edges, same right closed
+    # bins (the first one also closed on the left) and same interval labels. Bins are assigned
+    # with a single searchsorted and colored by indexing an integer palette array, instead of
+    # building Interval categories and looking colors up by their string per county.
+
+    def __init__(self, values, q: int, precision: int = 2):
+        values = np.asarray(values)
+        present = values[~np.isnan(values)]
+
+        with profiling.span('binning.quantile'):
+            edges = np.quantile(present, np.linspace(0, 1, q + 1)) if len(present) else np.array([])
+        unique = np.unique(edges)
+        if len(unique) < len(edges) and len(edges) != 2:
+            edges = unique
+        self.edges = edges
+
+        # Like the categories of pd.qcut's result, only the bins holding a county get a label and
+        # a color, ordered from the lowest bin up. The last palette entry colors missing values.
+        codes = self.codes(values)
+        occupied = np.bincount(codes[codes >= 0], minlength=max(len(edges) - 1, 0)) > 0
+        self.labels = [label for label, used in zip(interval_labels(edges, precision), occupied) if used]
+        self.palette = np.array([*palettes.cividis(len(self.labels)), MISSING_COLOR], dtype=object)
+
+        # Bin -> palette index, empty bins and missing values (-1) -> MISSING_COLOR
+        self.color_index = np.append(np.where(occupied, np.cumsum(occupied) - 1, -1), -1)
+
+    def codes(self, values) -> np.ndarray:
+        # Bin of every value, -1 for missing values and values outside the edges
+        values = np.asarray(values)
+        if len(self.edges) < 2:
+            return np.full(len(values), -1, dtype=np.intp)
+
+        codes = np.searchsorted(self.edges, values, side='left')
+        codes[values == self.edges[0]] = 1
+        codes -= 1
+        codes[(codes < 0) | (codes >= len(self.edges) - 1)] = -1
+        return codes
+
+    def colors(self, values=None, codes: np.ndarray = None) -> np.ndarray:
+        # Color of every value (or of already assigned bin codes)
+        if codes is None:
+            codes = self.codes(values)
+        return self.palette[self.color_index[codes]]
+
+
+class BinCache:
+    # Quantile bins by (attribute, scope, date). The edges of a report date only change when more
+    # of its reports arrive (forget), so recoloring the map for a date, attribute or view seen
+    # before skips the quantiles entirely.
+
+    def __init__(self):
+        self.bins = {}
+        self.lock = threading.Lock()
+
+    def get(self, attribute: str, scope: str, date: str, values, q: int) -> QuantileBins:
+        key = (attribute, scope, date)
+        with self.lock:
+            bins = self.bins.get(key)
+        if bins is None:
+            bins = QuantileBins(values, q)
+            with self.lock:
+                self.bins[key] = bins
+        return bins
+
+    def forget(self, date: str) -> None:
+        # Drop the bins of a report date, e.g. after more of its reports were added
+        with self.lock:
+            self.bins = {key: bins for key, bins in self.bins.items() if key[2] != date}
+
+
+def quantile_bins(values, q: int, cache: BinCache = None, attribute: str = None, scope: str = None,
+                  date: str = None) -> QuantileBins:
+    # Bins of values, from the cache when one is given
+    if cache is None or date is None:
+        return QuantileBins(values, q)
+    return cache.get(attribute, scope, date, values, q)
+
+
+def interval_labels(edges: np.ndarray, precision: int) -> list:
+    # Interval labels of the bins, formatted exactly like pd.qcut's categories. Only a handful of
+    # edges, so pandas formats them.
+    if len(edges) < 2:
+        return []
+    precision = infer_precision(precision, edges)
+    breaks = [round_fraction(edge, precision) for edge in edges]
+    # The first bin is closed on the left too, widen it by the precision like pandas does
+    breaks[0] = breaks[0] - 10 ** (-precision)
+    return [str(interval) for interval in pd.IntervalIndex.from_breaks(breaks, closed='right')]
+
+
+def round_fraction(x, precision: int):
+    # Round to precision significant digits of the fractional part
+    if not np.isfinite(x) or x == 0:
+        return x
+    fraction, whole = np.modf(x)
+    if whole == 0:
+        digits = -int(np.floor(np.log10(abs(fraction)))) - 1 + precision
+    else:
+        digits = precision
+    return np.around(x, digits)
+
+
+def infer_precision(base_precision: int, edges: np.ndarray) -> int:
+    # Smallest precision from base_precision up that keeps the rounded edges distinct
+    for precision in range(base_precision, 20):
+        if np.unique([round_fraction(edge, precision) for edge in edges]).size == edges.size:
+            return precision
+    return base_precision
@@ -0,0 +1,54 @@
+from matplotlib.backend_bases import FigureCanvasBase
+
+
+class BlitManager:
+    # Keeps a cached background of the figure without its dynamic artists, so that updates to
+    # those artists only restore the background and redraw them instead of rendering the whole figure.
+    # Dynamic artists are marked animated, which excludes them from regular canvas draws.
+
+    def __init__(self, canvas: FigureCanvasBase):
+        self.canvas = canvas
+        self.background = None
+        self.artists = []
+        self.cid = canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add_artist(self, artist):
+        if artist is None or artist in self.artists:
+            return
+        artist.set_animated(True)
+        self.artists.append(artist)
+
+    def set_artists(self, artists: list):
+        for artist in self.artists:
+            if artist not in artists:
+                artist.set_animated(False)
+        self.artists = []
+        for artist in artists:
+            self.add_artist(artist)
+
+    def clear(self):
+        # Called whenever the figure is rebuilt from scratch
+        self.artists = []
+        self.background = None
+
+    def on_draw(self, event):
+        # A full draw happened (first show, resize, hover annotation...): refresh the background
+        if event is not None and event.canvas is not self.canvas:
+            return
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.draw_animated()
+
+    def draw_animated(self):
+        figure = self.canvas.figure
+        for artist in self.artists:
+            if artist.figure is figure:
+                figure.draw_artist(artist)
+
+    def update(self):
+        if self.background is None:
+            self.canvas.draw()
+            return
+
+        self.canvas.restore_region(self.background)
+        self.draw_animated()
+        self.canvas.blit(self.canvas.figure.bbox)
@@ -9,17 +9,237 @@ from matplotlib import axes
 from matplotlib.lines import Line2D
 
 from matplotlib import colors as mplcolors
+from matplotlib.image import AxesImage
 from mplcursors import cursor
 
+import profiling
+from .binning import MISSING_COLOR
+
+LEVEL_CATEGORIES = ['Low', 'Medium', 'High']
+
+# Above this many points in view, the chart shows a density raster per community level
+# instead of one marker per county
+DENSITY_THRESHOLD = 20000
+# Size of a raster cell in pixels
+DENSITY_CELL_PIXELS = 4
+# Zoom factor of one scroll step
+ZOOM_STEP = 1.25
+# FilterIndex.median marks the sorted range of the rows while it spans less than this many
+# positions per row
+MEDIAN_MARK_SPAN = 4
+
+
+class FilterIndex:
+    # Slider filter index of one date frame: the SVI and population of its complete rows (the
+    # rows dropna() keeps) sorted once, with the permutations back to the rows. A threshold
+    # change is then three binary searches and the intersection of two row ranges instead of
+    # full column scans, so slider response does not grow with the number of counties. Other
+    # columns are sorted the same way on first use, for the median of the size legend.
+
+    def __init__(self, data: pd.DataFrame):
+        self.data = data
+        self.length = len(data)
+        self.complete = np.flatnonzero(data.notna().all(axis=1).to_numpy())
+        self.svi, self.svi_rows, self.svi_rank = sorted_column(data['SVI'].to_numpy(), self.complete, len(data))
+        self.population, self.population_rows, self.population_rank = \
+            sorted_column(data['county_population'].to_numpy(), self.complete, len(data))
+        self.columns = {'SVI': (self.svi, self.svi_rows, self.svi_rank),
+                        'county_population': (self.population, self.population_rows, self.population_rank)}
+
+    def rows(self, svi_min_threshold: float, svi_max_threshold: float, population_threshold: float) -> np.ndarray:
+        # Positions of the rows within the thresholds, in frame order. Thresholds are compared in
+        # the column dtype, like the scans they replace.
+        svi_start = np.searchsorted(self.svi, self.svi.dtype.type(svi_min_threshold), side='left')
+        svi_end = np.searchsorted(self.svi, self.svi.dtype.type(svi_max_threshold), side='right')
+        population_start = np.searchsorted(self.population, self.population.dtype.type(population_threshold),
+                                           side='left')
+
+        # Walk the shorter of the two ranges and keep its rows that fall in the other one
+        if svi_end - svi_start <= len(self.population) - population_start:
+            rows = self.svi_rows[svi_start:svi_end]
+            rows = rows[self.population_rank[rows] >= population_start]
+        else:
+            rows = self.population_rows[population_start:]
+            rank = self.svi_rank[rows]
+            rows = rows[(rank >= svi_start) & (rank < svi_end)]
+        return np.sort(rows)
+
+    def median(self, column: str, rows: np.ndarray) -> float:
+        # Median of a column over rows (of rows(), not empty), the upper one of an even count. Read
+        # by position from the sorted column: the ranks of the rows mark their values in the
+        # range they span, the median is the middle one of those. Rows scattered thinly over the
+        # sorted column select the middle of their ranks instead, cheaper than marking the range.
+        if column not in self.columns:
+            self.columns[column] = sorted_column(self.data[column].to_numpy(), self.complete, self.length)
+        values, _, rank = self.columns[column]
+        ranks = rank[rows]
+        first, last = ranks.min(), ranks.max()
+        middle = len(rows) // 2
+        if last - first >= MEDIAN_MARK_SPAN * len(rows):
+            return values[np.partition(ranks, middle)[middle]]
+        marked = np.zeros(last - first + 1, dtype=bool)
+        marked[ranks - first] = True
+        return values[first + np.flatnonzero(marked)[middle]]
+
+
+def sorted_column(values: np.ndarray, rows: np.ndarray, length: int) -> (np.ndarray, np.ndarray, np.ndarray):
+    # Values of the rows sorted, the row of every sorted value and the rank of every row (-1 when
+    # left out)
+    order = np.argsort(values[rows], kind='stable')
+    rank = np.full(length, -1, dtype=np.intp)
+    rank[rows[order]] = np.arange(len(rows))
+    return values[rows][order], rows[order], rank
+
+
+class DensityLayer:
+    # Points of the chart: one marker per county while at most threshold of them are in view,
+    # otherwise an image of their density, binned in numpy into a raster per community level
+    # (cells colored by the mix of levels, opacity by the count). Scrolling zooms around the
+    # cursor, and zooming into a small enough region brings the markers of that region back.
+
+    def __init__(self, ax: axes.Axes, scatter, threshold: int = DENSITY_THRESHOLD):
+        self.ax = ax
+        self.scatter = scatter
+        self.threshold = threshold
+        self.density = False
+        self.shown = np.arange(0)
+        self.home = None
+        self.suspended = False
+
+        # The raster always covers the axes, so it never changes the data limits
+        self.image = AxesImage(ax, transform=ax.transAxes, extent=(0, 1, 0, 1), origin='lower',
+                               interpolation='nearest', zorder=scatter.get_zorder())
+        self.image.set_visible(False)
+        ax.add_image(self.image)
+
+        # Called after a zoom, Window replaces it to redraw through its blit manager
+        self.redraw = ax.figure.canvas.draw_idle
+        ax.callbacks.connect('xlim_changed', self.on_limits_changed)
+        ax.callbacks.connect('ylim_changed', self.on_limits_changed)
+        self.scroll_id = ax.figure.canvas.mpl_connect('scroll_event', self.on_scroll)
+
+    def set_data(self, offsets: np.ndarray, sizes: np.ndarray, colors: np.ndarray, level_codes: np.ndarray,
+                 level_rgb: np.ndarray) -> None:
+        # level_codes and level_rgb as returned by level_rasters()
+        self.offsets = offsets
+        self.sizes = np.asarray(sizes, dtype=float)
+        self.colors = colors
+        self.level_codes = level_codes
+        self.level_rgb = level_rgb
+        if not self.suspended:
+            self.refresh()
+
+    @profiling.timed()
+    def refresh(self) -> None:
+        # Pick markers or raster for the current view
+        x0, x1 = self.ax.get_xlim()
+        y0, y1 = self.ax.get_ylim()
+        x, y = self.offsets[:, 0], self.offsets[:, 1]
+
+        if len(x) <= self.threshold:
+            self.show_markers(np.arange(len(x)))
+            return
+
+        in_view = (x >= min(x0, x1)) & (x <= max(x0, x1)) & (y >= min(y0, y1)) & (y <= max(y0, y1))
+        if np.count_nonzero(in_view) <= self.threshold:
+            # Keep the markers just outside the view too, they can overlap its edges
+            margin_x, margin_y = 0.05 * abs(x1 - x0), 0.05 * abs(y1 - y0)
+            near = (x >= min(x0, x1) - margin_x) & (x <= max(x0, x1) + margin_x) \
+                & (y >= min(y0, y1) - margin_y) & (y <= max(y0, y1) + margin_y)
+            self.show_markers(np.flatnonzero(near))
+            return
+
+        width, height = self.ax.bbox.width, self.ax.bbox.height
+        shape = (max(int(height / DENSITY_CELL_PIXELS), 1), max(int(width / DENSITY_CELL_PIXELS), 1))
+        self.image.set_data(density_raster(x, y, self.level_codes, self.level_rgb, (x0, x1), (y0, y1), shape))
+        self.image.set_visible(True)
+        self.scatter.set_offsets(np.empty((0, 2)))
+        self.scatter.set_sizes([])
+        self.scatter.set_facecolors(np.empty((0, 4)))
+        self.shown = np.arange(0)
+        self.density = True
+
+    def show_markers(self, rows: np.ndarray) -> None:
+        self.scatter.set_offsets(self.offsets[rows])
+        self.scatter.set_sizes(self.sizes[rows])
+        self.scatter.set_facecolors(self.colors[rows])
+        self.shown = rows
+        self.image.set_visible(False)
+        self.density = False
+
+    def on_limits_changed(self, ax):
+        if not self.suspended:
+            self.refresh()
+
+    def on_scroll(self, event):
+        if self.ax.figure is None or self.ax not in self.ax.figure.axes:
+            # The chart was cleared for another view
+            event.canvas.mpl_disconnect(self.scroll_id)
+            return
+        if event.inaxes is not self.ax or event.xdata is None:
+            return
+
+        if self.home is None or self.ax.get_autoscalex_on():
+            self.home = (self.ax.get_xlim(), self.ax.get_ylim())
+        scale = 1 / ZOOM_STEP if event.button == 'up' else ZOOM_STEP
+        (x0, x1), (y0, y1) = self.ax.get_xlim(), self.ax.get_ylim()
+
+        self.suspended = True
+        if scale > 1 and (x1 - x0) * scale >= self.home[0][1] - self.home[0][0]:
+            # Zoomed all the way out: back to the full chart, which follows the data again
+            self.ax.set_xlim(self.home[0])
+            self.ax.set_ylim(self.home[1])
+            self.ax.set_autoscalex_on(True)
+        else:
+            self.ax.set_xlim(event.xdata + (x0 - event.xdata) * scale, event.xdata + (x1 - event.xdata) * scale)
+            self.ax.set_ylim(event.ydata + (y0 - event.ydata) * scale, event.ydata + (y1 - event.ydata) * scale)
+        self.suspended = False
+
+        self.refresh()
+        self.redraw()
+
+
+def density_raster(x: np.ndarray, y: np.ndarray, level_codes: np.ndarray, level_rgb: np.ndarray,
+                   xlim: tuple, ylim: tuple, shape: tuple) -> np.ndarray:
+    # RGBA raster (rows from the bottom) of the points in the limits: one bincount gives the count
+    # of every (level, cell), cells take the count weighted mix of the level colors and an
+    # opacity growing with the log of their count
+    rows, columns = shape
+    column = np.floor((x - xlim[0]) / (xlim[1] - xlim[0]) * columns).astype(np.int64)
+    row = np.floor((y - ylim[0]) / (ylim[1] - ylim[0]) * rows).astype(np.int64)
+    inside = (column >= 0) & (column < columns) & (row >= 0) & (row < rows) & (level_codes >= 0)
+
+    cells = rows * columns
+    counts = np.bincount(level_codes[inside].astype(np.int64) * cells + row[inside] * columns + column[inside],
+                         minlength=len(level_rgb) * cells).reshape(len(level_rgb), rows, columns)
+    total = counts.sum(axis=0)
+
+    raster = np.zeros((rows, columns, 4))
+    raster[..., :3] = np.tensordot(counts, level_rgb, axes=(0, 0)) / np.maximum(total, 1)[..., None]
+    if total.max() > 0:
+        raster[..., 3] = np.where(total > 0, 0.25 + 0.6 * np.log1p(total) / np.log1p(total.max()), 0)
+    return raster
+
 
 def plot(data: pd.DataFrame, ax: axes.Axes, size_attribute: str,
          svi_min_threshold: float, svi_max_threshold: float,
-         population_threshold: float) -> None:
+         population_threshold: float, index: FilterIndex = None, density_threshold: int = None) -> None:
+    draw(filter_data(data, size_attribute, svi_min_threshold, svi_max_threshold, population_threshold, index),
+         ax, size_attribute, density_threshold)
+
 
+@profiling.timed()
+def filter_data(data: pd.DataFrame, size_attribute: str, svi_min_threshold: float,
+                svi_max_threshold: float, population_threshold: float,
+                index: FilterIndex = None) -> pd.DataFrame:
+    # Apply the slider thresholds and compute marker sizes. This touches no matplotlib state,
+    # so it is safe to run off the Qt main thread. index is the FilterIndex of data, pass it in
+    # to reuse it across slider changes, otherwise it is built from data.
     warnings.filterwarnings('ignore')
-    data = data.loc[(data['SVI'] >= svi_min_threshold) & (data['SVI'] <= svi_max_threshold)]
-    data = data.loc[data['county_population'] >= population_threshold]
-    data = data.dropna()
+    if index is None:
+        index = FilterIndex(data)
+    rows = index.rows(svi_min_threshold, svi_max_threshold, population_threshold)
+    data = data.take(rows)
 
     if size_attribute == 'SVI':
         data['normalized'] = data[size_attribute]
@@ -30,16 +250,27 @@ def plot(data: pd.DataFrame, ax: axes.Axes, size_attribute: str,
                              / max_value - min_value
 
     data.reset_index(inplace=True)
+    # The median of the size legend (size_labels), from the index
+    if len(rows):
+        data.attrs['medians'] = {size_attribute: index.median(size_attribute, rows)}
+    return data
 
-    level_categories = ['Low', 'Medium', 'High']
-    colors = palettes.cividis(len(level_categories))
-    color_map = {str(level_categories[i]): colors[i] for i in range(len(level_categories))}
 
-    ax.scatter(data['percent_strongly_hesitant'] + data['percent_hesitant'],
-                   1 - data['percent_vaccinated'],
-                   s=data['normalized'] * 150,
-                   c=[color_map[str(key)] for key in data['community_level']],
-                   alpha=0.7)
+@profiling.timed()
+def draw(data: pd.DataFrame, ax: axes.Axes, size_attribute: str, density_threshold: int = None,
+         history=None) -> dict:
+    # Build the chart and return the retained artists, which update() later modifies in place.
+    # Above density_threshold points in view (default DENSITY_THRESHOLD) they are drawn as a density raster.
+    # With a history.CountyHistory the hover tooltips show the county's history as sparklines.
+    level_categories = LEVEL_CATEGORIES
+    color_map = level_color_map()
+
+    colors = level_colors(data['community_level'])
+    scatter = ax.scatter(data['percent_strongly_hesitant'] + data['percent_hesitant'],
+                         1 - data['percent_vaccinated'],
+                         s=data['normalized'] * 150,
+                         c=colors,
+                         alpha=0.7)
 
     color_handles = [Line2D([0], [0], color=color_map[level],
                            marker='o', linestyle='none') for level in level_categories]
@@ -53,25 +284,7 @@ def plot(data: pd.DataFrame, ax: axes.Axes, size_attribute: str,
     for handle in legend1.legendHandles:
         handle._sizes = [50]
 
-    if len(data):
-        median = math.floor(len(data[size_attribute]) / 2)
-        label_sizes = [round(data[size_attribute].max() * 100, 2),
-                       round(sorted(data[size_attribute])[median] * 100, 2),
-                       round(max(data[size_attribute].min() * 100, 0.01), 2)]
-
-        size_handles = [Line2D([0], [0], color='gray',
-                                marker='o', markersize=np.sqrt(size), linestyle='none') for size in label_sizes]
-
-        legend2 = plt.legend(handles=size_handles,
-                             labels=label_sizes,
-                             title=size_attribute,
-                             loc='lower right',
-                             labelspacing=2)
-
-        for idx, handle in enumerate(legend2.legendHandles):
-            handle._sizes = [max(label_sizes[idx], 0.01)]
-
-        ax.add_artist(legend2)
+    legend2 = size_legend(data, ax, size_attribute)
 
     plt.xlabel("Percentage of Adults Hesitant/Strongly Hesitant", size=16)
     plt.ylabel("Percentage of Adults Unvaccinated", size=16)
@@ -81,21 +294,177 @@ def plot(data: pd.DataFrame, ax: axes.Axes, size_attribute: str,
 
     ax.set_ylim(0.2, 0.8)
 
-    cr = cursor(ax, hover=2, highlight=True)
+    # Set up last, with the final axis limits
+    density = DensityLayer(ax, scatter, DENSITY_THRESHOLD if density_threshold is None else density_threshold)
+    density.set_data(np.asarray(scatter.get_offsets()), data['normalized'] * 150, colors,
+                     *level_rasters(data['community_level']))
+
+    artists = {
+        'ax': ax,
+        'data': data,
+        'size_attribute': size_attribute,
+        'scatter': scatter,
+        'density': density,
+        'size_legend': legend2,
+        'history': history,
+        'dynamic': [artist for artist in [scatter, density.image, legend2] if artist is not None]
+    }
+
+    # Only the markers are hoverable, not the density raster
+    cr = cursor([scatter], hover=2, highlight=True)
+    # Highlights are copies of the (animated) scatter, keep them in regular draws
+    cr.highlight_kwargs['animated'] = False
 
     @cr.connect('add')
     def cr_hover(sel):
-        selected = data.iloc[sel.index, :]
+        # Read the current data from the retained artists, since update() swaps it out. The
+        # markers are the counties in or near the view, map them back to their rows.
+        selected = artists['data'].iloc[artists['density'].shown[sel.index], :]
+        hover_size_attribute = artists['size_attribute']
         annotation_dict = {
             'County Name': f'{selected["county"]}',
             'State': f'{selected["state"]}',
-            'Population': f'{selected["county_population"]}',
+            'Population': f'{int(selected["county_population"])}',
             'Percent Hesitant + Percent Strongly Hesitant':
                 f'{str(math.floor((selected["percent_strongly_hesitant"] + selected["percent_hesitant"]) * 100))}%',
             'Percent Unvaccinated': f'{str(math.floor((1 - selected["percent_vaccinated"]) * 100))}%',
             'Community Level': f'{str(selected["community_level"])}',
             'Cases per 100k People': f'{str(selected["cases_100k"])}',
-            f'{size_attribute}': f'{str(math.floor(selected[size_attribute] * 100))}'
+            f'{hover_size_attribute}': f'{str(math.floor(selected[hover_size_attribute] * 100))}'
         }
-        sel.annotation.set_text('\n'.join([f'{k}: {v}' for k, v in annotation_dict.items()]))
+        lines = [f'{k}: {v}' for k, v in annotation_dict.items()]
+        if artists['history'] is not None:
+            lines.append(artists['history'].sparklines(selected['county_fips']))
+        sel.annotation.set_text('\n'.join(line for line in lines if line))
         sel.annotation.set(bbox=dict(facecolor=mplcolors.to_rgba('yellow')[:-1] + (1.0,)))
+
+    return artists
+
+
+@profiling.timed()
+def update(artists: dict, data: pd.DataFrame, size_attribute: str) -> bool:
+    # Push newly filtered data into the retained artists instead of rebuilding the chart.
+    # Returns True when the x limits changed, in which case a blit is not enough and the
+    # caller has to redraw the full canvas.
+    return apply(artists, prepare(data, size_attribute))
+
+
+@profiling.timed()
+def prepare(data: pd.DataFrame, size_attribute: str) -> dict:
+    # The marker arrays and size legend labels update() pushes into the retained artists, from
+    # the filter_data() frame. Like filter_data() this touches no matplotlib state, playback
+    # prepares them off the Qt main thread.
+    level_codes, level_rgb = level_rasters(data['community_level'])
+    return {
+        'data': data,
+        'size_attribute': size_attribute,
+        'offsets': np.column_stack([data['percent_strongly_hesitant'] + data['percent_hesitant'],
+                                    1 - data['percent_vaccinated']]),
+        'sizes': data['normalized'] * 150,
+        'colors': level_colors(data['community_level']),
+        'level_codes': level_codes,
+        'level_rgb': level_rgb,
+        'size_labels': size_labels(data, size_attribute) if len(data) else None
+    }
+
+
+@profiling.timed()
+def apply(artists: dict, prepared: dict) -> bool:
+    # Push the arrays of prepare() into the retained artists, on the Qt main thread. Returns
+    # True when the x limits changed, like update().
+    ax = artists['ax']
+    data = prepared['data']
+    size_attribute = prepared['size_attribute']
+
+    offsets = prepared['offsets']
+    scatter = artists['scatter']
+    density = artists['density']
+    # Suspended while the x axis follows the data below, the view is refreshed once at the end
+    density.suspended = True
+    density.set_data(offsets, prepared['sizes'], prepared['colors'], prepared['level_codes'], prepared['level_rgb'])
+
+    artists['data'] = data
+    artists['size_attribute'] = size_attribute
+
+    legend2 = artists['size_legend']
+    if len(data) and legend2 is not None:
+        legend2.get_title().set_text(size_attribute)
+        for text, handle, size in zip(legend2.get_texts(), legend2.legendHandles, prepared['size_labels']):
+            text.set_text(str(size))
+            handle.set_markersize(np.sqrt(size))
+        legend2.set_visible(True)
+    elif len(data):
+        legend2 = size_legend(data, ax, size_attribute)
+        artists['size_legend'] = legend2
+    elif legend2 is not None:
+        legend2.set_visible(False)
+
+    artists['dynamic'] = [artist for artist in [scatter, density.image, legend2] if artist is not None]
+
+    # Autoscale the x axis to the new points, as a fresh scatter would (unless zoomed in)
+    xlim = ax.get_xlim()
+    if len(data):
+        ax.ignore_existing_data_limits = True
+        ax.update_datalim(offsets)
+        ax.autoscale_view()
+    density.suspended = False
+    density.refresh()
+    return ax.get_xlim() != xlim
+
+
+def level_color_map() -> dict:
+    colors = palettes.cividis(len(LEVEL_CATEGORIES))
+    return {str(LEVEL_CATEGORIES[i]): colors[i] for i in range(len(LEVEL_CATEGORIES))}
+
+
+def level_colors(levels: pd.Series) -> np.ndarray:
+    # Community levels are categorical: look up the color of each category once and index the
+    # colors with the category codes instead of a dictionary lookup per county. Counties without
+    # a level (code -1) index the last color, MISSING_COLOR.
+    color_map = level_color_map()
+    levels = levels.astype('category')
+    colors = np.array([*(color_map[str(level)] for level in levels.cat.categories), MISSING_COLOR], dtype=object)
+    return colors[levels.cat.codes.to_numpy()]
+
+
+def level_rasters(levels: pd.Series) -> (np.ndarray, np.ndarray):
+    # Category code of every county's level and the RGB of every category, for density_raster()
+    levels = levels.astype('category')
+    color_map = level_color_map()
+    level_rgb = mplcolors.to_rgba_array([color_map[str(level)] for level in levels.cat.categories])[:, :3] \
+        if len(levels.cat.categories) else np.zeros((0, 3))
+    return levels.cat.codes.to_numpy(), level_rgb
+
+
+def size_labels(data: pd.DataFrame, size_attribute: str) -> list:
+    # The median filter_data() read from the filter index, otherwise partition the column (the
+    # median is an order statistic) instead of sorting it
+    median = data.attrs.get('medians', {}).get(size_attribute)
+    if median is None:
+        middle = math.floor(len(data[size_attribute]) / 2)
+        median = np.partition(data[size_attribute].to_numpy(), middle)[middle]
+    return [round(float(data[size_attribute].max()) * 100, 2),
+            round(float(median) * 100, 2),
+            round(max(float(data[size_attribute].min()) * 100, 0.01), 2)]
+
+
+def size_legend(data: pd.DataFrame, ax: axes.Axes, size_attribute: str):
+    if not len(data):
+        return None
+
+    label_sizes = size_labels(data, size_attribute)
+
+    size_handles = [Line2D([0], [0], color='gray',
+                            marker='o', markersize=np.sqrt(size), linestyle='none') for size in label_sizes]
+
+    legend2 = ax.legend(handles=size_handles,
+                        labels=label_sizes,
+                        title=size_attribute,
+                        loc='lower right',
+                        labelspacing=2)
+
+    for idx, handle in enumerate(legend2.legendHandles):
+        handle._sizes = [max(label_sizes[idx], 0.01)]
+
+    ax.add_artist(legend2)
+    return legend2
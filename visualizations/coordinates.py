@@ -0,0 +1,266 @@
+import hashlib
+import os
+import re
+import shutil
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from matplotlib.path import Path
+
+import profiling
+from storage import atomic_write
+
+# Bump whenever the layout of the stored arrays changes so stale stores are ignored.
+STORE_VERSION = 2
+
+# Arrays of one table of geometries, written in this order: a table is complete once its offsets exist
+TABLE_ARRAYS = ['coords', 'codes', 'offsets']
+
+# Names of the store directories (store_key) in cache_dir/geometry
+STORE_NAME = re.compile(r'[0-9a-f]{32}')
+
+
+class CoordinateStore:
+    # Boundary rings of the counties and of the states as flat tables: one contiguous (n, 2)
+    # float64 coordinate array, the matplotlib Path code of every vertex (MOVETO starts a ring)
+    # and the offset of every geometry into both. Each state polygon is stored once and counties
+    # refer to theirs by row (county_state), instead of once per county.
+    # With a cache directory the tables are saved as .npy files and opened memory-mapped, so a
+    # Path is a zero-copy slice of the mapped buffer and every process opening the same store
+    # shares its pages. Simplified levels of detail are added to the store when first built.
+    # The counties of every state are also dissolved into one shape per state (row i of the
+    # dissolved tables merges the counties with county_state i), for the State by State view.
+
+    def __init__(self, geometry_df: pd.DataFrame, column: str = 'county_boundary',
+                 state_column: str = 'state_boundary', cache_dir: str = None):
+        self.geometries = np.asarray(gpd.GeoSeries(geometry_df[column]))
+        self.fips = pd.Index(geometry_df.index)
+        self.levels = {}
+        self.state_levels = {}
+        self.dissolved_geometries = None
+
+        # Counties of a state carry equal copies of its boundary, factorize them by their WKB
+        if state_column in geometry_df:
+            state_boundaries = np.asarray(gpd.GeoSeries(geometry_df[state_column]))
+            county_state, state_wkb = pd.factorize(shapely.to_wkb(state_boundaries))
+        else:
+            county_state, state_wkb = np.full(len(self.fips), -1), np.array([], dtype=object)
+        self.county_state = county_state.astype(np.int32)
+
+        self.directory = None
+        if cache_dir is not None:
+            key = store_key(self.fips, self.geometries, state_wkb, self.county_state)
+            self.directory = os.path.join(cache_dir, 'geometry', key)
+            prune(os.path.join(cache_dir, 'geometry'), key)
+        self.states = self.table('states', lambda: flat_rings(shapely.from_wkb(np.asarray(state_wkb, dtype=object))))
+
+    def level(self, tolerance: float) -> (np.ndarray, np.ndarray, np.ndarray):
+        # County table at a level of detail, simplified on first use. The borders of neighbouring
+        # counties are simplified together (simplify_shared), so they stay flush.
+        if tolerance not in self.levels:
+            def simplified():
+                if tolerance == 0:
+                    return flat_rings(self.geometries)
+                with profiling.span('paths.simplify', tolerance=tolerance):
+                    return simplify_shared(self.level(0), tolerance)
+            self.levels[tolerance] = self.table(f'counties-{tolerance:g}', simplified)
+        return self.levels[tolerance]
+
+    def state_level(self, tolerance: float) -> (np.ndarray, np.ndarray, np.ndarray):
+        # Table of the dissolved states at a level of detail, dissolved and simplified on first use
+        if tolerance not in self.state_levels:
+            def simplified():
+                if tolerance == 0:
+                    return flat_rings(self.dissolved())
+                with profiling.span('paths.simplify', tolerance=tolerance, states=True):
+                    return simplify_shared(self.state_level(0), tolerance)
+            self.state_levels[tolerance] = self.table(f'dissolved-{tolerance:g}', simplified)
+        return self.state_levels[tolerance]
+
+    def dissolved(self) -> np.ndarray:
+        # Union of the county boundaries of every state, one geometry per row of the states table
+        if self.dissolved_geometries is None:
+            states = len(self.states[2]) - 1
+            order = np.argsort(self.county_state, kind='stable')
+            bounds = np.searchsorted(self.county_state[order], np.arange(states + 1))
+            with profiling.span('paths.dissolve', states=states):
+                self.dissolved_geometries = np.array([shapely.union_all(self.geometries[order[start:stop]])
+                                                      for start, stop in zip(bounds[:-1], bounds[1:])],
+                                                     dtype=object)
+        return self.dissolved_geometries
+
+    def table(self, name: str, build) -> (np.ndarray, np.ndarray, np.ndarray):
+        # (coords, codes, offsets) of a table, mapped from the store when saved there before,
+        # otherwise built with build() and saved
+        table = load_table(self.directory, name) if self.directory is not None else None
+        if table is None:
+            table = build()
+            if self.directory is not None:
+                save_table(self.directory, name, table)
+                # Reopen the saved arrays so the store's pages are shared with other processes
+                table = load_table(self.directory, name) or table
+        return table
+
+    def state_bounds(self, fips) -> np.ndarray:
+        # (min x, min y, max x, max y) of the state boundaries of the given counties, NaN if there are none
+        rows = self.fips.get_indexer(np.asarray(fips))
+        states = np.unique(self.county_state[rows[rows >= 0]])
+        coords, _, offsets = self.states
+        parts = [coords[offsets[state]:offsets[state + 1]] for state in states[states >= 0]]
+        if not sum(len(part) for part in parts):
+            return np.full(4, np.nan)
+        coords = np.concatenate(parts)
+        return np.concatenate([coords.min(axis=0), coords.max(axis=0)])
+
+
+def store_key(fips: pd.Index, geometries: np.ndarray, state_wkb: np.ndarray, county_state: np.ndarray) -> str:
+    # Key the store on the geometry it holds, so a store never outlives the data it was built from
+    key = hashlib.sha256(f'v{STORE_VERSION}'.encode())
+    key.update(np.ascontiguousarray(fips.to_numpy(dtype=np.int64)).tobytes())
+    key.update(county_state.tobytes())
+    for wkb in [*shapely.to_wkb(geometries), *state_wkb]:
+        key.update(b'' if wkb is None else wkb)
+        key.update(b'\0')
+    return key.hexdigest()[:32]
+
+
+def prune(stores_dir: str, key: str) -> None:
+    # Remove the stores of other keys, built from earlier versions of the geometry, like
+    # cache.prune does for the cached frames. Only directories named like a store and holding
+    # nothing but stored arrays are removed. Arrays another process has mapped stay readable on
+    # POSIX, a store that can't be removed (Windows) is left for a later run.
+    if not os.path.isdir(stores_dir):
+        return
+    for name in os.listdir(stores_dir):
+        store = os.path.join(stores_dir, name)
+        if name == key or not STORE_NAME.fullmatch(name) or not os.path.isdir(store):
+            continue
+        if all(file.endswith(('.npy', '.tmp')) for file in os.listdir(store)):
+            shutil.rmtree(store, ignore_errors=True)
+
+
+@profiling.timed()
+def flat_rings(geometries: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+    # Flat table of the geometries: every polygon part and hole is a ring of the coordinate array,
+    # the rings of geometry i are coords[offsets[i]:offsets[i + 1]]. Missing geometries are empty.
+    parts, part_index = shapely.get_parts(geometries, return_index=True)
+    rings, ring_index = shapely.get_rings(parts, return_index=True)
+    coords, coordinate_index = shapely.get_coordinates(rings, return_index=True)
+
+    codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+    ring_starts = np.searchsorted(coordinate_index, np.arange(len(rings)))
+    codes[ring_starts[ring_starts < len(coords)]] = Path.MOVETO
+
+    # Coordinates come out grouped by ring, rings by part and parts by geometry
+    owner = part_index[ring_index[coordinate_index]]
+    offsets = np.searchsorted(owner, np.arange(len(geometries) + 1)).astype(np.int64)
+    return np.ascontiguousarray(coords, dtype=np.float64), codes, offsets
+
+
+@profiling.timed()
+def simplify_shared(table: tuple, tolerance: float) -> (np.ndarray, np.ndarray, np.ndarray):
+    # Flat table of the rings of table simplified as one coverage. The rings are cut into arcs at
+    # the junctions, the points where the neighbours along a boundary change, so a border shared
+    # by two polygons is one arc. Every arc is simplified once (Douglas-Peucker, keeping its ends)
+    # and each ring is put back together from its arcs, so neighbours keep the same border:
+    # simplifying every polygon on its own opens slivers and gaps between them. Unlike
+    # shapely.simplify(preserve_topology=True), an arc simplified at a coarse tolerance can cross
+    # another one. Borders only match where the neighbours share their vertices exactly.
+    coords, codes, offsets = table
+    starts = np.flatnonzero(codes == Path.MOVETO)
+    if not len(starts):
+        return table
+    ends = np.append(starts[1:], len(coords))
+
+    # The vertices of every ring without the last, which repeats the first
+    lengths = ends - starts - 1
+    ring_first = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    ring_last = ring_first + np.repeat(lengths, lengths) - 1
+    vertices = np.delete(np.arange(len(coords)), ends - 1)
+    points, point = np.unique(np.ascontiguousarray(coords[vertices]).view(np.complex128).ravel(),
+                              return_inverse=True)
+
+    # A point is a junction when it is on more than two rings or its neighbours differ between its
+    # rings: along a shared border both rings pass the same points, in opposite directions
+    position = np.arange(len(vertices))
+    before = point[np.where(position == ring_first, ring_last, position - 1)]
+    after = point[np.where(position == ring_last, ring_first, position + 1)]
+    pair = np.minimum(before, after).astype(np.int64) * len(points) + np.maximum(before, after)
+    order = np.argsort(point, kind='stable')
+    group_starts = np.flatnonzero(np.diff(point[order], prepend=-1))
+    first_pair = np.repeat(pair[order][group_starts], np.diff(np.append(group_starts, len(order))))
+    differs = np.bincount(point[order], weights=pair[order] != first_pair, minlength=len(points)) > 0
+    junction = (differs | (np.bincount(point, minlength=len(points)) > 2))[point]
+
+    # Cut the rings into arcs, each arc kept once in one direction
+    arcs, arc_points, ring_arcs = {}, [], []
+    for start, length in zip(np.cumsum(lengths) - lengths, lengths):
+        ids = point[start:start + length]
+        cuts = np.flatnonzero(junction[start:start + length])
+        if not len(cuts):
+            # An island, or the border of an enclave and of the hole around it: one closed arc,
+            # starting from the same point on both rings
+            cuts = np.array([np.argmin(ids)])
+        ids = np.append(np.roll(ids, -cuts[0]), ids[cuts[0]])
+        cuts = np.append(cuts - cuts[0], length)
+        pieces = []
+        for cut, next_cut in zip(cuts[:-1], cuts[1:]):
+            arc = ids[cut:next_cut + 1]
+            backward = bool(arc[0] > arc[-1] or (arc[0] == arc[-1] and arc[1] > arc[-2]))
+            if backward:
+                arc = arc[::-1]
+            key = arc.tobytes()
+            if key not in arcs:
+                arcs[key] = len(arc_points)
+                arc_points.append(arc)
+            pieces.append((arcs[key], backward))
+        ring_arcs.append(pieces)
+
+    arc_lengths = [len(arc) for arc in arc_points]
+    lines = shapely.linestrings(np.column_stack([points.real, points.imag])[np.concatenate(arc_points)],
+                                indices=np.repeat(np.arange(len(arc_points)), arc_lengths))
+    simplified, arc_index = shapely.get_coordinates(shapely.simplify(lines, tolerance, preserve_topology=False),
+                                                    return_index=True)
+    bounds = np.searchsorted(arc_index, np.arange(len(arc_points) + 1))
+    arc_coords = [simplified[first:last] if last - first >= 2 else
+                  np.column_stack([points.real, points.imag])[arc[[0, -1]]]
+                  for first, last, arc in zip(bounds[:-1], bounds[1:], arc_points)]
+
+    # Put every ring back together, the arcs joined at their shared ends
+    rings = []
+    for pieces in ring_arcs:
+        parts = [arc_coords[arc][::-1] if backward else arc_coords[arc] for arc, backward in pieces]
+        rings.append(np.concatenate([parts[0], *[part[1:] for part in parts[1:]]]))
+    ring_lengths = np.array([len(ring) for ring in rings])
+    ring_starts = np.cumsum(ring_lengths) - ring_lengths
+    simplified_coords = np.concatenate(rings)
+    simplified_codes = np.full(len(simplified_coords), Path.LINETO, dtype=Path.code_type)
+    simplified_codes[ring_starts] = Path.MOVETO
+
+    # The rings of geometry i start at or after offsets[i] and before offsets[i + 1]
+    simplified_offsets = np.append(ring_starts, len(simplified_coords))[np.searchsorted(starts, offsets)]
+    return np.ascontiguousarray(simplified_coords), simplified_codes, simplified_offsets.astype(np.int64)
+
+
+def load_table(directory: str, name: str):
+    # Memory-mapped (coords, codes, offsets) of a saved table, None if it is not in the store
+    paths = [os.path.join(directory, f'{name}.{array}.npy') for array in TABLE_ARRAYS]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    try:
+        return tuple(np.load(path, mmap_mode='r') for path in paths)
+    except (OSError, ValueError):
+        return None
+
+
+def save_table(directory: str, name: str, table: tuple) -> None:
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for array, values in zip(TABLE_ARRAYS, table):
+            with atomic_write(os.path.join(directory, f'{name}.{array}.npy')) as temporary:
+                with open(temporary, 'wb') as file:
+                    np.save(file, values)
+    except OSError as error:
+        print(f'Could not save the coordinate store: {error}')
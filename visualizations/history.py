@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+import profiling
+from .bubble_chart import LEVEL_CATEGORIES
+
+# Columns kept for every county and report date
+HISTORY_COLUMNS = ['cases_100k', 'hospital_100k', 'community_level']
+
+# Sparklines: one block character per report date (sampled down to SPARKLINE_WIDTH dates),
+# scaled between the lowest and highest value of the county
+SPARKLINE_WIDTH = 40
+SPARK_CHARACTERS = np.array(list('▁▂▃▄▅▆▇█'))
+LEVEL_CHARACTERS = np.array(list('▁▄█'))
+MISSING_CHARACTER = '·'
+
+
+class CountyHistory:
+    # Dense county x date pivot of the community reports: one contiguous (counties, dates) array
+    # per column, float32 for the rates and int8 codes into LEVEL_CATEGORIES (-1 if missing) for
+    # the community levels, with a dictionary from FIPS code to row. The history of a county is a
+    # row slice, so hovering a county never goes back to the reports of every date.
+
+    def __init__(self, fips: pd.Index, dates: list, arrays: dict):
+        self.fips = fips
+        self.dates = list(dates)
+        self.arrays = arrays
+        self.row_of = dict(zip(fips.tolist(), range(len(fips))))
+
+    def row(self, fips) -> int:
+        # Row of a county, -1 if it has no reports
+        return self.row_of.get(fips, -1)
+
+    def series(self, fips, column: str) -> pd.Series:
+        # Values of a county by report date, community levels as their names
+        row = self.row(fips)
+        if column == 'community_level':
+            codes = self.arrays[column][row] if row >= 0 else np.full(len(self.dates), -1)
+            return pd.Series(pd.Categorical.from_codes(codes, LEVEL_CATEGORIES), index=self.dates, name=column)
+        values = self.arrays[column][row] if row >= 0 else np.full(len(self.dates), np.nan, dtype=np.float32)
+        return pd.Series(values, index=self.dates, name=column)
+
+    def county(self, fips) -> pd.DataFrame:
+        # Every column of a county by report date
+        return pd.DataFrame({column: self.series(fips, column) for column in HISTORY_COLUMNS})
+
+    def table(self, column: str) -> pd.DataFrame:
+        # County x date table of a rate, a view of the array
+        return pd.DataFrame(self.arrays[column], index=self.fips, columns=self.dates, copy=False)
+
+    def sparklines(self, fips) -> str:
+        # Tooltip lines with the history of a county, empty if it has none
+        row = self.row(fips)
+        if row < 0:
+            return ''
+        cases, hospital = self.arrays['cases_100k'][row], self.arrays['hospital_100k'][row]
+        return '\n'.join([f'Cases per 100k History: {sparkline(cases)} {value_range(cases)}',
+                          f'Hospital Admissions per 100k History: {sparkline(hospital)} {value_range(hospital)}',
+                          f'Community Level History: {level_sparkline(self.arrays["community_level"][row])}'])
+
+
+@profiling.timed()
+def build_history(community_data: pd.DataFrame, database=None) -> CountyHistory:
+    # Pivot every report of community_data (or the database) once. The database is read one
+    # report date at a time (an indexed query each), never holding more than a date of reports.
+    if database is None:
+        dates = sorted(community_data['date_updated'].dropna().astype(str).unique())
+        return pivot(pd.Index(community_data.index.unique()), dates, community_data)
+
+    history = empty(database.counties(), database.dates())
+    for date in history.dates:
+        scatter(history, database.query('community', 'SELECT county_fips, date_updated, cases_100k, hospital_100k, '
+                                                     'community_level FROM community WHERE date_updated = ?', (date,)))
+    return history
+
+
+@profiling.timed()
+def extend_history(history: CountyHistory, new_reports: pd.DataFrame) -> CountyHistory:
+    # History with new_reports added: reports of new dates and counties, or more reports of a date
+    # the history has part of already. The earlier arrays are copied into the new ones (a column
+    # per new date, a row per new county) and only the new reports are scattered into them.
+    fips = history.fips.append(pd.Index(new_reports.index.unique()).difference(history.fips))
+    dates = sorted(set(history.dates).union(new_reports['date_updated'].dropna().astype(str)))
+
+    extended = empty(fips, dates)
+    columns = pd.Index(dates).get_indexer(history.dates)
+    for column, values in history.arrays.items():
+        extended.arrays[column][:len(history.fips), columns] = values
+    scatter(extended, new_reports)
+    return extended
+
+
+def pivot(fips: pd.Index, dates: list, reports: pd.DataFrame) -> CountyHistory:
+    # Arrays with a row per FIPS code and a column per date, holding the reports
+    history = empty(fips, dates)
+    scatter(history, reports)
+    return history
+
+
+def empty(fips: pd.Index, dates: list) -> CountyHistory:
+    arrays = {column: np.full((len(fips), len(dates)), np.nan, dtype=np.float32)
+              for column in ['cases_100k', 'hospital_100k']}
+    arrays['community_level'] = np.full((len(fips), len(dates)), -1, dtype=np.int8)
+    return CountyHistory(fips, dates, arrays)
+
+
+def scatter(history: CountyHistory, reports: pd.DataFrame) -> None:
+    # Write the reports into the arrays of the history, in place
+    rows = history.fips.get_indexer(reports.index)
+    columns = pd.Index(history.dates).get_indexer(reports['date_updated'].astype(str))
+    keep = (rows >= 0) & (columns >= 0)
+    rows, columns = rows[keep], columns[keep]
+
+    for column in ['cases_100k', 'hospital_100k']:
+        history.arrays[column][rows, columns] = reports[column].to_numpy(dtype=np.float32)[keep]
+    history.arrays['community_level'][rows, columns] = pd.Categorical(
+        reports['community_level'].astype(object), categories=LEVEL_CATEGORIES).codes[keep]
+
+
+def sample(values: np.ndarray, width: int = SPARKLINE_WIDTH) -> np.ndarray:
+    # At most width values, evenly spaced and always including the latest
+    if len(values) <= width:
+        return values
+    return values[np.linspace(0, len(values) - 1, width).round().astype(np.intp)]
+
+
+def sparkline(values: np.ndarray) -> str:
+    values = sample(values)
+    present = ~np.isnan(values)
+    if not present.any():
+        return MISSING_CHARACTER * len(values)
+
+    low, high = values[present].min(), values[present].max()
+    scaled = (np.where(present, values, low) - low) / (high - low) if high > low else np.zeros(len(values))
+    codes = np.minimum((scaled * len(SPARK_CHARACTERS)).astype(np.intp), len(SPARK_CHARACTERS) - 1)
+    return ''.join(np.where(present, SPARK_CHARACTERS[codes], MISSING_CHARACTER))
+
+
+def level_sparkline(codes: np.ndarray) -> str:
+    codes = sample(codes)
+    return ''.join(np.where(codes >= 0, LEVEL_CHARACTERS[np.maximum(codes, 0)], MISSING_CHARACTER))
+
+
+def value_range(values: np.ndarray) -> str:
+    present = values[~np.isnan(values)]
+    if not len(present):
+        return ''
+    return f'({round(float(present.min()), 2)} to {round(float(present.max()), 2)})'
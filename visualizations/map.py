@@ -1,137 +1,383 @@
 import math
 
-import geopandas as gpd
 import numpy as np
 from geopandas import GeoDataFrame
 from matplotlib.lines import Line2D
-from mplcursors import cursor
 import matplotlib.pyplot as plt
 from matplotlib import axes
 import pandas as pd
-from bokeh import palettes
 
-from matplotlib import colors as mplcolors
 import matplotlib.collections as collections
 
+import profiling
 from . import constants
+from .binning import BinCache, QuantileBins, quantile_bins
+from .history import CountyHistory
+from .paths import PathLevels
+from .picking import HoverPicker
+from .rollups import Rollups, rollups_of, weighted_sums
+from .spatial import CountyIndex
 
 
+@profiling.timed()
 def plot(data: pd.DataFrame, ax: axes.Axes, state_name: str,
-         attribute: str, secondary: str, view: str):
-    data.reset_index(inplace=True, drop=True)
+         attribute: str, secondary: str, view: str, paths: PathLevels = None,
+         index: CountyIndex = None, bins: BinCache = None, rollups: Rollups = None,
+         history: CountyHistory = None) -> dict:
+    # paths holds the county Paths at every level of detail, index the county spatial index,
+    # bins the quantile bins of the colors by date and rollups the state means of the State by
+    # State view. Pass them in to reuse them across redraws, otherwise they are built from data.
+    # With the county history the hover tooltips show its sparklines.
+    if paths is None:
+        paths = PathLevels(data)
+
+    # Work on a copy so the caller's frame is never mutated (it may be read from a worker thread).
+    # The FIPS index is kept as a column so update() can align later frames with the retained artists.
+    data = data.reset_index()
+    if index is None:
+        index = CountyIndex(data.set_index('county_fips'))
+
     if state_name == 'Country View':
-        country_view(data, ax, attribute, view)
+        return country_view(data, ax, attribute, view, paths, index, bins, rollups, history)
     else:
-        state_view(data, ax, state_name, attribute, secondary)
-
-
-def country_view(data: pd.DataFrame, ax: axes.Axes, attribute: str, view: str):
-    # Create state and county Geoframes
-    color_key = constants.MAP_ATTRIBUTES[attribute]
-
-    county_series = gpd.GeoSeries(data['county_boundary'])
-    data['county_point'] = county_series.centroid
-
-    county_boundaries = GeoDataFrame(data, geometry=data['county_boundary'])
-    if view == 'State':
-        data['KEY'] = data[color_key].groupby(data['state']).transform('mean')
+        return state_view(data, ax, state_name, attribute, secondary, paths, index, bins, history)
+
+
+@profiling.timed()
+def update(artists: dict, data: pd.DataFrame, attribute: str, secondary: str, view: str,
+           bins: BinCache = None, rollups: Rollups = None) -> None:
+    # Recolor and resize the retained artists of the map returned by plot() for a new date,
+    # attribute, secondary attribute or County/State toggle. The map extent stays the same.
+    apply(artists, prepare(artists, data, attribute, secondary, view, bins, rollups))
+
+
+@profiling.timed()
+def prepare(artists: dict, data: pd.DataFrame, attribute: str, secondary: str, view: str,
+            bins: BinCache = None, rollups: Rollups = None) -> dict:
+    # The colors, sizes, legend entries and tooltips update() pushes into the retained artists,
+    # computed from data without changing them. This touches no matplotlib state, so it is safe
+    # to run off the Qt main thread (playback prepares the dates ahead of the one on screen).
+    data = data.reset_index()
+    if artists['state_name'] == 'Country View':
+        return prepare_country_view(artists, data, attribute, view, bins, rollups)
+    return prepare_state_view(artists, data, attribute, secondary, bins)
+
+
+@profiling.timed()
+def apply(artists: dict, prepared: dict) -> None:
+    # Push the arrays of prepare() into the retained artists, on the Qt main thread
+    if artists['state_name'] == 'Country View':
+        apply_country_view(artists, prepared)
     else:
-        data['KEY'] = data[color_key]
-
-    # Create color map
-    data['RANGES'] = pd.qcut(data['KEY'], q=constants.BINS[attribute],
-                             duplicates='drop', precision=2)
-
-    intervals_array = data['RANGES'].unique().__array__()
-    for idx, interval in enumerate(intervals_array):
-        if isinstance(interval, float):
-            if math.isnan(interval):
-                intervals_array = np.delete(intervals_array, idx)
-
-    intervals_array.sort()
-    intervals = list(str(group) for group in intervals_array)
-
-    colors = palettes.cividis(len(intervals))
-    color_map = {str(intervals[i]): colors[i] for i in range(len(intervals))}
-    color_map['nan'] = 'lightgray'
-
-    # Plot
-    county_boundaries.plot(ax=ax,
-                           edgecolor=(0, 0, 0, 0.35),
-                           color=[color_map[str(key)] for key in data['RANGES']])
-
-    color_handles = [Line2D([0], [0], color=color_map[interval],
-                            marker='o', linestyle='none') for interval in intervals]
-    color_labels = [interval for interval in intervals]
-    color_labels[0] = '(0, ' + color_labels[0][color_labels[0].index(',') + 1:]
-
-    legend1 = plt.legend(handles=color_handles,
-                         labels=color_labels,
-                         title=attribute,
-                         loc='lower right')
-
-    for handle in legend1.legendHandles:
-        handle._sizes = [50]
+        apply_state_view(artists, prepared)
 
-    ax.add_artist(legend1)
 
+@profiling.timed()
+def country_view(data: pd.DataFrame, ax: axes.Axes, attribute: str, view: str, paths: PathLevels,
+                 index: CountyIndex, bins: BinCache = None, rollups: Rollups = None,
+                 history: CountyHistory = None) -> dict:
+    # Set the extent first, the level of detail of the county paths depends on it
     plt.ylim([23, 50])
     plt.xlim([-125, -67])
     ax.set_aspect('auto')
 
+    # Plot the counties, or the states dissolved from them, colored for the view
+    artists = {
+        'ax': ax,
+        'state_name': 'Country View',
+        'fips': data['county_fips'].to_numpy(),
+        'paths': paths,
+        'counties': None,
+        'states': None,
+        'color_legend': None
+    }
+    show_country_layer(artists, country_layer(paths, data, attribute, view, bins, rollups))
+
     # Set axis settings
     plt.xlabel("Longitude", size=16)
     plt.ylabel("Latitude", size=16)
 
+    # Hover tooltips for the county under the cursor
+    picker = HoverPicker(ax, index, tooltip_texts(data), history=history)
 
-def state_view(data: pd.DataFrame, ax: axes.Axes, state_name: str, attribute: str, secondary: str):
-    # Create state and county Geoframes, set up data
-    color_key = constants.MAP_ATTRIBUTES[attribute]
+    artists['picker'] = picker
+    artists['dynamic'] = [artists['layer'], artists['color_legend'], picker.annotation]
+    return artists
+
+
+@profiling.timed()
+def prepare_country_view(artists: dict, data: pd.DataFrame, attribute: str, view: str,
+                         bins: BinCache = None, rollups: Rollups = None) -> dict:
+    data = align(data, artists['fips'])
+    prepared = country_layer(artists['paths'], data, attribute, view, bins, rollups)
+    prepared['tooltips'] = tooltip_texts(data)
+    return prepared
+
+
+def apply_country_view(artists: dict, prepared: dict) -> None:
+    # Only the face colors change, the paths stay in the collections
+    show_country_layer(artists, prepared)
+
+    artists['picker'].set_tooltips(prepared['tooltips'])
+    artists['dynamic'] = [artists['layer'], artists['color_legend'], artists['picker'].annotation]
+
+
+def country_layer(paths: PathLevels, data: pd.DataFrame, attribute: str, view: str,
+                  bins: BinCache = None, rollups: Rollups = None) -> dict:
+    # Colors of the counties (County view) or of the dissolved states (State view) for data, and
+    # the entries of their color legend
+    if view == 'State':
+        colors, color_bins, national = state_colors(data, attribute, paths, bins, rollups)
+        title = f'{attribute}\nNational: {round(national, 2)}'
+    else:
+        colors, color_bins = county_colors(data, attribute, bins)
+        title = attribute
+    return {'view': view, 'colors': colors, 'color_legend': legend_entries(color_bins, title)}
+
+
+def show_country_layer(artists: dict, layer: dict) -> None:
+    # Color the layer of country_layer() and show only that one. Each layer is drawn on first
+    # use, then recolored.
+    ax = artists['ax']
+    paths = artists['paths']
+    if layer['view'] == 'State':
+        if artists['states'] is None:
+            artists['states'] = state_collection(ax, paths, edgecolor=(0, 0, 0, 0.5), facecolor=layer['colors'])
+        else:
+            artists['states'].set_facecolor(layer['colors'])
+        shown, hidden = artists['states'], artists['counties']
+    else:
+        if artists['counties'] is None:
+            artists['counties'] = county_collection(ax, paths, artists['fips'],
+                                                    edgecolor=(0, 0, 0, 0.35),
+                                                    facecolor=layer['colors'])
+        else:
+            artists['counties'].set_facecolor(layer['colors'])
+        shown, hidden = artists['counties'], artists['states']
+
+    shown.set_visible(True)
+    if hidden is not None:
+        hidden.set_visible(False)
+    artists['layer'] = shown
+
+    remove_legend(ax, artists['color_legend'])
+    artists['color_legend'] = color_legend(ax, layer['color_legend'], loc='lower right')
+
+
+@profiling.timed()
+def state_view(data: pd.DataFrame, ax: axes.Axes, state_name: str, attribute: str, secondary: str,
+               paths: PathLevels, index: CountyIndex, bins: BinCache = None,
+               history: CountyHistory = None) -> dict:
+    # State zoom setup. Set the extent first, the level of detail of the county paths depends on it
+    minx, miny, maxx, maxy = paths.store.state_bounds(data.loc[data['state'] == state_name, 'county_fips'])
 
-    county_series = gpd.GeoSeries(data['county_boundary'])
-    data['county_point'] = county_series.centroid
+    if state_name == 'Alaska':
+        maxx = -130
+    ax.set_xlim(minx - 2, maxx + 2)
+    ax.set_ylim(miny - 2, maxy + 2)
 
-    data_else = data.loc[data['state'] != state_name, :]
+    # Create state and county Geoframes, set up data. Only the background counties
+    # intersecting the visible extent are drawn.
+    visible = index.query_extent(minx - 2, miny - 2, maxx + 2, maxy + 2)
+    data_else = data.loc[(data['state'] != state_name) & data['county_fips'].isin(visible), :]
     data_state = data.loc[data['state'] == state_name, :]
     data_state.reset_index(inplace=True, drop=True)
-    data_counties = data_state.copy()
 
     # Create color map
-    data_counties['RANGES'] = pd.qcut(data_counties[color_key], q=constants.BINS[attribute] - 1,
-                                   duplicates='drop', precision=2)
-    data_counties.sort_values(by='RANGES', inplace=True)
+    data_counties, color_bins = state_counties(data_state, state_name, attribute, bins)
 
-    intervals_array = data_counties['RANGES'].unique().__array__()
-    for idx, interval in enumerate(intervals_array):
-        if isinstance(interval, float):
-            if math.isnan(interval):
-                intervals_array = np.delete(intervals_array, idx)
+    with profiling.span('map.geodataframe'):
+        county_points = GeoDataFrame(data_counties, geometry=data_counties['county_point'])
 
-    intervals_array.sort()
-    intervals = list(str(group) for group in intervals_array)
+    # Plot Boundaries
+    county_collection(ax, paths, data_else['county_fips'],
+                      edgecolor=(0, 0, 0, 0.35),
+                      facecolor='lightgray')
 
-    colors = palettes.cividis(len(intervals))
-    color_map = {str(intervals[i]): colors[i] for i in range(len(intervals))}
-    color_map['nan'] = 'lightgray'
+    county_collection(ax, paths, data_state['county_fips'],
+                      edgecolor=(0, 0, 0, 0.5),
+                      facecolor='lightsteelblue')
 
-    county_boundaries_else = GeoDataFrame(data_else, geometry=data_else['county_boundary'])
-    county_boundaries_state = GeoDataFrame(data_state, geometry=data_state['county_boundary'])
-    county_points = GeoDataFrame(data_counties, geometry=data_counties['county_point'])
+    # Plot Points and Process Size Attribute
+    size = point_sizes(data_counties, secondary)
 
-    # Plot Boundaries
-    county_boundaries_else.plot(ax=ax,
-                                edgecolor=(0, 0, 0, 0.35),
-                                color='lightgray')
+    with profiling.span('map.plot_points'):
+        county_points.plot(ax=ax,
+                           markersize=size,
+                           color=color_bins.colors(data_counties[constants.MAP_ATTRIBUTES[attribute]]))
+    points = ax.collections[-1]
 
-    county_boundaries_state.plot(ax=ax,
-                                 edgecolor=(0, 0, 0, 0.5),
-                                 color='lightsteelblue')
+    # Legends
+    legend1 = color_legend(ax, legend_entries(color_bins, attribute), loc='upper right', borderaxespad=0)
+    legend2 = secondary_legend(ax, secondary_entries(data_counties, secondary))
 
-    # Plot Points and Process Size Attribute
+    # Set axis settings
+    plt.xlabel("Longitude", size=16)
+    plt.ylabel("Latitude", size=16)
+
+    # Hover tooltips for the county points (and boundaries) of the state
+    picker = HoverPicker(ax, index, tooltip_texts(data_counties), points=True, history=history)
+
+    return {
+        'ax': ax,
+        'state_name': state_name,
+        'fips': data_counties['county_fips'].to_numpy(),
+        'data': data_counties,
+        'points': points,
+        'color_legend': legend1,
+        'secondary_legend': legend2,
+        'picker': picker,
+        'dynamic': [artist for artist in [points, legend1, legend2, picker.annotation] if artist is not None]
+    }
+
+
+@profiling.timed()
+def prepare_state_view(artists: dict, data: pd.DataFrame, attribute: str, secondary: str,
+                       bins: BinCache = None) -> dict:
+    data_state = data.loc[data['state'] == artists['state_name'], :].reset_index(drop=True)
+
+    data_counties, color_bins = state_counties(data_state, artists['state_name'], attribute, bins)
+
+    # Keep the point order of the retained collection (and of the hover lookup)
+    data_counties = align(data_counties, artists['fips'])
+    size = point_sizes(data_counties, secondary)
+
+    return {
+        'data': data_counties,
+        'colors': color_bins.colors(data_counties[constants.MAP_ATTRIBUTES[attribute]]),
+        'sizes': np.atleast_1d(np.asarray(size, dtype=float)),
+        'color_legend': legend_entries(color_bins, attribute),
+        'secondary_legend': secondary_entries(data_counties, secondary),
+        'tooltips': tooltip_texts(data_counties)
+    }
+
+
+def apply_state_view(artists: dict, prepared: dict) -> None:
+    ax = artists['ax']
+    points = artists['points']
+    points.set_color(prepared['colors'])
+    points.set_sizes(prepared['sizes'])
+    artists['data'] = prepared['data']
+
+    remove_legend(ax, artists['color_legend'])
+    remove_legend(ax, artists['secondary_legend'])
+    legend1 = color_legend(ax, prepared['color_legend'], loc='upper right', borderaxespad=0)
+    legend2 = secondary_legend(ax, prepared['secondary_legend'])
+
+    artists['color_legend'] = legend1
+    artists['secondary_legend'] = legend2
+    artists['picker'].set_tooltips(prepared['tooltips'])
+    artists['dynamic'] = [artist for artist in [points, legend1, legend2, artists['picker'].annotation]
+                          if artist is not None]
+
+
+@profiling.timed()
+def tooltip_texts(data: pd.DataFrame) -> pd.Series:
+    # Hover text of every county, indexed by FIPS. Built with column-wise string operations once
+    # per redraw so that hovering is a single lookup.
+    def line(label: str, values: pd.Series, show: pd.Series) -> pd.Series:
+        return (label + ': ' + values.astype(str) + '\n').where(show, '')
+
+    hesitant = data['percent_strongly_hesitant'] + data['percent_hesitant']
+    unvaccinated = 1 - data['percent_vaccinated']
+
+    texts = line('County Name', data['county'], data['county'].notna() & (data['county'] != '')) \
+        + line('State', data['state'], data['state'].notna() & (data['state'] != '')) \
+        + line('Population', data['county_population'].fillna(0).astype('int64'),
+               data['county_population'].notna()) \
+        + line('Percent Hesitant + Percent Strongly Hesitant',
+               np.floor(hesitant.fillna(0) * 100).astype(int).astype(str) + '%', hesitant.notna()) \
+        + line('Percent Unvaccinated',
+               np.floor(unvaccinated.fillna(0) * 100).astype(int).astype(str) + '%', unvaccinated.notna()) \
+        + line('Community Level', data['community_level'],
+               data['community_level'].notna() & (data['community_level'] != '')) \
+        + line('Cases per 100k People', data['cases_100k'], data['cases_100k'].notna())
+
+    return pd.Series(texts.str.rstrip('\n').to_numpy(), index=data['county_fips'].to_numpy())
+
+
+def county_colors(data: pd.DataFrame, attribute: str, bins: BinCache = None) -> (np.ndarray, QuantileBins):
+    values = data[constants.MAP_ATTRIBUTES[attribute]].to_numpy()
+    with profiling.span('map.bins'):
+        color_bins = quantile_bins(values, constants.BINS[attribute], bins, attribute, 'County', report_date(data))
+    return color_bins.colors(values), color_bins
+
+
+def state_values(data: pd.DataFrame, attribute: str, rollups: Rollups = None) -> (pd.Series, float):
+    # Population weighted means of the states of data (state -> mean) and of the country, from
+    # the precomputed rollups or, for a date they do not have, rolled up from data
+    column = constants.MAP_ATTRIBUTES[attribute]
+    date = report_date(data)
+    if rollups is None or date not in rollups.national_means.index:
+        rollups = rollups_of(*weighted_sums(data))
+    states = data['state'].dropna().unique()
+    return rollups.states(date, column).reindex(np.asarray(states, dtype=str)), rollups.national(date, column)
+
+
+def state_bins(data: pd.DataFrame, attribute: str, bins: BinCache = None,
+               rollups: Rollups = None) -> (pd.Series, float, QuantileBins):
+    # Means of the states and of the country, and the quantile bins of the state means
+    values, national = state_values(data, attribute, rollups)
+    with profiling.span('map.bins'):
+        color_bins = quantile_bins(values.to_numpy(dtype=np.float64), constants.BINS[attribute], bins, attribute,
+                                   'State', report_date(data))
+    return values, national, color_bins
+
+
+def state_colors(data: pd.DataFrame, attribute: str, paths: PathLevels, bins: BinCache = None,
+                 rollups: Rollups = None) -> (np.ndarray, QuantileBins, float):
+    # Color of every dissolved state of paths (light gray without counties in data) and the
+    # national mean
+    values, national, color_bins = state_bins(data, attribute, bins, rollups)
+
+    # Dissolved state of every county of data, which takes the mean of the county's state
+    store = paths.store
+    rows = store.fips.get_indexer(data['county_fips'].to_numpy())
+    county_values = values.reindex(data['state'].astype(str)).to_numpy()
+    known = (rows >= 0) & data['state'].notna().to_numpy()
+    shape_values = np.full(len(store.states[2]) - 1, np.nan)
+    shape_values[store.county_state[rows[known]]] = county_values[known]
+    return color_bins.colors(shape_values), color_bins, national
+
+
+def warm_bins(data: pd.DataFrame, bins: BinCache, rollups: Rollups = None) -> None:
+    # Compute the bins of the national views of every attribute for the date of data ahead of
+    # time, e.g. for a report date added while the window is open
+    for attribute in constants.MAP_ATTRIBUTES:
+        county_colors(data, attribute, bins)
+        state_bins(data, attribute, bins, rollups)
+
+
+def state_counties(data_state: pd.DataFrame, state_name: str, attribute: str,
+                   bins: BinCache = None) -> (pd.DataFrame, QuantileBins):
+    color_key = constants.MAP_ATTRIBUTES[attribute]
+    values = data_state[color_key].to_numpy()
+
+    with profiling.span('map.bins'):
+        color_bins = quantile_bins(values, constants.BINS[attribute] - 1, bins, attribute, state_name,
+                                   report_date(data_state))
+
+    # Counties of the higher bins are drawn last (on top), counties without a value after all
+    codes = color_bins.codes(values)
+    order = np.argsort(np.where(codes < 0, len(color_bins.edges), codes), kind='stable')
+    data_counties = data_state.take(order)
+    return data_counties, color_bins
+
+
+def report_date(data: pd.DataFrame):
+    # Report date of a single date frame, the date key of the cached bins. Aligned frames can
+    # start with a county missing from the date.
+    if 'date_updated' not in data.columns:
+        return None
+    dates = data['date_updated'].dropna()
+    return dates.iat[0] if len(dates) else None
+
+
+def point_sizes(data_counties: pd.DataFrame, secondary: str):
     size = 65
     secondary_attribute = constants.SECONDARY_MAP_ATTRIBUTES[secondary]
     if secondary != 'None':
-        data_counties[secondary_attribute].fillna(0, inplace=True)
+        data_counties[secondary_attribute] = data_counties[secondary_attribute].fillna(0)
         size_unscaled = data_counties[secondary_attribute]
 
         # Configure Scaling
@@ -139,102 +385,116 @@ def state_view(data: pd.DataFrame, ax: axes.Axes, state_name: str, attribute: st
         s_max = size_unscaled.max()
         size = ((size_unscaled - s_min) / (s_max - s_min)) * 100
         size[size < 5] = 5
+    return size
 
-    county_points.plot(ax=ax,
-                       markersize=size,
-                       color=[color_map[str(key)] for key in data_counties['RANGES']])
 
-    # Legends
-    color_handles = [Line2D([0], [0], color=color_map[interval],
-                            marker='o', linestyle='none') for interval in intervals]
-    color_labels = [interval for interval in intervals]
+def legend_entries(color_bins: QuantileBins, title: str) -> dict:
+    # Handles, labels and title of the color legend of color_bins. The handles are not added to
+    # any axes, so they can be made off the Qt main thread.
+    color_handles = [Line2D([0], [0], color=color,
+                            marker='o', linestyle='none') for color in color_bins.palette[:-1]]
+    color_labels = list(color_bins.labels)
     color_labels[0] = '(0, ' + color_labels[0][color_labels[0].index(',') + 1:]
+    return {'handles': color_handles, 'labels': color_labels, 'title': title}
 
-    legend1 = plt.legend(handles=color_handles,
-                         labels=color_labels,
-                         title=attribute,
-                         loc='upper right',
-                         borderaxespad=0)
+
+@profiling.timed()
+def color_legend(ax: axes.Axes, entries: dict, **kwargs):
+    legend1 = ax.legend(handles=entries['handles'],
+                        labels=entries['labels'],
+                        title=entries['title'],
+                        **kwargs)
 
     for handle in legend1.legendHandles:
         handle._sizes = [50]
 
     ax.add_artist(legend1)
+    return legend1
 
-    if secondary != 'None':
-        size_unscaled = data_counties[secondary_attribute]
-        size_unscaled.fillna(0)
-        s_min = size_unscaled.min()
-        s_max = size_unscaled.max()
 
-        median = math.floor(len(data_counties[secondary_attribute]) / 2)
-        label_sizes = np.array([round(data_counties[secondary_attribute].max(), 2),
-                                round(sorted(data_counties[secondary_attribute])[median], 2),
-                                round(max(data_counties[secondary_attribute].min(), 0.01), 2)])
+def secondary_entries(data_counties: pd.DataFrame, secondary: str):
+    # Handles, labels, title and marker sizes of the secondary attribute legend, None without one
+    if secondary == 'None':
+        return None
 
-        label_sizes_scales = ((label_sizes - s_min) / (s_max - s_min)) * 100
+    secondary_attribute = constants.SECONDARY_MAP_ATTRIBUTES[secondary]
+    size_unscaled = data_counties[secondary_attribute]
+    size_unscaled.fillna(0)
+    s_min = size_unscaled.min()
+    s_max = size_unscaled.max()
 
-        size_handles = [Line2D([0], [0], color='gray',
-                               marker='o', markersize=np.sqrt(size), linestyle='none') for size in label_sizes_scales]
+    median = math.floor(len(data_counties[secondary_attribute]) / 2)
+    label_sizes = np.array([round(float(data_counties[secondary_attribute].max()), 2),
+                            round(float(np.partition(size_unscaled.to_numpy(), median)[median]), 2),
+                            round(max(float(data_counties[secondary_attribute].min()), 0.01), 2)])
 
-        legend2 = plt.legend(handles=size_handles,
-                             labels=list(label_sizes),
-                             title=secondary,
-                             loc='lower right',
-                             labelspacing=2,
-                             borderaxespad=0)
+    label_sizes_scales = ((label_sizes - s_min) / (s_max - s_min)) * 100
 
-        for idx, handle in enumerate(legend2.legendHandles):
-            handle._sizes = [max(label_sizes_scales[idx], 0.01)]
+    size_handles = [Line2D([0], [0], color='gray',
+                           marker='o', markersize=np.sqrt(size), linestyle='none') for size in label_sizes_scales]
+    return {'handles': size_handles, 'labels': list(label_sizes), 'title': secondary, 'sizes': label_sizes_scales}
 
-        ax.add_artist(legend2)
 
-    # State zoom setup
-    state_boundary = gpd.GeoSeries(data.loc[data['state'] == state_name, 'state_boundary'])
-    minx, miny, maxx, maxy = state_boundary.total_bounds
+@profiling.timed()
+def secondary_legend(ax: axes.Axes, entries: dict):
+    if entries is None:
+        return None
 
-    if state_name == 'Alaska':
-        maxx = -130
-    ax.set_xlim(minx - 2, maxx + 2)
-    ax.set_ylim(miny - 2, maxy + 2)
+    legend2 = ax.legend(handles=entries['handles'],
+                        labels=entries['labels'],
+                        title=entries['title'],
+                        loc='lower right',
+                        labelspacing=2,
+                        borderaxespad=0)
+
+    for idx, handle in enumerate(legend2.legendHandles):
+        handle._sizes = [max(entries['sizes'][idx], 0.01)]
+
+    ax.add_artist(legend2)
+    return legend2
 
-    # Set axis settings
-    plt.xlabel("Longitude", size=16)
-    plt.ylabel("Latitude", size=16)
 
-    # Set up cursor
-    cr = cursor(ax, hover=2, highlight=True)
+def remove_legend(ax: axes.Axes, legend) -> None:
+    if legend is None:
+        return
+    legend.remove()
+    if ax.legend_ is legend:
+        ax.legend_ = None
 
-    @cr.connect('add')
-    def cr_hover(sel):
-        if not isinstance(sel.artist, collections.PathCollection):
-            cr.remove_selection(sel)
-            return
 
-        selected = data_counties.iloc[sel.index, :]
-        annotation_dict = {}
+def align(data: pd.DataFrame, fips: np.ndarray) -> pd.DataFrame:
+    # Reorder rows to match the FIPS order of the retained artists. Counties missing from
+    # the new data keep their place with empty values (drawn light gray).
+    return data.set_index('county_fips').reindex(fips).reset_index()
 
-        if selected["county"]:
-            annotation_dict['County Name'] = f'{selected["county"]}'
 
-        if selected["state"]:
-            annotation_dict['State'] = f'{selected["state"]}'
+@profiling.timed()
+def county_collection(ax: axes.Axes, paths: PathLevels, fips, **kwargs) -> collections.PathCollection:
+    # Draw the cached county Paths for the given FIPS codes (Series or array) as one
+    # PathCollection, in that order, at the level of detail of the current axis extent. Changing
+    # the extent swaps the level.
+    fips = np.asarray(fips)
+    return level_collection(ax, paths, lambda tolerance: paths.level(tolerance).reindex(fips).to_list(), **kwargs)
 
-        if not np.isnan(selected["county_population"]):
-            annotation_dict['Population'] = f'{selected["county_population"]}'
 
-        if not np.isnan(selected["percent_strongly_hesitant"]) and not np.isnan(selected["percent_hesitant"]):
-            annotation_dict['Percent Hesitant + Percent Strongly Hesitant'] = \
-                f'{str(math.floor((selected["percent_strongly_hesitant"] + selected["percent_hesitant"]) * 100))}%'
+@profiling.timed()
+def state_collection(ax: axes.Axes, paths: PathLevels, **kwargs) -> collections.PathCollection:
+    # Draw every dissolved state as one PathCollection, in the order of the store's states table
+    return level_collection(ax, paths, paths.state_level, **kwargs)
 
-        if not np.isnan(selected["percent_vaccinated"]):
-            annotation_dict['Percent Unvaccinated'] = f'{str(math.floor((1 - selected["percent_vaccinated"]) * 100))}%'
 
-        if selected["community_level"]:
-            annotation_dict['Community Level'] = f'{str(selected["community_level"])}'
+def level_collection(ax: axes.Axes, paths: PathLevels, level_paths, **kwargs) -> collections.PathCollection:
+    # PathCollection of level_paths(tolerance) at the level of detail of the current axis extent
+    tolerance = paths.tolerance_for(ax)
+    collection = collections.PathCollection(level_paths(tolerance), **kwargs)
+    ax.add_collection(collection, autolim=False)
 
-        if not np.isnan(selected["cases_100k"]):
-            annotation_dict['Cases per 100k People'] = f'{str(selected["cases_100k"])}'
+    def on_limits_changed(changed_ax):
+        nonlocal tolerance
+        if paths.tolerance_for(changed_ax) != tolerance:
+            tolerance = paths.tolerance_for(changed_ax)
+            collection.set_paths(level_paths(tolerance))
 
-        sel.annotation.set_text('\n'.join([f'{k}: {v}' for k, v in annotation_dict.items()]))
-        sel.annotation.set(bbox=dict(facecolor=mplcolors.to_rgba('yellow')[:-1] + (1.0,)))
+    ax.callbacks.connect('xlim_changed', on_limits_changed)
+    ax.callbacks.connect('ylim_changed', on_limits_changed)
+    return collection
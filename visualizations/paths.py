@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from matplotlib import axes
+from matplotlib.path import Path
+
+from .coordinates import CoordinateStore
+
+# Simplification tolerances (in degrees) of the levels of detail, full resolution first.
+# The renderer picks the coarsest level whose tolerance is still below one screen pixel, so the
+# national view draws a fraction of the vertices while zoomed state views stay exact.
+LOD_TOLERANCES = [0.0, 0.002, 0.01, 0.03]
+
+
+class PathLevels:
+    # Matplotlib Paths for every county boundary at each level of detail, indexed by FIPS.
+    # The coordinates live in a CoordinateStore (memory-mapped when given a cache directory), each
+    # Path is a zero-copy slice of it. A level is simplified and converted once, on first use,
+    # then reused for every redraw. The states dissolved from the counties have levels of their own.
+
+    def __init__(self, geometry_df: pd.DataFrame, column: str = 'county_boundary',
+                 tolerances: list = LOD_TOLERANCES, cache_dir: str = None):
+        self.store = CoordinateStore(geometry_df, column, cache_dir=cache_dir)
+        self.tolerances = sorted(tolerances)
+        self.levels = {}
+        self.state_levels = {}
+
+    def level(self, tolerance: float) -> pd.Series:
+        if tolerance not in self.levels:
+            self.levels[tolerance] = pd.Series(table_paths(*self.store.level(tolerance)), index=self.store.fips,
+                                               dtype=object)
+        return self.levels[tolerance]
+
+    def state_level(self, tolerance: float) -> list:
+        # Paths of the dissolved states, in the order of the store's states table
+        if tolerance not in self.state_levels:
+            self.state_levels[tolerance] = table_paths(*self.store.state_level(tolerance))
+        return self.state_levels[tolerance]
+
+    def dissolve(self) -> None:
+        # Dissolve the states at every level of detail ahead of the first State by State view
+        for tolerance in self.tolerances:
+            self.store.state_level(tolerance)
+
+    def tolerance_for(self, ax: axes.Axes) -> float:
+        # Size of one screen pixel in data units at the current axis extent
+        bbox = ax.get_window_extent()
+        x_min, x_max = ax.get_xlim()
+        y_min, y_max = ax.get_ylim()
+        pixel = min(abs(x_max - x_min) / max(bbox.width, 1), abs(y_max - y_min) / max(bbox.height, 1))
+        return max([tolerance for tolerance in self.tolerances if tolerance <= pixel], default=self.tolerances[0])
+
+
+def table_paths(coords: np.ndarray, codes: np.ndarray, offsets: np.ndarray) -> list:
+    # Paths of a flat table, as views into its coordinate and code arrays (no vertices are copied)
+    return [Path(coords[start:stop], codes[start:stop]) for start, stop in zip(offsets[:-1], offsets[1:])]
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from matplotlib import axes
+from matplotlib import colors as mplcolors
+
+from .spatial import CountyIndex
+
+# Distance in pixels from a county point within which hovering selects it
+POINT_RADIUS = 8
+
+
+class HoverPicker:
+    # Hover tooltips for the map views. The mouse position is resolved to a FIPS code through the
+    # county spatial index (points first, then the boundary under the cursor) and the text comes
+    # from a per-FIPS table built once per redraw, instead of hit testing every artist on the axes.
+    # With a history.CountyHistory the tooltip also shows the county's history as sparklines.
+    # The tooltip annotation is a dynamic artist, redraw is called whenever it changes.
+
+    def __init__(self, ax: axes.Axes, index: CountyIndex, tooltips: pd.Series, points: bool = False,
+                 history=None):
+        self.ax = ax
+        self.index = index
+        self.tooltips = tooltips
+        self.points = points
+        self.history = history
+        self.fips = None
+        self.redraw = ax.figure.canvas.draw_idle
+
+        self.annotation = ax.annotate('', xy=(0, 0), xytext=(15, 15), textcoords='offset points',
+                                      bbox=dict(facecolor=mplcolors.to_rgba('yellow')[:-1] + (1.0,)),
+                                      arrowprops=dict(arrowstyle='->'), zorder=10)
+        self.annotation.set_visible(False)
+        self.cid = ax.figure.canvas.mpl_connect('motion_notify_event', self.on_move)
+
+    def pick(self, x: float, y: float):
+        if self.points:
+            # Pixel radius in data units at the current extent
+            origin, corner = self.ax.transData.inverted().transform([(0, 0), (POINT_RADIUS, POINT_RADIUS)])
+            fips = self.index.nearest(x, y, max_distance=np.abs(corner - origin).max())
+            if fips in self.tooltips.index:
+                return fips
+
+        fips = self.index.locate(x, y)
+        return fips if fips in self.tooltips.index else None
+
+    def text(self, fips) -> str:
+        if self.history is None:
+            return self.tooltips[fips]
+        return '\n'.join(line for line in [self.tooltips[fips], self.history.sparklines(fips)] if line)
+
+    def set_tooltips(self, tooltips: pd.Series) -> None:
+        # New data for the same counties: refresh the text of the open tooltip
+        self.tooltips = tooltips
+        if self.fips is not None and self.fips in tooltips.index:
+            self.annotation.set_text(self.text(self.fips))
+        else:
+            self.hide()
+
+    def set_history(self, history) -> None:
+        self.history = history
+        if self.fips is not None:
+            self.annotation.set_text(self.text(self.fips))
+
+    def hide(self) -> None:
+        self.fips = None
+        self.annotation.set_visible(False)
+
+    def on_move(self, event):
+        # The figure was rebuilt without these axes: stop listening
+        if self.ax not in self.ax.figure.axes:
+            event.canvas.mpl_disconnect(self.cid)
+            return
+
+        fips = None
+        if event.inaxes is self.ax and event.xdata is not None:
+            fips = self.pick(event.xdata, event.ydata)
+
+        if fips == self.fips:
+            return
+
+        if fips is None:
+            self.hide()
+        else:
+            self.fips = fips
+            self.annotation.xy = self.index.point(fips) if self.points else (event.xdata, event.ydata)
+            self.annotation.set_text(self.text(fips))
+            self.annotation.set_visible(True)
+        self.redraw()
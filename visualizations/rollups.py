@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+import profiling
+from . import constants
+
+# Columns rolled up: every attribute the map colors by
+ROLLUP_COLUMNS = list(dict.fromkeys(constants.MAP_ATTRIBUTES.values()))
+
+
+class Rollups:
+    # Population weighted means of the map attributes for every state and for the whole country by
+    # report date: state_means is indexed by (date, state), national_means by date, both with one
+    # column per attribute. A state's value is the mean of its counties weighted by their
+    # population, counties without a value or a population left out; NaN if none has both.
+
+    def __init__(self, state_means: pd.DataFrame, national_means: pd.DataFrame):
+        self.state_means = state_means
+        self.national_means = national_means
+
+    def states(self, date: str, column: str) -> pd.Series:
+        # State -> weighted mean of a column on a report date, empty if the date is not rolled up
+        if date not in self.national_means.index:
+            return pd.Series(dtype=np.float64)
+        return self.state_means.loc[date, column]
+
+    def national(self, date: str, column: str) -> float:
+        if date not in self.national_means.index:
+            return np.nan
+        return float(self.national_means.at[date, column])
+
+
+@profiling.timed()
+def build_rollups(community_data: pd.DataFrame, hesitancy_df: pd.DataFrame, database=None) -> Rollups:
+    # Roll up every report of community_data (or the database) joined with the counties of
+    # hesitancy_df, for every date and attribute in one pass
+    if database is not None:
+        sums, weights = database.weighted_sums(ROLLUP_COLUMNS)
+    else:
+        sums, weights = weighted_sums(join(community_data, hesitancy_df))
+    return rollups_of(sums, weights)
+
+
+@profiling.timed()
+def extend_rollups(rollups: Rollups, date_reports: pd.DataFrame, hesitancy_df: pd.DataFrame,
+                   database=None) -> Rollups:
+    # Rollups with the report dates of date_reports rolled up (again), from every report of those
+    # dates: date_reports in memory, the database otherwise (where only its dates are used). A date
+    # is rolled up from its own reports only, so the other dates do not change.
+    if database is not None:
+        sums, weights = database.weighted_sums(ROLLUP_COLUMNS, list(date_reports['date_updated'].dropna().unique()))
+    else:
+        sums, weights = weighted_sums(join(date_reports, hesitancy_df))
+    added = rollups_of(sums, weights)
+
+    dates = rollups.national_means.index.difference(added.national_means.index)
+    state_means = rollups.state_means.loc[rollups.state_means.index.get_level_values(0).isin(dates), :]
+    return Rollups(pd.concat([state_means, added.state_means]).sort_index(),
+                   pd.concat([rollups.national_means.loc[dates, :], added.national_means]).sort_index())
+
+
+def join(community_data: pd.DataFrame, hesitancy_df: pd.DataFrame) -> pd.DataFrame:
+    # Reports with the hesitancy columns rolled up, only for the counties of hesitancy_df
+    community_columns = [column for column in ROLLUP_COLUMNS if column in community_data]
+    hesitancy_columns = [column for column in ROLLUP_COLUMNS if column not in community_data]
+    return community_data[['date_updated', 'state', 'county_population', *community_columns]].join(
+        hesitancy_df[hesitancy_columns], how='inner')
+
+
+def weighted_sums(data: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    # Sums of population * value and of the population of the counties with a value, by
+    # (date, state) and column. Every (date, state) pair is a bin of one bincount per column.
+    population = data['county_population'].to_numpy(dtype=np.float64)
+    values = data[ROLLUP_COLUMNS].to_numpy(dtype=np.float64)
+    present = ~np.isnan(values) & ~np.isnan(population)[:, None]
+    weights = np.where(present, population[:, None], 0)
+    weighted = np.where(present, values * population[:, None], 0)
+
+    dates = data['date_updated'].astype('category').cat
+    states = data['state'].astype('category').cat
+    date_codes, state_codes = dates.codes.to_numpy(), states.codes.to_numpy()
+    keep = (date_codes >= 0) & (state_codes >= 0)
+    keys = date_codes[keep].astype(np.int64) * len(states.categories) + state_codes[keep]
+    size = len(dates.categories) * len(states.categories)
+
+    # Only the (date, state) pairs that have reports
+    reported = np.bincount(keys, minlength=size) > 0
+    index = pd.MultiIndex.from_product([dates.categories.astype(str), states.categories.astype(str)])[reported]
+
+    def sums(columns: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(np.column_stack([np.bincount(keys, columns[keep, i], minlength=size)[reported]
+                                             for i in range(len(ROLLUP_COLUMNS))]),
+                            index=index, columns=ROLLUP_COLUMNS)
+    return sums(weighted), sums(weights)
+
+
+def rollups_of(sums: pd.DataFrame, weights: pd.DataFrame) -> Rollups:
+    # Weighted means from the sums of weighted_sums(), the country is the sum of its states
+    sums, weights = sums.sort_index(), weights.sort_index()
+    state_means = sums / weights.where(weights > 0)
+    national_weights = weights.groupby(level=0).sum()
+    national_means = sums.groupby(level=0).sum() / national_weights.where(national_weights > 0)
+    return Rollups(state_means, national_means)
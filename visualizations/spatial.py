@@ -0,0 +1,39 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+
+class CountyIndex:
+    # Spatial index (shapely STRtree) over the county boundaries, indexed by FIPS. Built once at
+    # load so views can look up the counties in an extent without testing every polygon.
+
+    def __init__(self, geometry_df: pd.DataFrame, column: str = 'county_boundary'):
+        self.fips = geometry_df.index.to_numpy()
+        self.geometries = np.asarray(gpd.GeoSeries(geometry_df[column]))
+        self.tree = shapely.STRtree(self.geometries)
+
+        # County points (the markers of the state view), falling back to the boundary centroids
+        if 'county_point' in geometry_df:
+            self.points = np.asarray(gpd.GeoSeries(geometry_df['county_point']))
+        else:
+            self.points = shapely.centroid(self.geometries)
+        self.point_tree = shapely.STRtree(self.points)
+
+    def query_extent(self, x_min: float, y_min: float, x_max: float, y_max: float) -> np.ndarray:
+        # FIPS codes of the counties whose bounding boxes intersect the extent
+        return self.fips[np.sort(self.tree.query(shapely.box(x_min, y_min, x_max, y_max)))]
+
+    def locate(self, x: float, y: float):
+        # FIPS code of the county whose boundary contains the point, or None
+        hits = self.tree.query(shapely.points(x, y), predicate='intersects')
+        return self.fips[hits.min()] if len(hits) else None
+
+    def nearest(self, x: float, y: float, max_distance: float):
+        # FIPS code of the county with the closest center point within max_distance, or None
+        hits = self.point_tree.query_nearest(shapely.points(x, y), max_distance=max_distance)
+        return self.fips[hits.min()] if len(hits) else None
+
+    def point(self, fips) -> (float, float):
+        point = self.points[np.flatnonzero(self.fips == fips)[0]]
+        return point.x, point.y
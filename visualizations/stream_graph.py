@@ -1,56 +1,147 @@
-import math
-
 import matplotlib.pyplot as plt
 from matplotlib import axes
-import pandas as pd
 import numpy as np
+import pandas as pd
 
+import profiling
 from . import constants
+from .binning import QuantileBins
+
+LEVEL_CATEGORIES = ['Low', 'Medium', 'High']
 
 
-def plot(community_data: pd.DataFrame, attribute: str, ax: axes.Axes):
-    label_dict = {}
+@profiling.timed()
+def aggregate(community_data: pd.DataFrame, attribute: str, report_dates: list = None,
+              database=None) -> pd.DataFrame:
+    # Count the counties in each level/interval of the attribute for every report date in one
+    # vectorized bincount. Rows are the report dates (by default those of dates_of()), columns
+    # are the legend labels. The community dataset is only read, never modified or re-sorted.
+    # With a preprocessing.database.ReportDatabase the counts are queried from it instead.
+    if database is not None:
+        return aggregate_query(database, attribute, report_dates)
+
     column = constants.STREAM_ATTRIBUTES[attribute]
+    dates = community_data['date_updated'].astype('category')
+
+    if attribute == 'Community Level':
+        levels = community_data[column].astype('category').cat
+        bins = levels.codes.to_numpy()
+        bin_labels = list(levels.categories)
+        labels = LEVEL_CATEGORIES
+    else:
+        values = community_data[column].to_numpy()
+        with profiling.span('stream_graph.bins'):
+            quantiles = QuantileBins(values, 6)
+        # Only the occupied bins have a label, renumber the others away
+        codes = quantiles.codes(values)
+        bins = quantiles.color_index[codes]
+        bin_labels = quantiles.labels
+        labels = bin_labels
+
+    # (date, bin) counts with one bincount over the combined codes, missing values (-1) dropped
+    date_codes = dates.cat.codes.to_numpy()
+    counted = (bins >= 0) & (date_codes >= 0)
+    counts = np.bincount(date_codes[counted].astype(np.int64) * len(bin_labels) + bins[counted],
+                         minlength=len(dates.cat.categories) * len(bin_labels))
+    counts = pd.DataFrame(counts.reshape(len(dates.cat.categories), len(bin_labels)),
+                          index=dates.cat.categories.astype(str), columns=bin_labels)
+    if report_dates is None:
+        report_dates = dates_of(community_data)
+    counts = counts.reindex(index=report_dates, columns=labels, fill_value=0)
+    counts.columns = [str(label) for label in labels]
+    return counts
 
+
+def aggregate_query(database, attribute: str, report_dates: list = None) -> pd.DataFrame:
+    # aggregate() over the reports of the database: (date, bin) counts are grouped in SQL, only
+    # the quantile edges need the values of the attribute in memory
+    column = constants.STREAM_ATTRIBUTES[attribute]
     if attribute == 'Community Level':
-        label_dict = {
-            'Low': list(),
-            'Medium': list(),
-            'High': list()
-        }
-
-        for date in constants.REPORT_DATES:
-            date_data = community_data.loc[community_data['date_updated'] == date, column]
-            label_dict['Low'].append(len(date_data[date_data == 'Low']))
-            label_dict['Medium'].append(len(date_data[date_data == 'Medium']))
-            label_dict['High'].append(len(date_data[date_data == 'High']))
+        counts = database.count_values(column)
+        labels = LEVEL_CATEGORIES
     else:
-        community_data['RANGES'] = pd.qcut(community_data[column], q=6,
-                                           duplicates='drop', precision=2)
-        community_data.sort_values(by='RANGES', inplace=True)
+        with profiling.span('stream_graph.bins'):
+            quantiles = QuantileBins(database.values(column), 6)
+        # Only the occupied bins have a label, drop the others
+        counts = database.count_bins(column, quantiles.edges)
+        counts = counts.loc[:, quantiles.color_index[:-1] >= 0]
+        counts.columns = quantiles.labels
+        labels = quantiles.labels
 
-        intervals_array = community_data['RANGES'].unique().__array__()
-        for idx, interval in enumerate(intervals_array):
-            if isinstance(interval, float):
-                if math.isnan(interval):
-                    intervals_array = np.delete(intervals_array, idx)
+    if report_dates is None:
+        report_dates = dates_of(database=database)
+    counts = counts.reindex(index=report_dates, columns=labels, fill_value=0)
+    counts.columns = [str(label) for label in labels]
+    return counts
 
-        intervals_array.sort()
-        intervals = list(str(group) for group in intervals_array)
 
-        label_dict = {interval: list() for interval in intervals}
+@profiling.timed()
+def build_cube(community_data: pd.DataFrame, database=None) -> dict:
+    # Precompute the (date, attribute, bin) count cube for every stream attribute so redraws
+    # only look up a table instead of rescanning the community dataset (or querying the database).
+    return {attribute: aggregate(community_data, attribute, database=database)
+            for attribute in constants.STREAM_ATTRIBUTES}
 
-        for date in constants.REPORT_DATES:
-            date_data = community_data.loc[community_data['date_updated'] == date, 'RANGES']
-            for interval in intervals_array:
-                label_dict[str(interval)].append(len(date_data[date_data == interval]))
 
-    ax.stackplot(constants.REPORT_DATES, label_dict.values(),
-                 labels=label_dict.keys(), alpha=0.8)
+@profiling.timed()
+def extend_cube(cube: dict, community_data: pd.DataFrame, new_reports: pd.DataFrame, database=None) -> dict:
+    # Cube of community_data (or the database) from the cube of the reports it had before
+    # new_reports were added. Community levels are counted for the new reports only, the counts
+    # of the earlier dates do not change. The other attributes are binned by quantiles over every
+    # report, which the new reports shift, so they are counted again in full.
+    report_dates = dates_of(community_data, database)
+    extended = {}
+    for attribute in constants.STREAM_ATTRIBUTES:
+        if attribute == 'Community Level' and attribute in cube:
+            counts = cube[attribute].reindex(report_dates, fill_value=0)
+            extended[attribute] = counts + aggregate(new_reports, attribute, report_dates).to_numpy()
+        else:
+            extended[attribute] = aggregate(community_data, attribute, report_dates, database)
+    return extended
+
+
+def dates_of(community_data: pd.DataFrame = None, database=None) -> list:
+    # constants.REPORT_DATES and any later report date the data (or database) has
+    if database is not None:
+        dates = database.dates()
+    else:
+        dates = community_data['date_updated'].astype('category').cat.categories.astype(str)
+    return sorted(set(constants.REPORT_DATES).union(dates))
+
+
+@profiling.timed()
+def plot(community_data: pd.DataFrame, attribute: str, ax: axes.Axes, cube: dict = None) -> dict:
+    artists = {'ax': ax, 'layers': [], 'dynamic': []}
+    stack(artists, community_data, attribute, cube)
 
-    ax.legend(loc='upper left')
     ax.set_xlabel('Report Date')
-    ax.set_ylabel(f'Number of Counties for each range of: {attribute}')
 
     plt.xticks(rotation=90)
     plt.tight_layout()
+    return artists
+
+
+@profiling.timed()
+def update(artists: dict, community_data: pd.DataFrame, attribute: str, cube: dict = None) -> None:
+    # Swap the stacked layers and legend for a new attribute, keeping the axes and layout
+    for layer in artists['layers']:
+        layer.remove()
+    if artists['ax'].legend_ is not None:
+        artists['ax'].legend_.remove()
+    stack(artists, community_data, attribute, cube)
+
+
+def stack(artists: dict, community_data: pd.DataFrame, attribute: str, cube: dict = None) -> None:
+    ax = artists['ax']
+    if cube is not None and attribute in cube:
+        counts = cube[attribute]
+    else:
+        counts = aggregate(community_data, attribute)
+
+    # Explicit colors so that re-stacking on the same axes starts from the first cycle color again
+    artists['layers'] = ax.stackplot(list(counts.index), counts.to_numpy().T,
+                                     labels=counts.columns, alpha=0.8,
+                                     colors=[f'C{i}' for i in range(len(counts.columns))])
+
+    ax.legend(loc='upper left')
+    ax.set_ylabel(f'Number of Counties for each range of: {attribute}')